@@ -0,0 +1,153 @@
+import asyncio
+import time
+from _sx126x import ERR_NONE
+from link_manager import EU868_SUB_BANDS
+
+# EU868 channels (MHz) over two 1% sub-bands: 865.0-868.0 and 868.0-868.6. They are
+# 200 kHz apart, so they only hold bandwidths up to 200 kHz
+EU868_CHANNELS = (867.1, 867.3, 867.5, 867.7, 867.9, 868.1, 868.3, 868.5)
+# The 1% sub-bands (MHz) wider channels are packed into
+HOP_SUB_BANDS = ((865.0, 868.0), (868.0, 868.6))
+
+def eu868_channels(bw):
+    # Channels (MHz) for bandwidth bw (kHz): the EU868 channels when they are wide enough,
+    # otherwise channels bw apart packed edge to edge into each of HOP_SUB_BANDS.
+    if bw <= 200:
+        return EU868_CHANNELS
+    width = bw / 1000
+    channels = []
+    for low, high in HOP_SUB_BANDS:
+        for i in range(int((high - low) / width + 1e-6)):
+            channels.append(round(low + (i + 0.5) * width, 4))
+    return tuple(channels)
+
+def _mix(x):
+    # 32-bit integer hash, the same on MicroPython and CPython.
+    x = ((x ^ (x >> 16)) * 0x45D9F3B) & 0xFFFFFFFF
+    x = ((x ^ (x >> 16)) * 0x45D9F3B) & 0xFFFFFFFF
+    return x ^ (x >> 16)
+
+class ChannelPlan:
+    # Frequency hopping plan: time is divided into slots of slot seconds, and each node has
+    # its own pseudo-random channel sequence keyed on its node ID (and the network seed).
+    # Every run of len(channels) slots visits each channel once, in an order shuffled per
+    # node and per run, so a node's traffic spreads evenly over the channels (and the
+    # sub-bands they fall in) and different nodes rarely share a channel in the same slot.
+    # Nodes agree on slots through their clocks, so every node needs the same time of day
+    # (boot.py sets the RTC from the GPS fix).
+    # Channels default to eu868_channels(bw). Each channel occupies bw (kHz) around its
+    # frequency, so the plan is rejected (ValueError) if two channels overlap or a channel
+    # does not fit whole inside one of sub_bands.
+    def __init__(self, channels=None, slot=30, seed=0, clock=time.time, bw=125.0,
+                 sub_bands=EU868_SUB_BANDS):
+        self.channels = tuple(channels) if channels is not None else eu868_channels(bw)
+        self.bw = bw
+        self._check(sub_bands)
+        self.slot = slot
+        self.seed = seed
+        self._clock = clock
+        # node_id -> (run, channel order), so the TX and RX sequences each keep their own
+        self._orders = {}
+
+    def _check(self, sub_bands):
+        if not self.channels:
+            raise ValueError("Channel plan has no channels")
+        half = self.bw / 2000
+        previous = None
+        for freq in sorted(self.channels):
+            low, high = freq - half, freq + half
+            if not any(band[0] - 1e-6 <= low and high <= band[1] + 1e-6 for band in sub_bands):
+                raise ValueError("Channel {} MHz at {} kHz does not fit in a sub-band".format(freq, self.bw))
+            if previous is not None and low < previous + half - 1e-6:
+                raise ValueError("Channels {} and {} MHz overlap at {} kHz".format(previous, freq, self.bw))
+            previous = freq
+
+    def slot_at(self, t=None):
+        return int((self._clock() if t is None else t) // self.slot)
+
+    def until_next_slot(self, t=None):
+        # Seconds until the next slot boundary.
+        t = self._clock() if t is None else t
+        return (self.slot_at(t) + 1) * self.slot - t
+
+    def order(self, node_id, run):
+        # Channel indices for node_id's run-th pass over the channels (Fisher-Yates shuffle).
+        cached = self._orders.get(node_id)
+        if cached is not None and cached[0] == run:
+            return cached[1]
+        order = list(range(len(self.channels)))
+        x = _mix(self.seed ^ (node_id << 20) ^ run)
+        for i in range(len(order) - 1, 0, -1):
+            x = _mix(x + i)
+            j = x % (i + 1)
+            order[i], order[j] = order[j], order[i]
+        self._orders[node_id] = (run, order)
+        return order
+
+    def channel(self, node_id, slot=None):
+        # Frequency (MHz) node_id uses in slot (the current slot by default).
+        if slot is None:
+            slot = self.slot_at()
+        run, position = divmod(slot, len(self.channels))
+        return self.channels[self.order(node_id, run)[position]]
+
+class FrequencyHopper:
+    # Keeps the radio on the plan: transmissions go out on this node's channel for the
+    # current slot, and in between the radio listens on the channel of the node it
+    # follows (its peer, whose transmissions it wants to hear). Retuning goes through
+    # the driver's apply(), which only writes the new frequency and skips image
+    # calibration while the channel stays in the same band, so a hop costs a single
+    # SetRfFrequency command.
+    # Until the clock is known to be right (synced), the radio stays on the frequency it
+    # was started with. While a sender holds the hopper (hold/release), run() leaves the
+    # radio on the channel the sender tuned it to. The radio's bandwidth must fit the plan's
+    # channels.
+    def __init__(self, radio, plan, node_id, follow=None, synced=True):
+        if radio.getProfile().bw > plan.bw:
+            raise ValueError("Radio bandwidth {} kHz is wider than the channel plan's {} kHz".format(
+                radio.getProfile().bw, plan.bw))
+        self.radio = radio
+        self.plan = plan
+        self.node_id = node_id
+        self.follow = follow if follow is not None else node_id
+        self.synced = synced
+        self.home = radio.getProfile().freq
+        self.holds = 0
+        self.hops = 0
+
+    def tx_frequency(self, t=None):
+        if not self.synced:
+            return self.home
+        return self.plan.channel(self.node_id, self.plan.slot_at(t))
+
+    def rx_frequency(self, t=None):
+        if not self.synced:
+            return self.home
+        return self.plan.channel(self.follow, self.plan.slot_at(t))
+
+    def hold(self):
+        self.holds += 1
+
+    def release(self):
+        self.holds -= 1
+
+    def until_next_slot(self):
+        return self.plan.until_next_slot()
+
+    async def tune(self, freq):
+        # Retune the radio to freq (MHz) if it is not already there. Returns the driver state.
+        profile = self.radio.getProfile()
+        if profile.freq == freq:
+            return ERR_NONE
+        state = await self.radio.apply(profile.copy(freq=freq))
+        if state == ERR_NONE:
+            self.hops += 1
+        return state
+
+    async def run(self):
+        # Receive side: follow the peer's channel from slot to slot. A sender holding the
+        # hopper retunes to the receive channel itself when it is done.
+        while True:
+            if not self.holds:
+                await self.tune(self.rx_frequency())
+            await asyncio.sleep(self.until_next_slot())
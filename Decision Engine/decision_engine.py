@@ -1,53 +1,287 @@
 from machine import RTC
+import heapq
+import json
+import struct
+import time
+
+# Urgency rules defined as data, so they can be tuned or loaded from a JSON config.
+# For each sensor type, 'default' is the urgency below the first breakpoint and every
+# breakpoint is [threshold, urgency, slope, inclusive]: from the threshold upwards the
+# urgency is urgency + slope * (value - threshold). slope defaults to 0.0 (piecewise-constant)
+# and inclusive to True; inclusive=False keeps the threshold itself in the previous segment,
+# i.e. a strict "value > threshold" comparison.
+DEFAULT_URGENCY_RULES = {
+    'temperature': {'default': 0.0, 'breakpoints': [[35.0, 0.6, 0.02, False], [55.0, 1.0]]},
+    'humidity': {'default': 0.4, 'breakpoints': [[20.0, 0.0]]},
+    'pressure': {'default': 0.2, 'breakpoints': [[1005.0, 0.0], [1025.0, 0.2, 0.0, False]]},
+    'battery_level': {'default': 1.0, 'breakpoints': [[5.0, 0.8], [10.0, 0.5], [15.0, 0.2], [20.0, 0.0]]},
+    'system_voltage': {'default': 0.3, 'breakpoints': [[3.0, 0.0]]},
+    'latitude': {'default': 0.2, 'breakpoints': [[-90.0, 0.0], [90.0, 0.2, 0.0, False]]},
+    'longitude': {'default': 0.2, 'breakpoints': [[-180.0, 0.0], [180.0, 0.2, 0.0, False]]},
+}
+
+def compile_urgency_rule(rule):
+    # Compile a rule into sorted parallel tuples for evaluate_urgency_rule().
+    breakpoints = sorted(rule.get('breakpoints', ()), key=lambda point: point[0])
+    thresholds = tuple(float(point[0]) for point in breakpoints)
+    urgencies = tuple(float(point[1]) for point in breakpoints)
+    slopes = tuple(float(point[2]) if len(point) > 2 else 0.0 for point in breakpoints)
+    inclusive = tuple(bool(point[3]) if len(point) > 3 else True for point in breakpoints)
+    return thresholds, urgencies, slopes, inclusive, float(rule.get('default', 0.0))
+
+def evaluate_urgency_rule(table, value):
+    # Binary search for the last threshold <= value, O(log n) in the number of breakpoints.
+    thresholds, urgencies, slopes, inclusive, default = table
+    lo = 0
+    hi = len(thresholds)
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if value < thresholds[mid]:
+            hi = mid
+        else:
+            lo = mid + 1
+    i = lo - 1
+    if i >= 0 and value == thresholds[i] and not inclusive[i]:
+        i -= 1
+    if i < 0:
+        return default
+    return urgencies[i] + slopes[i] * (value - thresholds[i])
+
+# Header fields are stored as small integer codes; the tables below give the readable
+# names, highest priority / most demanding class first.
+PRIORITY_HIGHEST = 0
+PRIORITY_HIGH = 1
+PRIORITY_MODERATE = 2
+PRIORITY_BEST_EFFORT = 3
+PRIORITY_LEVELS = ("Highest", "High", "Moderate", "Best Effort")
+
+TRAFFIC_CRITICAL = 0
+TRAFFIC_DATA_INTENSIVE = 1
+TRAFFIC_RELIABLE = 2
+TRAFFIC_STANDARD = 3
+TRAFFIC_TYPES = ("Critical", "Data Intensive", "Reliable", "Standard")
+
+QOS_GUARANTEED_DELIVERY = 0
+QOS_HIGH_BANDWIDTH = 1
+QOS_HIGH_RELIABILITY = 2
+QOS_STANDARD = 3
+QOS_LEVELS = ("Guaranteed Delivery", "High Bandwidth", "High Reliability", "Standard")
+
+RADIO_WIFI_LORA = 0
+RADIO_WIFI = 1
+RADIO_BLE = 2
+RADIO_LORA = 3
+RADIOS = ("WiFi/LoRa - range dependent", "WiFi", "BLE", "LoRa")
+
+class Classification:
+    # Result of a single classification pass, shared by Packetisation and classify_batch.
+    # priority, traffic_type, qos and radio are integer codes, see the *_name properties
+    # for their readable form.
+    __slots__ = ('urgency', 'importance', 'priority', 'traffic_type', 'qos', 'radio')
+
+    def __init__(self, urgency, importance, priority, traffic_type, qos, radio):
+        self.urgency = urgency
+        self.importance = importance
+        self.priority = priority
+        self.traffic_type = traffic_type
+        self.qos = qos
+        self.radio = radio
+
+    @property
+    def priority_name(self):
+        return PRIORITY_LEVELS[self.priority]
+
+    @property
+    def traffic_type_name(self):
+        return TRAFFIC_TYPES[self.traffic_type]
+
+    @property
+    def qos_name(self):
+        return QOS_LEVELS[self.qos]
+
+    @property
+    def radio_name(self):
+        return RADIOS[self.radio]
+
+    def __iter__(self):
+        # Allows the legacy "urgency, priority, traffic_type, qos, radio = classify_data(...)" unpacking
+        return iter((self.urgency, self.priority_name, self.traffic_type_name, self.qos_name, self.radio_name))
+
+    def __repr__(self):
+        return "Classification(urgency={}, importance={}, priority={}, traffic_type={}, qos={}, radio={})".format(
+            self.urgency, self.importance, self.priority_name, self.traffic_type_name, self.qos_name, self.radio_name)
+
+def encoded_size(data_type):
+    # Bytes the values of data_type take in the binary wire format (0 if it has no encoding).
+    # packet_codec imports this module, so it is only imported once packets are created.
+    from packet_codec import DATA_TYPES, DATA_TYPE_CODES
+    code = DATA_TYPE_CODES.get(data_type)
+    if code is None:
+        return 0
+    return struct.calcsize(DATA_TYPES[code][2])
 
 class Packetisation:
-    def __init__(self, sensor_id, sensor_data, data_type, decision_engine, payload, qos):
-        # Use the DecisionEngine to classify the sensor data automatically
-        urgency = decision_engine.calculate_urgency(sensor_data)
-        importance = decision_engine.calculate_importance(data_type)
-        urgency, priority, traffic_type, qos, radio = decision_engine.classify_data(sensor_data, data_type)
-        # Assuming payload is a byte array or string
-        data_size = len(payload)  
-        
-        # Initialize packet with automatically populated parameters
-        self.packet = {
+    # Compact packet: the header is kept as slots and integer codes, the readable nested
+    # dict is only built on demand by get_packet().
+    __slots__ = ('sensor_id', 'sensor_data', 'data_type', 'payload', 'data_size', 'timestamp', 'classification')
+
+    def __init__(self, sensor_id, sensor_data, data_type, decision_engine, payload, qos, classification=None):
+        # Use the DecisionEngine to classify the sensor data automatically, unless a
+        # result from classify_batch() is passed in
+        if classification is None:
+            classification = decision_engine.classify_data(sensor_data, data_type)
+        self.classification = classification
+        self.sensor_id = sensor_id
+        self.sensor_data = sensor_data
+        self.data_type = data_type
+        # Optional pre-encoded payload (byte array or string); the binary wire format in
+        # packet_codec encodes sensor_data directly and does not need one
+        self.payload = payload
+        self.data_size = len(payload) if payload is not None else encoded_size(data_type)
+        # Seconds since midnight, formatted only when requested
+        current_time = RTC().datetime()
+        self.timestamp = current_time[4] * 3600 + current_time[5] * 60 + current_time[6]
+
+    @property
+    def urgency(self):
+        return self.classification.urgency
+
+    @property
+    def importance(self):
+        return self.classification.importance
+
+    @property
+    def priority(self):
+        return self.classification.priority
+
+    @property
+    def traffic_type(self):
+        return self.classification.traffic_type
+
+    @property
+    def qos(self):
+        return self.classification.qos
+
+    @property
+    def radio(self):
+        return self.classification.radio
+
+    def get_timestamp(self):
+        # Get the packet timestamp as a readable string.
+        return "Time: {:02}:{:02}:{:02}".format(self.timestamp // 3600, (self.timestamp // 60) % 60, self.timestamp % 60)
+
+    def get_packet(self):
+        # Readable view of the packet, in the original nested dict layout.
+        classification = self.classification
+        return {
             'header': {
-                'sensor_id': sensor_id,
-                'urgency': urgency,
-                'importance': importance,
-                'data_type': data_type,
-                'data_size': data_size,
+                'sensor_id': self.sensor_id,
+                'urgency': classification.urgency,
+                'importance': classification.importance,
+                'data_type': self.data_type,
+                'data_size': self.data_size,
                 'timestamp': self.get_timestamp(),
-                'qos': qos,
-                'priority': priority,
-                'traffic_type': traffic_type,
-                'radio': radio
+                'qos': classification.qos_name,
+                'priority': classification.priority_name,
+                'traffic_type': classification.traffic_type_name,
+                'radio': classification.radio_name
             },
-            'payload': payload
+            'payload': self.payload
         }
 
-    def get_timestamp(self):
-        # Get the current timestamp.
-        rtc = RTC()
-        current_time = rtc.datetime()
-        time_string = "Time: {:02}:{:02}:{:02}".format(current_time[4], current_time[5], current_time[6])
-        return time_string
+    @property
+    def packet(self):
+        # Compatibility alias for code that used the old packet attribute
+        return self.get_packet()
 
-    def get_packet(self):
-        return self.packet
+class TransmitQueue:
+    # Multi-level transmit queue keyed on the engine's priority.
+    # Packets are ordered by a virtual deadline of enqueue time + level * aging_period, so a
+    # waiting low-priority packet gradually overtakes newer high-priority traffic instead of
+    # starving. "Critical" traffic is ranked ahead of everything else. Push and pop are
+    # O(log n); a second heap on the inverted key finds the lowest-priority entry to evict
+    # when the queue is full. Removed entries are deleted lazily and the heaps are compacted
+    # once they hold too many of them.
+    def __init__(self, max_size=32, aging_period=30, clock=time.time):
+        self.max_size = max_size
+        self.aging_period = aging_period
+        self._clock = clock
+        self._heap = []
+        self._evict_heap = []
+        self._seq = 0
+        self._size = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._size
+
+    def push(self, packet):
+        # Queue a packet. Returns the packet dropped to make room (which may be the new
+        # packet itself if it is the lowest priority), or None.
+        classification = packet.classification
+        rank = 0 if classification.traffic_type == TRAFFIC_CRITICAL else 1
+        deadline = self._clock() + classification.priority * self.aging_period
+
+        evicted = None
+        if self._size >= self.max_size:
+            worst = self._peek_worst()
+            if worst is None or (rank, deadline) >= (worst[0], worst[1]):
+                self.dropped += 1
+                return packet
+            evicted = self._remove(worst)
+            self.dropped += 1
+
+        self._seq += 1
+        # [rank, deadline, seq, packet, queued]; seq is unique so packets are never compared
+        entry = [rank, deadline, self._seq, packet, True]
+        heapq.heappush(self._heap, entry)
+        heapq.heappush(self._evict_heap, (-rank, -deadline, -self._seq, entry))
+        self._size += 1
+        self._compact()
+        return evicted
+
+    def peek(self):
+        # Return the next packet to transmit without removing it, or None.
+        heap = self._heap
+        while heap and not heap[0][4]:
+            heapq.heappop(heap)
+        return heap[0][3] if heap else None
+
+    def pop(self):
+        # Remove and return the next packet to transmit, or None if the queue is empty.
+        heap = self._heap
+        while heap:
+            entry = heapq.heappop(heap)
+            if entry[4]:
+                return self._remove(entry)
+        return None
+
+    def _peek_worst(self):
+        evict_heap = self._evict_heap
+        while evict_heap and not evict_heap[0][3][4]:
+            heapq.heappop(evict_heap)
+        return evict_heap[0][3] if evict_heap else None
+
+    def _remove(self, entry):
+        entry[4] = False
+        self._size -= 1
+        packet = entry[3]
+        entry[3] = None
+        return packet
+
+    def _compact(self):
+        limit = 2 * self.max_size
+        if len(self._heap) > limit:
+            self._heap = [entry for entry in self._heap if entry[4]]
+            heapq.heapify(self._heap)
+        if len(self._evict_heap) > limit:
+            self._evict_heap = [item for item in self._evict_heap if item[3][4]]
+            heapq.heapify(self._evict_heap)
 
 class DecisionEngine:
-    def __init__(self):
-        # Define urgency thresholds for various sensors with a refined temperature rule
-        self.sensor_urgency_rules = {
-            'temperature': lambda value: min(1.0, 0.6 + 0.02 * (value - 35)) if value > 35.0 else 0.0,
-            'humidity': lambda value: 0.4 if value < 20.0 else 0.0,
-            'pressure': lambda value: 0.2 if abs(value - 1015.0) > 10 else 0.0,
-            'battery_level': lambda value: 1.0 if value < 5 else 0.8 if value < 10 else 0.5 if value < 15 else 0.2 if value < 20 else 0.0,
-            'system_voltage': lambda value: 0.3 if value < 3.0 else 0.0, 
-            'latitude': lambda value: 0.2 if value < -90.0 or value > 90.0 else 0.0,
-            'longitude': lambda value: 0.2 if value < -180.0 or value > 180.0 else 0.0,
-        }
+    def __init__(self, urgency_rules=None, transmit_queue=None):
+        # Define urgency thresholds for various sensors (see DEFAULT_URGENCY_RULES for the format)
+        self.set_urgency_rules(urgency_rules if urgency_rules is not None else DEFAULT_URGENCY_RULES)
 
         # Define importance levels for different data types
         self.data_type_importance = {
@@ -65,13 +299,27 @@ class DecisionEngine:
         self.medium_urgency_threshold = 0.5
         self.low_urgency_threshold = 0.2
 
+        # Packets waiting to be transmitted, highest priority first
+        self.transmit_queue = transmit_queue if transmit_queue is not None else TransmitQueue()
+
+    def set_urgency_rules(self, urgency_rules):
+        # Replace the urgency rules and compile them into lookup tables.
+        self.sensor_urgency_rules = urgency_rules
+        self._urgency_tables = {sensor_type: compile_urgency_rule(rule) for sensor_type, rule in urgency_rules.items()}
+
+    def load_urgency_rules(self, path):
+        # Load urgency rules from a JSON config file with the same layout as DEFAULT_URGENCY_RULES.
+        with open(path) as f:
+            self.set_urgency_rules(json.load(f))
+
     def calculate_urgency(self, sensor_data):
         # Calculate urgency based on sensor data and defined rules.
         urgency = 0.0
+        tables = self._urgency_tables
         for sensor_type, value in sensor_data.items():
-            rule = self.sensor_urgency_rules.get(sensor_type)
-            if rule:
-                urgency += rule(value)  # Apply the rule for this sensor type
+            table = tables.get(sensor_type)
+            if table:
+                urgency += evaluate_urgency_rule(table, value)  # Apply the rule for this sensor type
         return min(urgency, 1.0)  # Clamp urgency to 1.0 max
 
     def calculate_importance(self, data_type):
@@ -82,41 +330,60 @@ class DecisionEngine:
         # Classify any type of sensor data by calculating urgency and importance.
         urgency = self.calculate_urgency(sensor_data)
         importance = self.calculate_importance(data_type)
+        return self._classify(urgency, importance)
+
+    def classify_batch(self, readings):
+        # Classify a whole sensor snapshot in one call, e.g.
+        # {'temperature': 21.4, 'battery_level': 87.0, 'gps': {'latitude': 51.5, 'longitude': -0.1}}.
+        # Plain values are classified as a single reading of that data type, dict values
+        # as a grouped reading (like the GPS fix). Returns {data_type: Classification}.
+        tables = self._urgency_tables
+        importance_table = self.data_type_importance
+        results = {}
+        for data_type, value in readings.items():
+            if isinstance(value, dict):
+                urgency = self.calculate_urgency(value)
+            else:
+                table = tables.get(data_type)
+                urgency = min(evaluate_urgency_rule(table, value), 1.0) if table else 0.0
+            results[data_type] = self._classify(urgency, importance_table.get(data_type, 0.5))
+        return results
 
+    def _classify(self, urgency, importance):
         # Calculate priority score as a weighted combination of urgency and importance
         priority_score = 0.6 * urgency + 0.4 * importance
 
         # Assign priority label based on the priority score
         if priority_score >= self.high_urgency_threshold:
-            priority = "Highest"
+            priority = PRIORITY_HIGHEST
         elif self.medium_urgency_threshold <= priority_score < self.high_urgency_threshold:
-            priority = "High"
+            priority = PRIORITY_HIGH
         elif self.low_urgency_threshold <= priority_score < self.medium_urgency_threshold:
-            priority = "Moderate"
+            priority = PRIORITY_MODERATE
         else:
-            priority = "Best Effort"
+            priority = PRIORITY_BEST_EFFORT
 
         # Map to traffic classification based on urgency and priority
-        if urgency >= 0.9 and priority == "Highest":
-            traffic_type = "Critical"
-            qos = "Guaranteed Delivery"
-            radio = "WiFi/LoRa - range dependent"
-        elif urgency >= 0.7 and priority == "High":
-            traffic_type = "Data Intensive"
-            qos = "High Bandwidth"
-            radio = "WiFi"
-        elif urgency >= 0.4 and priority == "Moderate":
-            traffic_type = "Reliable"
-            qos = "High Reliability"
-            radio = "BLE"
+        if urgency >= 0.9 and priority == PRIORITY_HIGHEST:
+            traffic_type = TRAFFIC_CRITICAL
+            qos = QOS_GUARANTEED_DELIVERY
+            radio = RADIO_WIFI_LORA
+        elif urgency >= 0.7 and priority == PRIORITY_HIGH:
+            traffic_type = TRAFFIC_DATA_INTENSIVE
+            qos = QOS_HIGH_BANDWIDTH
+            radio = RADIO_WIFI
+        elif urgency >= 0.4 and priority == PRIORITY_MODERATE:
+            traffic_type = TRAFFIC_RELIABLE
+            qos = QOS_HIGH_RELIABILITY
+            radio = RADIO_BLE
         else:
-            traffic_type = "Standard"
-            qos = "Standard"
-            radio = "LoRa"
+            traffic_type = TRAFFIC_STANDARD
+            qos = QOS_STANDARD
+            radio = RADIO_LORA
             
-        return urgency, priority, traffic_type, qos, radio
+        return Classification(urgency, importance, priority, traffic_type, qos, radio)
 
     def preempt_message(self, message):
-        # Preempt lower-priority messages if necessary.
-        # ^ To be added in future iterations.
-        pass
+        # Queue a packet for transmission ahead of any lower-priority traffic. If the queue
+        # is full the lowest-priority packet is evicted and returned, otherwise None.
+        return self.transmit_queue.push(message)
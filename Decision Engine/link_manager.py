@@ -0,0 +1,610 @@
+import asyncio
+import math
+import random
+import time
+from decision_engine import PRIORITY_BEST_EFFORT
+from _sx126x import ERR_NONE, ERR_INVALID_FREQUENCY, ERR_PACKET_TOO_LONG, CHANNEL_FREE, LORA_DETECTED
+
+try:
+    sleep_ms = asyncio.sleep_ms
+except AttributeError:
+    # Host Python (e.g. with emulator.py)
+    def sleep_ms(ms):
+        return asyncio.sleep(ms / 1000)
+
+# EU868 sub-bands (ETSI EN 300 220) as (low MHz, high MHz, duty cycle)
+EU868_SUB_BANDS = (
+    (863.0, 865.0, 0.001),
+    (865.0, 868.0, 0.01),
+    (868.0, 868.6, 0.01),
+    (868.7, 869.2, 0.001),
+    (869.4, 869.65, 0.1),
+    (869.7, 870.0, 0.01),
+)
+
+class DutyCycleBudget:
+    # Airtime accounting per regulatory sub-band over a sliding window (one hour by
+    # default). Each transmission is kept with its start time and airtime until it is
+    # older than the window, and the sub-band's running total is its used airtime.
+    def __init__(self, sub_bands=EU868_SUB_BANDS, window=3600, clock=time.time):
+        self.sub_bands = sub_bands
+        self.window = window
+        self._clock = clock
+        # Per sub-band: [[time, airtime_us], ...] oldest first, and their total
+        self._sent = [[] for _ in sub_bands]
+        self._used = [0] * len(sub_bands)
+
+    def sub_band(self, freq):
+        # Index of the sub-band containing freq (MHz), or None if it is outside all of them.
+        for i, (low, high, duty) in enumerate(self.sub_bands):
+            if low <= freq < high:
+                return i
+        return None
+
+    def limit_us(self, freq):
+        band = self.sub_band(freq)
+        if band is None:
+            return 0
+        return int(self.sub_bands[band][2] * self.window * 1000000)
+
+    def used_us(self, freq):
+        band = self.sub_band(freq)
+        if band is None:
+            return 0
+        self._expire(band, self._clock())
+        return self._used[band]
+
+    def remaining_us(self, freq):
+        # Airtime still available in freq's sub-band over the current window.
+        return max(0, self.limit_us(freq) - self.used_us(freq))
+
+    def record(self, freq, airtime_us):
+        band = self.sub_band(freq)
+        if band is None:
+            return
+        now = self._clock()
+        self._expire(band, now)
+        self._sent[band].append([now, airtime_us])
+        self._used[band] += airtime_us
+
+    def next_allowed(self, freq, airtime_us):
+        # Earliest time (clock units) a transmission of airtime_us fits in the budget, or
+        # None if it never can (outside the sub-bands or longer than the whole allowance).
+        limit = self.limit_us(freq)
+        if airtime_us > limit:
+            return None
+        band = self.sub_band(freq)
+        now = self._clock()
+        self._expire(band, now)
+        excess = self._used[band] + airtime_us - limit
+        if excess <= 0:
+            return now
+        for sent, airtime in self._sent[band]:
+            excess -= airtime
+            if excess <= 0:
+                return sent + self.window
+        return now + self.window
+
+    def _expire(self, band, now):
+        sent = self._sent[band]
+        cutoff = now - self.window
+        expired = 0
+        while expired < len(sent) and sent[expired][0] <= cutoff:
+            self._used[band] -= sent[expired][1]
+            expired += 1
+        if expired:
+            del sent[:expired]
+
+class ListenBeforeTalk:
+    # Channel activity detection before each transmission. While CAD reports a LoRa
+    # preamble on the channel the sender backs off for a random number of slots drawn
+    # from a window that doubles with every busy scan (binary exponential backoff), and
+    # gives up after max_attempts scans. A slot defaults to the frame's own time on air,
+    # the time the transmission we heard is likely to need. The radio only has to provide
+    # a coroutine scanChannel() returning CHANNEL_FREE or LORA_DETECTED.
+    def __init__(self, radio, max_attempts=6, max_exponent=5, slot_ms=None, rand=random.getrandbits):
+        self.radio = radio
+        self.max_attempts = max_attempts
+        self.max_exponent = max_exponent
+        self.slot_ms = slot_ms
+        self._rand = rand
+        self.busy = 0
+        self.backoffs = 0
+        self.backoff_ms = 0
+        self.dropped = 0
+
+    def backoff(self, attempt, slot_ms):
+        # Random wait (ms) after the attempt-th busy scan: 1 to 2^attempt slots.
+        exponent = min(attempt, self.max_exponent)
+        return (1 + self._rand(exponent) if exponent else 1) * slot_ms
+
+    async def acquire(self, airtime_us):
+        # Wait until the channel is clear for a frame of airtime_us. Returns CHANNEL_FREE,
+        # LORA_DETECTED if it stayed busy for every attempt, or the radio's error state.
+        slot_ms = self.slot_ms if self.slot_ms is not None else airtime_us // 1000 + 1
+        for attempt in range(1, self.max_attempts + 1):
+            state = await self.radio.scanChannel()
+            if state != LORA_DETECTED:
+                return state
+            self.busy += 1
+            if attempt == self.max_attempts:
+                break
+            wait = self.backoff(attempt, slot_ms)
+            self.backoffs += 1
+            self.backoff_ms += wait
+            await sleep_ms(wait)
+        self.dropped += 1
+        return LORA_DETECTED
+
+class LinkManager:
+    # Sends LoRa frames through the radio while keeping within the duty-cycle budget of
+    # the sub-band the radio is tuned to, using the driver's time-on-air for each frame.
+    # send() waits until the budget allows the frame. defer() is meant for the frame
+    # aggregator: Best Effort frames are held back while the budget is short, so later
+    # readings merge into them instead of queueing up as separate transmissions.
+    # With a ListenBeforeTalk (lbt), each frame is only sent once CAD finds the channel clear.
+    # With a FrequencyHopper (hopper), frames go out on this node's channel for the current
+    # slot and the radio returns to the followed node's channel afterwards. A frame whose
+    # channel is out of budget waits at most until the next hop, which may land it in a
+    # sub-band with airtime to spare.
+    # With a TxPowerControl (power_control), frames sent to a destination node (dest) go
+    # out with the TX power kept for that node.
+    def __init__(self, radio, budget=None, clock=time.time, lbt=None, hopper=None, power_control=None):
+        self.radio = radio
+        self.budget = budget if budget is not None else DutyCycleBudget(clock=clock)
+        self.lbt = lbt
+        self.hopper = hopper
+        self.power_control = power_control
+        self._clock = clock
+        self.deferred = 0
+        # Sends in flight, and when a deferred one resumes (clock units)
+        self._busy = 0
+        self._resume = None
+
+    def frequency(self):
+        # Frequency the next transmission goes out on.
+        if self.hopper is not None:
+            return self.hopper.tx_frequency()
+        return self.radio.getProfile().freq
+
+    def remaining_us(self):
+        return self.budget.remaining_us(self.frequency())
+
+    def next_allowed(self, length):
+        # Earliest time a frame of length bytes may be sent, or None if it never may.
+        return self.budget.next_allowed(self.frequency(), self.radio.getTimeOnAir(length))
+
+    def until_wake(self):
+        # Seconds until a send in flight needs the CPU again (0 while it is using the radio),
+        # or None if nothing is being sent. Lets the power scheduler sleep through deferrals.
+        if not self._busy:
+            return None
+        if self._resume is None:
+            return 0
+        return max(0, self._resume - self._clock())
+
+    def defer(self, length, priority):
+        # Seconds to hold back a due frame of length bytes whose highest priority is priority.
+        if priority != PRIORITY_BEST_EFFORT:
+            return 0
+        allowed = self.next_allowed(length)
+        if allowed is None:
+            return self.budget.window
+        return max(0, allowed - self._clock())
+
+    def can_send(self, length):
+        # Whether the budget allows a frame of length bytes right now.
+        allowed = self.next_allowed(length)
+        return allowed is not None and allowed <= self._clock()
+
+    async def _acquire(self, airtime, dest=None):
+        # Wait until airtime us fits in the budget of the channel to send on, tune to it, set
+        # dest's TX power and check the channel is clear. Starts over if the hop slot ends
+        # in the meantime, so the frame goes out on (and is charged to) the returned
+        # channel. Returns (frequency, state).
+        deferred = False
+        while True:
+            freq = self.frequency()
+            allowed = self.budget.next_allowed(freq, airtime)
+            if allowed is None:
+                return freq, ERR_INVALID_FREQUENCY if self.budget.sub_band(freq) is None else ERR_PACKET_TOO_LONG
+            delay = allowed - self._clock()
+            if delay > 0:
+                if not deferred:
+                    self.deferred += 1
+                    deferred = True
+                if self.hopper is not None:
+                    # Keep following the peer while waiting
+                    delay = min(delay, self.hopper.until_next_slot())
+                    self.hopper.release()
+                    await self._listen()
+                self._resume = self._clock() + delay
+                try:
+                    await asyncio.sleep(delay)
+                finally:
+                    self._resume = None
+                    if self.hopper is not None:
+                        self.hopper.hold()
+                continue
+
+            if self.hopper is not None:
+                state = await self.hopper.tune(freq)
+                if state != ERR_NONE:
+                    return freq, state
+
+            if self.power_control is not None and dest is not None:
+                state = await self.power_control.apply(dest)
+                if state != ERR_NONE:
+                    return freq, state
+
+            if self.lbt is not None:
+                state = await self.lbt.acquire(airtime)
+                if state != CHANNEL_FREE:
+                    return freq, state
+
+            if self.hopper is None or self.frequency() == freq:
+                return freq, ERR_NONE
+
+    async def _listen(self):
+        if self.hopper is not None:
+            await self.hopper.tune(self.hopper.rx_frequency())
+
+    async def send(self, frame, dest=None):
+        # Send frame (to node dest) once the budget allows it. Returns (length, state) like SX1262.send().
+        self._hold()
+        try:
+            return await self._send(frame, dest)
+        finally:
+            self._release()
+
+    async def send_all(self, frames, dest=None):
+        # Send a list of frames (to node dest) back to back through the radio's pipelined
+        # sendAll() once the budget allows all of them. Returns (frames sent, state).
+        if len(frames) == 1:
+            length, state = await self.send(frames[0], dest)
+            return (1 if length else 0), state
+        self._hold()
+        try:
+            return await self._send_all(frames, dest)
+        finally:
+            self._release()
+
+    def _hold(self):
+        # A send is in flight: keep the power scheduler awake and the hopper on our channel
+        self._busy += 1
+        if self.hopper is not None:
+            self.hopper.hold()
+
+    def _release(self):
+        self._busy -= 1
+        if self.hopper is not None:
+            self.hopper.release()
+
+    async def _send(self, frame, dest):
+        airtime = self.radio.getTimeOnAir(len(frame))
+        freq, state = await self._acquire(airtime, dest)
+        if state != ERR_NONE:
+            await self._listen()
+            return 0, state
+
+        length, state = await self.radio.send(frame)
+        if length:
+            self.budget.record(freq, airtime)
+        await self._listen()
+        return length, state
+
+    async def _send_all(self, frames, dest):
+        airtimes = [self.radio.getTimeOnAir(len(frame)) for frame in frames]
+        freq, state = await self._acquire(sum(airtimes), dest)
+        if state != ERR_NONE:
+            await self._listen()
+            return 0, state
+
+        sent, state = await self.radio.sendAll(frames)
+        for airtime in airtimes[:sent]:
+            self.budget.record(freq, airtime)
+        await self._listen()
+        return sent, state
+
+class AckSender:
+    # Sends acknowledgements through a LinkManager from its own task (run), so the receive
+    # loop never waits for the duty-cycle budget or listen-before-talk: ack() only queues
+    # the frame. Only the latest acknowledgement per destination is kept, so a burst from
+    # one node costs one ACK, and an ACK the budget cannot take right away is dropped
+    # (counted in dropped) rather than sent late, when the sender has given up on it.
+    # on_sent, if given, is awaited once the ACK has gone out; it is dropped along with
+    # the ACK, or when a newer ACK to the same node replaces it.
+    def __init__(self, link_manager):
+        self.link_manager = link_manager
+        # dest -> (frame, on_sent)
+        self._pending = {}
+        self._event = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def ack(self, frame, dest, on_sent=None):
+        if dest in self._pending:
+            self.coalesced += 1
+        self._pending[dest] = (frame, on_sent)
+        self._event.set()
+
+    async def run(self):
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            while self._pending:
+                dest = next(iter(self._pending))
+                frame, on_sent = self._pending.pop(dest)
+                if not self.link_manager.can_send(len(frame)):
+                    self.dropped += 1
+                    continue
+                length, state = await self.link_manager.send(frame, dest=dest)
+                if not length:
+                    self.dropped += 1
+                    continue
+                self.sent += 1
+                if on_sent is not None:
+                    await on_sent()
+
+# Demodulation floor SNR (dB) per spreading factor, SX126x datasheet
+LORA_SNR_FLOOR = {5: -2.5, 6: -5.0, 7: -7.5, 8: -10.0, 9: -12.5, 10: -15.0, 11: -17.5, 12: -20.0}
+# Receiver noise figure (dB) used for the RSSI based sensitivity estimate
+LORA_NOISE_FIGURE = 6
+
+def lora_sensitivity(sf, bw):
+    # Estimated RSSI (dBm) at the demodulation floor for sf at bandwidth bw (kHz).
+    return -174 + 10 * math.log10(bw * 1000) + LORA_NOISE_FIGURE + LORA_SNR_FLOOR[sf]
+
+def link_margin(rssi, snr, sf, bw):
+    # Link margin (dB) of a frame received with rssi (dBm) and snr (dB) at sf and bw (kHz):
+    # the smaller of the SNR above the demodulation floor and the RSSI above the
+    # sensitivity, since SNR saturates on strong links.
+    return min(snr - LORA_SNR_FLOOR[sf], rssi - lora_sensitivity(sf, bw))
+
+class AdrController:
+    # Adaptive data rate: picks the lowest spreading factor, then the lowest TX power,
+    # that keep target_margin dB of link margin, and applies it through the driver.
+    # Both ends of a link must use the same SF, so a new SF is only proposed to the peer
+    # (carried in each data frame, see PacketEncoder.link_sf). The peer switches after
+    # acknowledging a frame with a proposal (follow), and this node switches once that
+    # acknowledgement arrives (confirmed). If nothing is heard from the peer for
+    # link_timeout seconds, e.g. because an acknowledgement was lost and the two ended up
+    # on different SFs, run() falls back to the SF the radio was started with.
+    # Observations are RSSI/SNR of frames, either as measured by a peer and reported in
+    # its acknowledgement (observe_ack), or as measured here from the peer's frames
+    # (observe, with the TX power the peer reports in them). Each is normalised by
+    # the TX power it was sent with and smoothed with an EWMA, so the estimate survives
+    # our own power changes. The margin is the smaller of the SNR above the SF's
+    # demodulation floor and the RSSI above the SF's sensitivity, since SNR saturates on
+    # strong links. Moving to a faster SF needs hysteresis dB of extra margin.
+    # Without adjust_power the TX power is left to a TxPowerControl, and the SF is picked
+    # for the margin it would have at max_power.
+    PENDING = 8
+
+    def __init__(self, radio, target_margin=10, alpha=0.25, min_samples=3, hysteresis=3,
+                 min_sf=7, max_sf=12, min_power=-9, max_power=22, adjust_power=True,
+                 link_timeout=300, clock=time.time):
+        self.radio = radio
+        self.target_margin = target_margin
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.hysteresis = hysteresis
+        self.min_sf = min_sf
+        self.max_sf = max_sf
+        self.min_power = min_power
+        self.max_power = max_power
+        self.adjust_power = adjust_power
+        self.link_timeout = link_timeout
+        self._clock = clock
+        self.base_sf = radio.getProfile().sf
+        # EWMA of RSSI and SNR as if sent at 0 dBm
+        self.rssi = None
+        self.snr = None
+        self.samples = 0
+        self.changes = 0
+        self.fallbacks = 0
+        # SF proposed to the peer (None while it is the current one), and frame seq -> SF
+        # proposed in it, for frames awaiting acknowledgement
+        self.proposed_sf = None
+        self._proposals = {}
+        self._heard = clock()
+
+    def observe(self, rssi, snr, tx_power=None):
+        # Add one reception; tx_power defaults to the power we currently transmit with.
+        if tx_power is None:
+            tx_power = self.radio.getProfile().power
+        rssi -= tx_power
+        snr -= tx_power
+        if self.samples:
+            self.rssi += self.alpha * (rssi - self.rssi)
+            self.snr += self.alpha * (snr - self.snr)
+        else:
+            self.rssi, self.snr = rssi, snr
+        self.samples += 1
+
+    def observe_ack(self, rssi, snr, tx_power=None):
+        # Add the RSSI/SNR a peer reported for one of our frames, sent with tx_power
+        # (e.g. as returned by TxPowerControl.on_ack).
+        self.observe(rssi, snr, tx_power)
+
+    def sensitivity(self, sf, bw):
+        return lora_sensitivity(sf, bw)
+
+    def margin(self, sf, power, bw):
+        # Predicted link margin (dB) when sending with sf and power, or None without observations.
+        if not self.samples:
+            return None
+        return link_margin(self.rssi + power, self.snr + power, sf, bw)
+
+    def select(self):
+        # (sf, power) to use: the fastest SF that reaches the target margin within
+        # max_power, at the lowest power that does. The current settings until enough
+        # observations have been made, and the most robust settings if nothing reaches it.
+        profile = self.radio.getProfile()
+        if self.samples < self.min_samples:
+            return profile.sf, profile.power
+        for sf in range(self.min_sf, self.max_sf + 1):
+            target = self.target_margin
+            if sf < profile.sf:
+                target += self.hysteresis
+            power = math.ceil(target - self.margin(sf, 0, profile.bw))
+            if power <= self.max_power:
+                return sf, max(self.min_power, power) if self.adjust_power else profile.power
+        return self.max_sf, self.max_power if self.adjust_power else profile.power
+
+    async def update(self):
+        # Propose the selected SF to the peer if it differs from the radio's, and apply the
+        # selected power (with adjust_power). Returns the driver state.
+        profile = self.radio.getProfile()
+        sf, power = self.select()
+        self.proposed_sf = sf if sf != profile.sf else None
+        if power == profile.power:
+            return ERR_NONE
+        return await self._apply(profile.copy(power=power))
+
+    def proposal(self):
+        # SF to put in outgoing frames: the proposed one, or the current one.
+        return self.proposed_sf if self.proposed_sf is not None else self.radio.getProfile().sf
+
+    def sent(self, seq, sf):
+        # Frame seq went to the peer proposing sf (None, or the current SF, proposes no change).
+        self._proposals.pop((seq - self.PENDING) & 0xFF, None)
+        if sf is None or sf == self.radio.getProfile().sf:
+            self._proposals.pop(seq, None)
+        else:
+            self._proposals[seq] = sf
+
+    def heard(self):
+        # A frame arrived from the peer, so the link still works on the current SF.
+        self._heard = self._clock()
+
+    async def confirmed(self, seq):
+        # The peer acknowledged frame seq, and has moved to the SF proposed in it.
+        self.heard()
+        sf = self._proposals.pop(seq, None)
+        if sf is None:
+            return ERR_NONE
+        if sf == self.proposed_sf:
+            self.proposed_sf = None
+        return await self._switch(sf)
+
+    async def follow(self, sf):
+        # The peer proposed sf in a frame this node has just acknowledged.
+        self.heard()
+        self.proposed_sf = None
+        return await self._switch(sf)
+
+    async def run(self):
+        # Fall back to the starting SF while the peer stays silent for link_timeout seconds.
+        while True:
+            await asyncio.sleep(self.link_timeout / 4)
+            if self._clock() - self._heard > self.link_timeout:
+                self.proposed_sf = None
+                self._proposals = {}
+                self.heard()
+                if self.radio.getProfile().sf != self.base_sf and await self._switch(self.base_sf) == ERR_NONE:
+                    self.fallbacks += 1
+
+    async def _switch(self, sf):
+        # Ignores SFs outside the range this node may use
+        profile = self.radio.getProfile()
+        if sf == profile.sf or not (self.min_sf <= sf <= self.max_sf or sf == self.base_sf):
+            return ERR_NONE
+        return await self._apply(profile.copy(sf=sf))
+
+    async def _apply(self, profile):
+        state = await self.radio.apply(profile)
+        if state == ERR_NONE:
+            self.changes += 1
+        return state
+
+class TxPowerControl:
+    # Closed-loop transmit power per destination node. The receiver reports the link margin
+    # of each acknowledged frame; the sender keeps one power level per destination and
+    # lowers it by up to step_down dB per acknowledgement while the margin is above
+    # target_margin, raises it straight to the target when the margin falls short, and
+    # raises it by step_up dB for every frame left unacknowledged for ack_timeout seconds.
+    # The PA draws most of a frame's energy, so each dB saved is spent on every frame.
+    # Power changes go through the driver's apply(), which with the PA already configured
+    # costs a single SetTxParams command.
+    PENDING = 8
+
+    def __init__(self, radio, target_margin=10, step_down=2, step_up=3, min_power=-9, max_power=22,
+                 ack_timeout=10, clock=time.time):
+        self.radio = radio
+        self.target_margin = target_margin
+        self.step_down = step_down
+        self.step_up = step_up
+        self.min_power = min_power
+        self.max_power = max_power
+        self.ack_timeout = ack_timeout
+        self._clock = clock
+        # dest -> power (dBm), and dest -> {seq: (time sent, power)} awaiting acknowledgement
+        self._power = {}
+        self._pending = {}
+        self.acks = 0
+        self.losses = 0
+        self.changes = 0
+
+    def power(self, dest):
+        # TX power (dBm) for frames to dest, starting from the radio's configured power.
+        self._expire(dest)
+        power = self._power.get(dest)
+        if power is None:
+            power = self._power[dest] = self.radio.getProfile().power
+        return power
+
+    def sent(self, dest, seq):
+        # Record frame seq as sent to dest with its current power, to be acknowledged.
+        pending = self._pending.get(dest)
+        if pending is None:
+            pending = self._pending[dest] = {}
+        pending[seq] = (self._clock(), self.power(dest))
+        pending.pop((seq - self.PENDING) & 0xFF, None)
+
+    def on_ack(self, dest, seq, margin):
+        # dest acknowledged frame seq, received with margin dB (None if the peer does not
+        # report it). Frames are only assumed lost once their timeout passes, so a late
+        # acknowledgement still counts. Returns the power the frame was sent with, or None
+        # if it was not waiting for an acknowledgement.
+        pending = self._pending.get(dest)
+        if pending is None or seq not in pending:
+            return None
+        sent_power = pending.pop(seq)[1]
+        self.acks += 1
+        if margin is None:
+            return sent_power
+        current = self.power(dest)
+        excess = margin - self.target_margin
+        if excess > 0:
+            # Only step down from the level the frame was sent with, not one a loss has raised since
+            if sent_power == current:
+                self._set(dest, current - min(self.step_down, int(excess)))
+        else:
+            self._set(dest, max(current, sent_power + math.ceil(-excess)))
+        return sent_power
+
+    def _expire(self, dest):
+        pending = self._pending.get(dest)
+        if not pending:
+            return
+        cutoff = self._clock() - self.ack_timeout
+        for seq in [seq for seq, (sent, power) in pending.items() if sent <= cutoff]:
+            del pending[seq]
+            self.losses += 1
+            self._set(dest, self._power.get(dest, self.max_power) + self.step_up)
+
+    def _set(self, dest, power):
+        power = min(self.max_power, max(self.min_power, power))
+        if self._power.get(dest) != power:
+            self._power[dest] = power
+            self.changes += 1
+
+    async def apply(self, dest):
+        # Set the radio to dest's power if it is not already there. Returns the driver state.
+        profile = self.radio.getProfile()
+        power = self.power(dest)
+        if profile.power == power:
+            return ERR_NONE
+        return await self.radio.apply(profile.copy(power=power))
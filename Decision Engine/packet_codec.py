@@ -0,0 +1,461 @@
+import struct
+import time
+
+from decision_engine import PRIORITY_LEVELS, TRAFFIC_TYPES, QOS_LEVELS, RADIOS
+from _sx126x import SX126X_MAX_PACKET_LENGTH
+
+# Binary wire format for Packetisation packets.
+#
+# A frame is a 4 byte header, optional header fields flagged in the header, and one or
+# more records:
+#   frame header:  version << 4 | flags, node id, frame sequence number, record count
+#   FRAME_FLAG_TX_POWER: the TX power (signed dBm) the frame was sent with
+#   FRAME_FLAG_SF:       the spreading factor the sender proposes for the link
+#   record header: sensor id, data type, class byte, urgency, importance, timestamp
+#   record values: fixed-point integers, layout given by the data type
+# The class byte packs priority, traffic type, QoS and radio codes into 2 bits each.
+# Urgency and importance are scaled to 0-255, the timestamp is seconds since midnight.
+#
+# With a DeltaEncoder the top bits of the data type byte flag stream-coded values:
+#   DATA_TYPE_KEYFRAME: stream sequence number, then the fixed-point values as usual
+#   DATA_TYPE_DELTA:    stream sequence number, base sequence number, then one zig-zag
+#                       varint per value with the difference from the base values
+#
+# An acknowledgement is a frame header with FRAME_FLAG_ACK set, the acknowledging node,
+# the acknowledged frame's sequence number and a zero count, followed by the node the
+# frame came from, the RSSI (-2 x dBm) and SNR (4 x dB) it was received with, and the
+# link margin (dB) the receiver had above its demodulation floor. Version 1 nodes send
+# acknowledgements without the margin; they are still accepted.
+WIRE_VERSION = 2
+WIRE_VERSIONS = (1, 2)
+FRAME_FLAG_ACK = 0x01
+FRAME_FLAG_TX_POWER = 0x02
+FRAME_FLAG_SF = 0x04
+DATA_TYPE_KEYFRAME = 0x40
+DATA_TYPE_DELTA = 0x80
+DATA_TYPE_MASK = 0x3F
+
+FRAME_HEADER = '>BBBB'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+RECORD_HEADER = '>BBBBBI'
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+ACK_BODY = '>BBbb'
+ACK_BODY_V1 = '>BBb'
+
+# Known sensor IDs, anything else must already be an integer ID (0-255)
+SENSOR_IDS = {'BME': 1, 'PMU': 2, 'GPS': 3}
+SENSOR_NAMES = {code: name for name, code in SENSOR_IDS.items()}
+
+# Data type code: (name, value fields, struct format, fixed-point scale)
+DATA_TYPES = {
+    1: ('temperature', ('temperature',), '>h', 10),
+    2: ('humidity', ('humidity',), '>H', 10),
+    3: ('pressure', ('pressure',), '>I', 100),
+    4: ('battery_level', ('battery_level',), '>B', 1),
+    5: ('system_voltage', ('system_voltage',), '>H', 1000),
+    6: ('latitude', ('latitude',), '>i', 100000),
+    7: ('longitude', ('longitude',), '>i', 100000),
+    8: ('gps', ('latitude', 'longitude'), '>ii', 100000),
+}
+DATA_TYPE_CODES = {entry[0]: code for code, entry in DATA_TYPES.items()}
+
+def register_data_type(code, name, fields, fmt, scale):
+    # Add a data type to the wire format. Both ends must register the same code.
+    DATA_TYPES[code] = (name, tuple(fields), fmt, scale)
+    DATA_TYPE_CODES[name] = code
+
+def encode_record(packet, delta_encoder=None):
+    # Encode a single Packetisation packet as a record (header + values). With a
+    # DeltaEncoder the values are sent as a keyframe or as deltas for the packet's stream.
+    code = DATA_TYPE_CODES[packet.data_type]
+    name, fields, fmt, scale = DATA_TYPES[code]
+    classification = packet.classification
+    sensor_id = SENSOR_IDS.get(packet.sensor_id, packet.sensor_id)
+    class_byte = (classification.priority << 6) | (classification.traffic_type << 4) | (classification.qos << 2) | classification.radio
+    sensor_data = packet.sensor_data
+    values = tuple(int(round(sensor_data[field] * scale)) for field in fields)
+
+    if delta_encoder is None:
+        body = struct.pack(fmt, *values)
+    else:
+        flag, body = delta_encoder.encode((sensor_id, code), values, fmt)
+        code |= flag
+
+    header = struct.pack(RECORD_HEADER, sensor_id, code, class_byte,
+                         int(classification.urgency * 255 + 0.5), int(classification.importance * 255 + 0.5),
+                         packet.timestamp)
+    return header + body
+
+def decode_record(buf, offset=0, delta_decoder=None, node_id=0):
+    # Decode the record starting at offset. Returns (packet dict, next offset), where the
+    # packet dict has the same layout as Packetisation.get_packet(). Stream-coded records
+    # need a DeltaDecoder; the payload is None if a delta's base value is unknown.
+    sensor_id, code, class_byte, urgency, importance, timestamp = struct.unpack_from(RECORD_HEADER, buf, offset)
+    offset += RECORD_HEADER_SIZE
+    start = offset
+    flags = code & ~DATA_TYPE_MASK
+    code &= DATA_TYPE_MASK
+    name, fields, fmt, scale = DATA_TYPES[code]
+    if flags:
+        if delta_decoder is None:
+            raise ValueError("Stream-coded record needs a DeltaDecoder")
+        raw, offset = delta_decoder.decode((node_id, sensor_id, code), flags, buf, offset, fmt, len(fields))
+    else:
+        raw = struct.unpack_from(fmt, buf, offset)
+        offset += struct.calcsize(fmt)
+
+    values = None
+    if raw is not None:
+        values = {}
+        for i in range(len(fields)):
+            values[fields[i]] = raw[i] / scale
+    packet = {
+        'header': {
+            'sensor_id': SENSOR_NAMES.get(sensor_id, sensor_id),
+            'urgency': round(urgency / 255, 2),
+            'importance': round(importance / 255, 2),
+            'data_type': name,
+            'data_size': offset - start,
+            'timestamp': "Time: {:02}:{:02}:{:02}".format(timestamp // 3600, (timestamp // 60) % 60, timestamp % 60),
+            'qos': QOS_LEVELS[(class_byte >> 2) & 0x03],
+            'priority': PRIORITY_LEVELS[class_byte >> 6],
+            'traffic_type': TRAFFIC_TYPES[(class_byte >> 4) & 0x03],
+            'radio': RADIOS[class_byte & 0x03]
+        },
+        'payload': values
+    }
+    return packet, offset
+
+def write_varint(out, value):
+    # Append a signed integer to a bytearray as a zig-zag LEB128 varint.
+    value = (value << 1) if value >= 0 else ((-value) << 1) - 1
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(buf, offset):
+    # Read a zig-zag varint written by write_varint(). Returns (value, next offset).
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return (value >> 1) if not value & 1 else -((value + 1) >> 1), offset
+
+class DeltaEncoder:
+    # Per-stream delta coding for slowly changing readings. Each (sensor, data type) stream
+    # sends a keyframe, then zig-zag varint deltas against the last acknowledged values,
+    # with a fresh keyframe every resync_interval records so a receiver that missed a
+    # keyframe recovers. With auto_ack every sent value is assumed delivered; otherwise
+    # deltas are taken against the last values the peer confirmed through ack() (or
+    # PacketEncoder.ack() for a whole frame), and a keyframe is sent instead once that
+    # reference is further back than the DeltaDecoder keeps, so lost frames only cost
+    # the records they carried.
+    PENDING = 8
+
+    def __init__(self, resync_interval=10, auto_ack=True):
+        self.resync_interval = resync_interval
+        self.auto_ack = auto_ack
+        # stream -> [next seq, reference seq, reference values, records since keyframe, {seq: values}]
+        self._streams = {}
+
+    def encode(self, stream, values, fmt):
+        # Returns (data type flag, encoded body) for the next values of a stream.
+        state = self._streams.get(stream)
+        if state is None:
+            state = [0, None, None, 0, {}]
+            self._streams[stream] = state
+        seq = state[0]
+        state[0] = (seq + 1) & 0xFF
+
+        body = bytearray()
+        body.append(seq)
+        if state[2] is None or state[3] >= self.resync_interval or \
+                ((seq - state[1]) & 0xFF) >= DeltaDecoder.HISTORY:
+            flag = DATA_TYPE_KEYFRAME
+            body.extend(struct.pack(fmt, *values))
+            state[3] = 0
+        else:
+            flag = DATA_TYPE_DELTA
+            body.append(state[1])
+            reference = state[2]
+            for i in range(len(values)):
+                write_varint(body, values[i] - reference[i])
+            state[3] += 1
+
+        if self.auto_ack:
+            state[1] = seq
+            state[2] = values
+        else:
+            pending = state[4]
+            pending[seq] = values
+            pending.pop((seq - self.PENDING) & 0xFF, None)
+        return flag, bytes(body)
+
+    def ack(self, stream, seq):
+        # Mark the values sent with the given stream sequence number as received. A late
+        # acknowledgement never moves the reference back to older values.
+        state = self._streams.get(stream)
+        if state is not None and seq in state[4] and \
+                (state[1] is None or 0 < ((seq - state[1]) & 0xFF) < 0x80):
+            state[1] = seq
+            state[2] = state[4][seq]
+
+    def stream_seq(self, record):
+        # (stream, stream sequence number) of a record from encode_record(), or None if it
+        # was not stream-coded.
+        if not record[1] & ~DATA_TYPE_MASK:
+            return None
+        return (record[0], record[1] & DATA_TYPE_MASK), record[RECORD_HEADER_SIZE]
+
+    def resync(self, stream=None):
+        # Force the next record of one stream (or of all streams) to be a keyframe.
+        for key, state in self._streams.items():
+            if stream is None or key == stream:
+                state[2] = None
+
+class DeltaDecoder:
+    # Receiver side of DeltaEncoder, keeping the last few values of every stream so deltas
+    # against any recently acknowledged reference can be resolved. The encoder never
+    # refers further back than HISTORY records.
+    HISTORY = 8
+
+    def __init__(self):
+        self._streams = {}
+        self.missing_reference = 0
+
+    def decode(self, stream, flags, buf, offset, fmt, count):
+        # Returns (raw values or None, next offset).
+        history = self._streams.get(stream)
+        if history is None:
+            history = {}
+            self._streams[stream] = history
+        seq = buf[offset]
+        offset += 1
+        if flags & DATA_TYPE_KEYFRAME:
+            values = struct.unpack_from(fmt, buf, offset)
+            offset += struct.calcsize(fmt)
+        else:
+            reference = history.get(buf[offset])
+            offset += 1
+            deltas = []
+            for _ in range(count):
+                delta, offset = read_varint(buf, offset)
+                deltas.append(delta)
+            if reference is None:
+                self.missing_reference += 1
+                return None, offset
+            values = tuple(reference[i] + deltas[i] for i in range(count))
+        history[seq] = values
+        history.pop((seq - self.HISTORY) & 0xFF, None)
+        return values, offset
+
+def encode_ack(node_id, dest_node, seq, rssi, snr, margin):
+    # Acknowledge frame seq from dest_node, reporting the RSSI (dBm), SNR (dB) and link
+    # margin (dB) it arrived with.
+    rssi_raw = min(255, max(0, int(round(-rssi * 2))))
+    snr_raw = min(127, max(-128, int(round(snr * 4))))
+    margin_raw = min(127, max(-128, int(round(margin))))
+    return struct.pack(FRAME_HEADER, (WIRE_VERSION << 4) | FRAME_FLAG_ACK, node_id, seq, 0) + \
+        struct.pack(ACK_BODY, dest_node, rssi_raw, snr_raw, margin_raw)
+
+def decode_ack(frame):
+    # Returns (acknowledging node, destination node, seq, rssi, snr, margin), or None if
+    # frame is not an acknowledgement. The margin is None from version 1 nodes.
+    if len(frame) < FRAME_HEADER_SIZE:
+        return None
+    version_flags, node_id, seq, count = struct.unpack_from(FRAME_HEADER, frame, 0)
+    version = version_flags >> 4
+    if version not in WIRE_VERSIONS or not (version_flags & FRAME_FLAG_ACK):
+        return None
+    body = ACK_BODY if version == WIRE_VERSION else ACK_BODY_V1
+    if len(frame) < FRAME_HEADER_SIZE + struct.calcsize(body):
+        return None
+    fields = struct.unpack_from(body, frame, FRAME_HEADER_SIZE)
+    margin = fields[3] if version == WIRE_VERSION else None
+    return node_id, fields[0], seq, -fields[1] / 2, fields[2] / 4, margin
+
+def frame_options(frame):
+    # Optional header fields of a data frame as a dict, and the offset of its first record.
+    version_flags = frame[0]
+    options = {}
+    offset = FRAME_HEADER_SIZE
+    if version_flags & FRAME_FLAG_TX_POWER:
+        options['tx_power'] = struct.unpack_from('>b', frame, offset)[0]
+        offset += 1
+    if version_flags & FRAME_FLAG_SF:
+        options['sf'] = frame[offset]
+        offset += 1
+    return options, offset
+
+def frame_seq(frame):
+    # Sequence number of an encoded frame, the one its acknowledgement carries.
+    return frame[2]
+
+class PacketEncoder:
+    # Encodes packets into frames for one node, numbering the frames as it goes.
+    # Pass a DeltaEncoder to send repeated sensor streams as deltas; without auto_ack,
+    # call ack() with the sequence number of each acknowledged frame.
+    # tx_power may be set to a function returning the TX power (dBm) the frames will be
+    # sent with, which is then carried in each frame for the receiver's link estimate.
+    # link_sf likewise returns the spreading factor to propose to the peer (normally
+    # AdrController.proposal).
+    def __init__(self, node_id, delta_encoder=None, tx_power=None, link_sf=None):
+        self.node_id = node_id
+        self.delta_encoder = delta_encoder
+        self.tx_power = tx_power
+        self.link_sf = link_sf
+        self.seq = 0
+        # frame seq -> [(stream, stream seq), ...] of its stream-coded records
+        self._frames = {}
+
+    def encode(self, packets):
+        # Encode one or more packets into a single frame.
+        return self.encode_records([self.encode_record(packet) for packet in packets])
+
+    def encode_record(self, packet):
+        return encode_record(packet, self.delta_encoder)
+
+    def encode_records(self, records):
+        # Build a frame from records already produced by encode_record().
+        flags = 0
+        options = b''
+        if self.tx_power is not None:
+            flags |= FRAME_FLAG_TX_POWER
+            options += struct.pack('>b', self.tx_power())
+        if self.link_sf is not None:
+            flags |= FRAME_FLAG_SF
+            options += bytes((self.link_sf(),))
+        header = struct.pack(FRAME_HEADER, (WIRE_VERSION << 4) | flags, self.node_id, self.seq, len(records)) + options
+        delta_encoder = self.delta_encoder
+        if delta_encoder is not None and not delta_encoder.auto_ack:
+            streams = [delta_encoder.stream_seq(record) for record in records]
+            self._frames[self.seq] = [stream for stream in streams if stream is not None]
+            self._frames.pop((self.seq - DeltaEncoder.PENDING) & 0xFF, None)
+        self.seq = (self.seq + 1) & 0xFF
+        return header + b''.join(records)
+
+    def header_size(self):
+        # Bytes of frame header, including the optional fields, in front of the records.
+        return FRAME_HEADER_SIZE + (1 if self.tx_power is not None else 0) + (1 if self.link_sf is not None else 0)
+
+    def ack(self, seq):
+        # The peer acknowledged frame seq: its stream-coded values become delta references.
+        for stream, stream_seq in self._frames.pop(seq, ()):
+            self.delta_encoder.ack(stream, stream_seq)
+
+class PacketDecoder:
+    # Gateway-side decoder for frames produced by PacketEncoder.
+    def __init__(self):
+        self.delta_decoder = DeltaDecoder()
+
+    def decode(self, frame):
+        # Returns (node id, frame sequence number, list of packet dicts).
+        version_flags, node_id, seq, count = struct.unpack_from(FRAME_HEADER, frame, 0)
+        if (version_flags >> 4) not in WIRE_VERSIONS:
+            raise ValueError("Unsupported wire format version: {}".format(version_flags >> 4))
+        if version_flags & FRAME_FLAG_ACK:
+            return node_id, seq, []
+        options, offset = frame_options(frame)
+        packets = []
+        for _ in range(count):
+            packet, offset = decode_record(frame, offset, self.delta_decoder, node_id)
+            packets.append(packet)
+        return node_id, seq, packets
+
+# Longest time a record may wait for others to share its frame, in seconds, indexed by
+# priority code (Highest, High, Moderate, Best Effort)
+DEFAULT_HOLD_TIMES = (0, 2, 10, 30)
+
+class FrameAggregator:
+    # Packs records from the same or different sensors into one frame, so a BME or PMU
+    # tick costs one preamble and frame header instead of one per reading.
+    # A frame is emitted when the next record would not fit in the MTU, when adding it
+    # would cost more airtime than sending it on its own (or exceed max_airtime_us), or
+    # when the oldest record reaches the hold time of its priority class.
+    # time_on_air is a function returning the airtime in us of a frame of the given
+    # length, normally SX126X.getTimeOnAir; without it only the MTU is checked.
+    # defer(length, priority) may return the seconds to hold back a frame that is due
+    # (e.g. LinkManager.defer while the duty-cycle budget is short); its records stay
+    # pending and later readings merge into the same frame.
+    def __init__(self, encoder, time_on_air=None, mtu=SX126X_MAX_PACKET_LENGTH,
+                 hold_times=DEFAULT_HOLD_TIMES, max_airtime_us=0, clock=time.time, defer=None):
+        self.encoder = encoder
+        self.time_on_air = time_on_air
+        self.mtu = mtu
+        self.hold_times = hold_times
+        self.max_airtime_us = max_airtime_us
+        self._clock = clock
+        self.defer = defer
+        self._records = []
+        self._size = self.encoder.header_size()
+        self._deadline = None
+        self._priority = None
+
+    def __len__(self):
+        return len(self._records)
+
+    def add(self, packet):
+        # Add a packet. Returns the list of frames that are ready to transmit.
+        frames = []
+        record = self.encoder.encode_record(packet)
+        if self._records and not self._worth_adding(len(record)):
+            frames.append(self._emit())
+
+        self._records.append(record)
+        self._size += len(record)
+        priority = packet.classification.priority
+        deadline = self._clock() + self.hold_times[priority]
+        if self._deadline is None or deadline < self._deadline:
+            self._deadline = deadline
+        if self._priority is None or priority < self._priority:
+            self._priority = priority
+
+        frames.extend(self.poll())
+        return frames
+
+    def poll(self):
+        # Return the pending frame as a one-element list once its hold time has expired.
+        if self._records and self._clock() >= self._deadline:
+            if self.defer is not None:
+                wait = self.defer(self._size, self._priority)
+                if wait > 0:
+                    self._deadline = self._clock() + wait
+                    return []
+            return [self._emit()]
+        return []
+
+    def flush(self):
+        # Return everything pending as a frame, regardless of hold times.
+        if self._records:
+            return [self._emit()]
+        return []
+
+    def next_deadline(self):
+        # Time (in clock units) at which poll() will next emit a frame, or None.
+        return self._deadline
+
+    def _worth_adding(self, record_len):
+        size = self._size + record_len
+        if size > self.mtu:
+            return False
+        if self.time_on_air is None:
+            return True
+        airtime = self.time_on_air(size)
+        if self.max_airtime_us and airtime > self.max_airtime_us:
+            return False
+        # Extra airtime for riding along, against a frame of its own
+        return airtime - self.time_on_air(self._size) < self.time_on_air(self.encoder.header_size() + record_len)
+
+    def _emit(self):
+        frame = self.encoder.encode_records(self._records)
+        self._records = []
+        self._size = self.encoder.header_size()
+        self._deadline = None
+        self._priority = None
+        return frame
@@ -30,14 +30,23 @@ from sys import implementation
 if implementation.name == 'micropython':
   from utime import sleep_ms
 
-if implementation.name == 'circuitpython':
+if implementation.name != 'micropython':
     from time import sleep
     def sleep_ms(ms):
         sleep(ms/1000)
 
+if implementation.name not in ('micropython', 'circuitpython'):
+    # Host Python, e.g. running the driver against emulator.py
+    def const(x):
+        return x
+
 def ASSERT(state):
     assert state == ERR_NONE, ERROR[state]
 
+def errorState(e):
+    # State code of an AssertionError raised by ASSERT(), looked up by its message.
+    return ERROR_CODE.get(str(e), ERR_UNKNOWN)
+
 def yield_():
     sleep_ms(1)
 
@@ -438,3 +447,6 @@ ERROR = {
     -804: 'ERR_INVALID_PACKET_TYPE',
     -805: 'ERR_INVALID_PACKET_LENGTH'
     }
+
+# Reverse of ERROR, from message to state code
+ERROR_CODE = {name: code for code, name in ERROR.items()}
@@ -0,0 +1,310 @@
+import asyncio
+from _sx126x import *
+from sx126x import ticks_ms, ticks_add, ticks_diff
+from sx1262 import SX1262
+
+try:
+    ThreadSafeFlag = asyncio.ThreadSafeFlag
+    wait_for_ms = asyncio.wait_for_ms
+except AttributeError:
+    # Host Python (e.g. with emulator.py): DIO1 handlers run in the event loop's thread,
+    # so an Event that clears itself on wake-up behaves like ThreadSafeFlag
+    class ThreadSafeFlag(asyncio.Event):
+        async def wait(self):
+            await super().wait()
+            self.clear()
+
+    def wait_for_ms(awaitable, timeout_ms):
+        return asyncio.wait_for(awaitable, timeout_ms / 1000)
+
+class AsyncSX1262(SX1262):
+    # SX1262 with coroutine send/recv for use alongside other asyncio tasks.
+    # The DIO1 interrupt only sets a ThreadSafeFlag; the waiting coroutine then reads the
+    # IRQ status and the packet over SPI in task context. A lock gives one coroutine the
+    # radio at a time, and a send wakes a pending recv so the receiver gives the radio up
+    # for the transmission and goes back to listening afterwards.
+    # With an RxRing attached (setRxRing), the DIO1 handler copies each frame into the ring
+    # and restarts reception whenever the radio is listening with no SPI transfer in
+    # progress, so frames keep arriving while the consumer of recv() is busy.
+    # scanChannel() runs CAD the same way, for listen-before-talk.
+    # sendAll() streams frames back to back: the next frame is staged in the data buffer
+    # while the current one is on air, and the DIO1 handler starts it on TX_DONE. The
+    # handler only touches SPI while the task is waiting (_irqSpi); a TX_DONE that comes
+    # in while the task is still staging is left for the task (_dio1Pending).
+
+    def __init__(self, spi_bus, clk, mosi, miso, cs, irq, rst, gpio):
+        super().__init__(spi_bus, clk, mosi, miso, cs, irq, rst, gpio)
+        self._flag = ThreadSafeFlag()
+        self._lock = asyncio.Lock()
+        self._receiving = False
+        self._listening = False
+        self._sendsPending = 0
+        self._stream = False
+        self._irqSpi = False
+        self._dio1Pending = False
+        self._txDone = 0
+        self._txFired = 0
+
+    def begin(self, *args, **kwargs):
+        kwargs['blocking'] = True
+        state = super().begin(*args, **kwargs)
+        super().setDio1Action(self._onDio1)
+        return state
+
+    def beginFSK(self, *args, **kwargs):
+        kwargs['blocking'] = True
+        state = super().beginFSK(*args, **kwargs)
+        super().setDio1Action(self._onDio1)
+        return state
+
+    async def send(self, data):
+        # Transmit data and wait for TX_DONE. Returns (length, state) like SX1262.send().
+        if not (isinstance(data, bytes) or isinstance(data, bytearray)):
+            return 0, ERR_INVALID_PACKET_TYPE
+
+        self._listening = False
+        self._sendsPending += 1
+        self._flag.set()
+        async with self._lock:
+            self._sendsPending -= 1
+            self._receiving = False
+
+            if self.getPacketType() == SX126X_PACKET_TYPE_LORA:
+                timeout_ms = (self.getTimeOnAir(len(data)) * 3) // 2000 + 1
+            else:
+                timeout_ms = (self.getTimeOnAir(len(data)) * 5) // 1000 + 1
+
+            state = super().standby()
+            if state != ERR_NONE:
+                return 0, state
+
+            self._flag.clear()
+            state = self._call(super().startTransmit, data, len(data))
+            if state != ERR_NONE:
+                return 0, state
+
+            if not await self._wait(timeout_ms):
+                state = ERR_TX_TIMEOUT
+            self.clearIrqStatus()
+            self.standby()
+            return len(data), state
+
+    async def sendAll(self, frames):
+        # Transmit an iterable of frames back to back, pipelining each into the data buffer
+        # behind the previous one. A frame that does not fit beside the one on air goes out
+        # with a normal startTransmit() once that one is done. Returns (frames sent, state).
+        self._listening = False
+        self._sendsPending += 1
+        self._flag.set()
+        async with self._lock:
+            self._sendsPending -= 1
+            self._receiving = False
+
+            it = iter(frames)
+            frame = next(it, None)
+            if frame is None:
+                return 0, ERR_NONE
+            if self.getPacketType() == SX126X_PACKET_TYPE_LORA:
+                timeout_ms = (self.getTimeOnAir(SX126X_MAX_PACKET_LENGTH) * 3) // 2000 + 1
+            else:
+                timeout_ms = (self.getTimeOnAir(SX126X_MAX_PACKET_LENGTH) * 5) // 1000 + 1
+
+            state = super().standby()
+            if state != ERR_NONE:
+                return 0, state
+
+            self._txDone = 0
+            self._txFired = 0
+            self._dio1Pending = False
+            self._stream = True
+            try:
+                while True:
+                    if frame is not None and self._txDone == self._txFired:
+                        # Nothing on air: start the frame the normal way
+                        if not (isinstance(frame, bytes) or isinstance(frame, bytearray)):
+                            state = ERR_INVALID_PACKET_TYPE
+                            break
+                        self._flag.clear()
+                        state = self._call(super().startTransmit, frame, len(frame))
+                        if state != ERR_NONE:
+                            break
+                        self._txFired += 1
+                        frame = next(it, None)
+
+                    if frame is not None and not self.hasStaged() and \
+                            (isinstance(frame, bytes) or isinstance(frame, bytearray)):
+                        if self._call(self.stageTransmit, frame, len(frame)) == ERR_NONE:
+                            frame = next(it, None)
+
+                    if self._txDone == self._txFired:
+                        break
+
+                    done = self._txDone
+                    self._irqSpi = True
+                    if self._dio1Pending:
+                        self._irqSpi = False
+                        self._dio1Pending = False
+                        self._onTxDone()
+                        self._irqSpi = True
+                    while self._txDone == done:
+                        if not await self._wait(timeout_ms):
+                            state = ERR_TX_TIMEOUT
+                            break
+                    self._irqSpi = False
+                    if state != ERR_NONE:
+                        break
+            finally:
+                self._irqSpi = False
+                self._stream = False
+                self._staged = None
+
+            self.clearIrqStatus()
+            self.standby()
+            return self._txDone, state
+
+    async def scanChannel(self, timeout_ms=100):
+        # Channel activity detection without blocking other tasks. Returns LORA_DETECTED,
+        # CHANNEL_FREE or an error state, like SX126X.scanChannel().
+        self._listening = False
+        self._sendsPending += 1
+        self._flag.set()
+        async with self._lock:
+            self._sendsPending -= 1
+            self._receiving = False
+            if self.getPacketType() != SX126X_PACKET_TYPE_LORA:
+                return ERR_WRONG_MODEM
+
+            state = super().standby()
+            if state != ERR_NONE:
+                return state
+            self._flag.clear()
+            state = self.setDioIrqParams(SX126X_IRQ_CAD_DETECTED | SX126X_IRQ_CAD_DONE, SX126X_IRQ_CAD_DETECTED | SX126X_IRQ_CAD_DONE)
+            state |= self.clearIrqStatus()
+            state |= self.setCad()
+            if state != ERR_NONE:
+                return ERR_UNKNOWN
+
+            if not await self._wait(timeout_ms):
+                self.standby()
+                return ERR_RX_TIMEOUT
+            cadResult = self.getIrqStatus()
+            self.clearIrqStatus()
+            if cadResult & SX126X_IRQ_CAD_DETECTED:
+                return LORA_DETECTED
+            if cadResult & SX126X_IRQ_CAD_DONE:
+                return CHANNEL_FREE
+            return ERR_UNKNOWN
+
+    async def apply(self, profile):
+        # SX1262.apply() with the radio taken from a pending recv like send() does; the
+        # receiver starts listening again with the new settings.
+        self._listening = False
+        self._sendsPending += 1
+        self._flag.set()
+        async with self._lock:
+            self._sendsPending -= 1
+            self._receiving = False
+            state = super().standby()
+            if state != ERR_NONE:
+                return state
+            return self._call(super().apply, profile)
+
+    async def recv(self, timeout_ms=0):
+        # Listen until a packet arrives or timeout_ms passes (0 waits forever).
+        # Returns (data, state, rssi, snr); data is b'' unless state is ERR_NONE or ERR_CRC_MISMATCH.
+        deadline = ticks_add(ticks_ms(), timeout_ms) if timeout_ms else None
+        ring = self._rxRing
+        while True:
+            async with self._lock:
+                self._listening = False
+                if ring is not None and len(ring):
+                    return self._popRing()
+
+                if not self._receiving:
+                    self._flag.clear()
+                    state = self._call(self.startListening)
+                    if state != ERR_NONE:
+                        return b'', state, 0.0, 0.0
+                    self._receiving = True
+
+                remaining = 0
+                if deadline is not None:
+                    remaining = ticks_diff(deadline, ticks_ms())
+                    if remaining <= 0:
+                        remaining = -1
+
+                self._listening = ring is not None
+                woke = remaining >= 0 and await self._wait(remaining)
+                self._listening = False
+                if ring is not None and len(ring):
+                    return self._popRing()
+
+                if self.getIrqStatus() & SX126X_IRQ_RX_DONE:
+                    if ring is not None:
+                        self._readIntoRing()
+                        if len(ring):
+                            return self._popRing()
+                        continue
+                    self._receiving = False
+                    return self._readFrame()
+
+                if not woke:
+                    self._receiving = False
+                    self.standby()
+                    return b'', ERR_RX_TIMEOUT, 0.0, 0.0
+            # Woken by a send: the lock passes to the sender, then we listen again
+
+    async def _wait(self, timeout_ms):
+        # Wait for DIO1 (or a send asking for the radio); False on timeout.
+        if self._sendsPending and self._receiving:
+            return True
+        if not timeout_ms:
+            await self._flag.wait()
+            return True
+        try:
+            await wait_for_ms(self._flag.wait(), timeout_ms)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def _readFrame(self):
+        length = super().getPacketLength()
+        data = bytearray(length)
+        state = self._call(super().readData, memoryview(data), length)
+        if state != ERR_NONE and state != ERR_CRC_MISMATCH:
+            return b'', state, 0.0, 0.0
+        self._noteFrame(length)
+        return bytes(data), state, super().getRSSI(), super().getSNR()
+
+    def _popRing(self):
+        # The radio is still in RX after _readIntoRing, so let DIO1 fill the ring again
+        data, state, rssi, snr, ticks = self._rxRing.get()
+        self._listening = True
+        return data, state, rssi, snr
+
+    def _call(self, func, *args):
+        try:
+            return func(*args)
+        except AssertionError as e:
+            return errorState(e)
+
+    def _onTxDone(self):
+        # TX_DONE while streaming: count it and start the staged frame straight away.
+        if not super().getIrqStatus() & SX126X_IRQ_TX_DONE:
+            return
+        self._txDone += 1
+        if self.hasStaged():
+            if self._call(self.fireStaged) == ERR_NONE:
+                self._txFired += 1
+        else:
+            self.clearIrqStatus()
+
+    def _onDio1(self, pin):
+        if self._stream:
+            if self._irqSpi:
+                self._onTxDone()
+            else:
+                self._dio1Pending = True
+        elif self._listening and super().getIrqStatus() & SX126X_IRQ_RX_DONE:
+            self._readIntoRing()
+        self._flag.set()
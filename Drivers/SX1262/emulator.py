@@ -0,0 +1,670 @@
+import asyncio
+import random
+import sys
+import time
+from math import ceil
+from _sx126x import *
+
+# SPI-level emulation of the SX126x for running the driver on a host without the board.
+#
+# SX126xEmulator answers the SPI transactions the driver clocks with write_readinto
+# (opcodes, status bytes, registers, the 256-byte data buffer, IRQ status, packet status
+# and RSSI) and drives the BUSY and DIO1 lines. install() puts a stand-in machine module
+# with SPI, Pin and RTC in sys.modules, so SX126X/SX1262 pick the emulator up by the SPI bus
+# and pin numbers they are constructed with. Emulated radios attached to the same
+# VirtualChannel hear each other's transmissions, with configurable RSSI/SNR, packet
+# loss and CRC errors per link, collisions between overlapping frames and CAD.
+#
+#     import emulator
+#     channel = emulator.VirtualChannel(loss=0.1)
+#     emulator.SX126xEmulator(channel, spi_bus=1, cs=10, irq=1, rst=5, gpio=4)
+#     emulator.SX126xEmulator(channel, spi_bus=2, cs=20, irq=21, rst=22, gpio=23)
+#     emulator.install()
+#     from sx1262 import SX1262
+#     tx = SX1262(1, 12, 11, 13, 10, 1, 5, 4)
+#     rx = SX1262(2, 12, 11, 13, 20, 21, 22, 23)
+#
+# Timing follows the host clock: frames take their time on air (scaled by time_scale,
+# 0 for instant delivery), and BUSY stays high for busy_us after every command. Events
+# are processed whenever an emulated radio is accessed, or by VirtualChannel.update().
+# DIO1 handlers run on the rising edge, deferred to the end of the SPI transaction in
+# progress like a MicroPython soft interrupt.
+
+LORA_BANDWIDTH_KHZ = {0x00: 7.81, 0x08: 10.42, 0x01: 15.63, 0x09: 20.83, 0x02: 31.25,
+                      0x0A: 41.67, 0x03: 62.5, 0x04: 125.0, 0x05: 250.0, 0x06: 500.0}
+
+_MODE_SLEEP = 0x00
+_MODE_STDBY_RC = SX126X_STATUS_MODE_STDBY_RC
+_MODE_STDBY_XOSC = SX126X_STATUS_MODE_STDBY_XOSC
+_MODE_FS = SX126X_STATUS_MODE_FS
+_MODE_RX = SX126X_STATUS_MODE_RX
+_MODE_TX = SX126X_STATUS_MODE_TX
+
+# Read commands: opcode -> bytes before the status byte (opcode plus address/offset)
+_READ_HEADER = {SX126X_CMD_GET_STATUS: 1, SX126X_CMD_GET_PACKET_TYPE: 1, SX126X_CMD_GET_IRQ_STATUS: 1,
+                SX126X_CMD_GET_RX_BUFFER_STATUS: 1, SX126X_CMD_GET_PACKET_STATUS: 1,
+                SX126X_CMD_GET_RSSI_INST: 1, SX126X_CMD_GET_DEVICE_ERRORS: 1, SX126X_CMD_GET_STATS: 1,
+                SX126X_CMD_READ_BUFFER: 2, SX126X_CMD_READ_REGISTER: 3}
+
+# Register contents after reset that the driver reads back
+_REGISTER_DEFAULTS = {SX126X_REG_LORA_SYNC_WORD_MSB: 0x14, SX126X_REG_LORA_SYNC_WORD_LSB: 0x24,
+                      SX126X_REG_OCP_CONFIGURATION: 0x18, SX126X_REG_IQ_CONFIG: 0x0D,
+                      SX126X_REG_SENSITIVITY_CONFIG: 0x04, SX126X_REG_TX_CLAMP_CONFIG: 0xC8,
+                      SX126X_REG_RX_GAIN: 0x94}
+
+_CAD_SYMBOLS = (1, 2, 4, 8, 16)
+_NOISE_FLOOR = -120.0
+
+class _Transmission:
+    __slots__ = ('sender', 'payload', 'key', 'start', 'end', 'receivers', 'collided')
+
+    def __init__(self, sender, payload, key, start, end, receivers):
+        self.sender = sender
+        self.payload = payload
+        self.key = key
+        self.start = start
+        self.end = end
+        self.receivers = receivers
+        self.collided = set()
+
+class VirtualChannel:
+    # Air shared by emulated radios. A frame reaches every other radio that was listening
+    # with the same packet type, frequency, modulation, sync word and IQ setting when it
+    # started and still is when it ends, unless it is lost (loss probability), collides
+    # with another frame overlapping it at that receiver, or arrives corrupted (crc_error
+    # probability, delivered with CRC_ERR). rssi, snr, loss and crc_error are defaults
+    # that setLink() overrides per sender/receiver pair.
+    def __init__(self, loss=0.0, crc_error=0.0, rssi=-60.0, snr=9.0, seed=None, clock=time.monotonic):
+        self.loss = loss
+        self.crc_error = crc_error
+        self.rssi = rssi
+        self.snr = snr
+        self.clock = clock
+        self.radios = []
+        self._links = {}
+        self._air = []
+        self._rng = random.Random(seed)
+        self._updating = False
+        self.sent = 0
+        self.delivered = 0
+        self.lost = 0
+        self.collisions = 0
+
+    def attach(self, radio):
+        self.radios.append(radio)
+
+    def setLink(self, sender, receiver, rssi=None, snr=None, loss=None, crc_error=None):
+        link = dict(self.link(sender, receiver))
+        for name, value in (('rssi', rssi), ('snr', snr), ('loss', loss), ('crc_error', crc_error)):
+            if value is not None:
+                link[name] = value
+        self._links[(id(sender), id(receiver))] = link
+
+    def link(self, sender, receiver):
+        # Link conditions from sender to receiver: dict of rssi, snr, loss and crc_error.
+        link = self._links.get((id(sender), id(receiver)))
+        if link is None:
+            link = {'rssi': self.rssi, 'snr': self.snr, 'loss': self.loss, 'crc_error': self.crc_error}
+        return link
+
+    def transmit(self, sender, payload, key, duration):
+        now = self.clock()
+        receivers = [radio for radio in self.radios if radio is not sender and radio.listeningOn(key)]
+        tx = _Transmission(sender, payload, key, now, now + duration, receivers)
+        for other in self._air:
+            if other.key == key and other.end > now:
+                for radio in receivers:
+                    if radio in other.receivers:
+                        tx.collided.add(radio)
+                        other.collided.add(radio)
+        self._air.append(tx)
+        self.sent += 1
+        return tx
+
+    def busy(self, radio, key):
+        # True if another radio is transmitting on key (what CAD detects).
+        now = self.clock()
+        return any(tx.sender is not radio and tx.key == key and tx.start <= now < tx.end for tx in self._air)
+
+    def strongest(self, radio, key):
+        # RSSI of the strongest transmission radio hears on key, or None.
+        now = self.clock()
+        levels = [self.link(tx.sender, radio)['rssi'] for tx in self._air
+                  if tx.sender is not radio and tx.key == key and tx.start <= now < tx.end]
+        return max(levels) if levels else None
+
+    async def run(self, interval_ms=1):
+        # Keep delivering frames and firing DIO1 while coroutines wait on the radios (the
+        # asynchronous driver waits for DIO1 without touching the radio).
+        while True:
+            self.update()
+            await asyncio.sleep(interval_ms / 1000)
+
+    def update(self, now=None):
+        # Finish every transmission whose time on air has passed, and the radios' timers.
+        if self._updating:
+            return
+        self._updating = True
+        try:
+            if now is None:
+                now = self.clock()
+            done = [tx for tx in self._air if tx.end <= now]
+            if done:
+                self._air = [tx for tx in self._air if tx.end > now]
+            for tx in done:
+                tx.sender._txEnded(tx)
+                for radio in tx.receivers:
+                    if radio in tx.collided:
+                        self.collisions += 1
+                        self.lost += 1
+                        continue
+                    link = self.link(tx.sender, radio)
+                    if not radio.listeningOn(tx.key) or self._rng.random() < link['loss']:
+                        self.lost += 1
+                        continue
+                    corrupted = self._rng.random() < link['crc_error']
+                    radio._receive(tx.payload, link['rssi'], link['snr'], corrupted)
+                    self.delivered += 1
+            for radio in self.radios:
+                radio._timers(now)
+        finally:
+            self._updating = False
+
+class SX126xEmulator:
+    # One emulated SX126x. spi_bus and the cs/irq/rst/gpio pin numbers are those given to
+    # SX126X(); irq is the DIO1 line and gpio the BUSY line, as the driver uses them.
+    def __init__(self, channel=None, spi_bus=2, cs=10, irq=1, rst=5, gpio=4, busy_us=0, time_scale=1.0,
+                 clock=time.monotonic):
+        self.channel = channel if channel is not None else VirtualChannel(clock=clock)
+        self.channel.attach(self)
+        self.spi_bus = spi_bus
+        self.pins = {cs: 'cs', irq: 'dio1', rst: 'rst', gpio: 'busy'}
+        self.busy_us = busy_us
+        self.time_scale = time_scale
+        self.clock = clock
+        self._handler = None
+        self._selected = False
+        self._dio1 = False
+        self._pendingEdge = False
+        self.commands = 0
+        self.bytes = 0
+        self.transmitted = 0
+        self.received = 0
+        _EMULATORS.append(self)
+        self._reset()
+
+    def _reset(self):
+        self.mode = _MODE_STDBY_RC
+        self.buffer = bytearray(256)
+        self.registers = bytearray(0x1000)
+        for addr, value in _REGISTER_DEFAULTS.items():
+            self.registers[addr] = value
+        self.packetType = SX126X_PACKET_TYPE_GFSK
+        self.frf = 0
+        self.modulation = bytes(8)
+        self.packetParams = bytes(9)
+        self.power = 0
+        self.txBase = 0
+        self.rxBase = 0
+        self.rxLength = 0
+        self.rxStart = 0
+        self.irqStatus = 0
+        self.irqMask = 0
+        self.dio1Mask = 0
+        self.fallback = _MODE_STDBY_RC
+        self.cadParams = bytes(7)
+        self.packetRssi = 0.0
+        self.packetSnr = 0.0
+        self.continuous = False
+        self.dutyCycle = False
+        self.busyUntil = 0.0
+        self.rxDeadline = None
+        self.cadEnd = None
+        self._tx = None
+        self._updateDio1()
+
+    # Lines and SPI, as seen through the stand-in machine module
+
+    def busy(self):
+        self.channel.update()
+        return self.mode == _MODE_SLEEP or self.clock() < self.busyUntil
+
+    def dio1(self):
+        self.channel.update()
+        return self._dio1
+
+    def select(self, selected):
+        # NSS: a falling edge wakes the chip from sleep, a rising edge ends the transaction.
+        self._selected = selected
+        if selected and self.mode == _MODE_SLEEP:
+            self.mode = _MODE_STDBY_RC
+            self.busyUntil = self.clock() + 0.0035 * self.time_scale
+        if not selected:
+            self._runHandler()
+
+    def resetLine(self, level):
+        if not level:
+            self.mode = _MODE_SLEEP
+        elif self.mode == _MODE_SLEEP:
+            self._reset()
+
+    def setHandler(self, handler, pin):
+        self._handler = (handler, pin) if handler is not None else None
+
+    def transfer(self, out, in_):
+        # One SPI transaction: out is clocked in, the response into in_.
+        self.channel.update()
+        self.commands += 1
+        self.bytes += len(out)
+        opcode = out[0]
+        handler = _COMMANDS.get(opcode)
+        response = None
+        if handler is None:
+            status = self._status(SX126X_STATUS_CMD_INVALID)
+        else:
+            response = handler(self, bytes(out[1:])) if opcode not in _READ_HEADER else \
+                handler(self, bytes(out[1:_READ_HEADER[opcode]]), len(out) - _READ_HEADER[opcode] - 1)
+            status = self._status()
+        for i in range(len(in_)):
+            in_[i] = status
+        if response is not None:
+            start = _READ_HEADER[opcode] + 1
+            for i, value in enumerate(response[:len(in_) - start]):
+                in_[start + i] = value
+        if self.mode != _MODE_SLEEP:
+            self.busyUntil = self.clock() + self.busy_us / 1000000
+        self._updateDio1()
+
+    # Internals
+
+    def _status(self, commandStatus=0):
+        if not commandStatus and self.irqStatus & SX126X_IRQ_RX_DONE:
+            commandStatus = SX126X_STATUS_DATA_AVAILABLE
+        return (self.mode if self.mode != _MODE_SLEEP else _MODE_STDBY_RC) | commandStatus
+
+    def _raise(self, flags):
+        self.irqStatus |= flags & self.irqMask
+        self._updateDio1()
+
+    def _updateDio1(self):
+        level = bool(self.irqStatus & self.dio1Mask)
+        if level and not self._dio1:
+            self._pendingEdge = True
+        self._dio1 = level
+        if not self._selected:
+            self._runHandler()
+
+    def _runHandler(self):
+        if self._pendingEdge and self._handler is not None:
+            self._pendingEdge = False
+            handler, pin = self._handler
+            handler(pin)
+        self._pendingEdge = False
+
+    def key(self):
+        # What a receiver has to match: packet type, frequency, modulation, sync word and IQ.
+        if self.packetType == SX126X_PACKET_TYPE_LORA:
+            sync = bytes(self.registers[SX126X_REG_LORA_SYNC_WORD_MSB:SX126X_REG_LORA_SYNC_WORD_LSB + 1])
+            return (self.packetType, self.frf, self.modulation[:3], sync, self.packetParams[5])
+        sync = bytes(self.registers[SX126X_REG_SYNC_WORD_0:SX126X_REG_SYNC_WORD_0 + (self.packetParams[3] + 7) // 8])
+        return (self.packetType, self.frf, self.modulation[:3], sync)
+
+    def listeningOn(self, key):
+        return self.mode == _MODE_RX and self.cadEnd is None and self.key() == key
+
+    def timeOnAir(self, length):
+        # Seconds on air for a payload of length bytes with the current settings.
+        if self.packetType == SX126X_PACKET_TYPE_LORA:
+            sf, bw, cr, ldro = self.modulation[0], LORA_BANDWIDTH_KHZ.get(self.modulation[1], 125.0), \
+                self.modulation[2], self.modulation[3]
+            symbol = (1 << sf) / (bw * 1000)
+            preamble = (self.packetParams[0] << 8) | self.packetParams[1]
+            implicit = 1 if self.packetParams[2] else 0
+            crc = 1 if self.packetParams[4] else 0
+            payload = 8 + max(ceil((8 * length - 4 * sf + 28 + 16 * crc - 20 * implicit) /
+                                   (4 * (sf - 2 * (1 if ldro else 0)))) * (cr + 4), 0)
+            return (preamble + 4.25 + payload) * symbol
+        raw = (self.modulation[0] << 16) | (self.modulation[1] << 8) | self.modulation[2]
+        bitrate = 32 * SX126X_CRYSTAL_FREQ * 1000000 / raw if raw else 1
+        preamble = (self.packetParams[0] << 8) | self.packetParams[1]
+        crcType = self.packetParams[7]
+        crcBytes = 0 if crcType == 0x01 else (2 if crcType & 0x02 else 1)
+        header = (1 if self.packetParams[5] else 0) + (1 if self.packetParams[4] else 0)
+        return (preamble + self.packetParams[3] + 8 * (length + header + crcBytes)) / bitrate
+
+    def _payloadLength(self):
+        return self.packetParams[3] if self.packetType == SX126X_PACKET_TYPE_LORA else self.packetParams[6]
+
+    def _startTx(self):
+        length = self._payloadLength()
+        payload = bytes(self.buffer[(self.txBase + i) & 0xFF] for i in range(length))
+        self.mode = _MODE_TX
+        self._tx = self.channel.transmit(self, payload, self.key(), self.timeOnAir(length) * self.time_scale)
+
+    def _txEnded(self, tx):
+        if tx is not self._tx:
+            return
+        self._tx = None
+        self.transmitted += 1
+        self.mode = self.fallback
+        self._raise(SX126X_IRQ_TX_DONE)
+
+    def _receive(self, payload, rssi, snr, corrupted):
+        length = len(payload)
+        for i in range(length):
+            self.buffer[(self.rxBase + i) & 0xFF] = payload[i]
+        self.rxLength = length
+        self.rxStart = self.rxBase
+        self.packetRssi = rssi
+        self.packetSnr = snr
+        self.received += 1
+        if not self.continuous:
+            self.mode = self.fallback
+            self.rxDeadline = None
+        flags = SX126X_IRQ_PREAMBLE_DETECTED | SX126X_IRQ_SYNC_WORD_VALID | SX126X_IRQ_HEADER_VALID | SX126X_IRQ_RX_DONE
+        if corrupted:
+            flags |= SX126X_IRQ_CRC_ERR
+        self._raise(flags)
+
+    def _timers(self, now):
+        if self.cadEnd is not None and now >= self.cadEnd:
+            self.cadEnd = None
+            flags = SX126X_IRQ_CAD_DONE
+            if self.channel.busy(self, self.key()):
+                flags |= SX126X_IRQ_CAD_DETECTED
+            self.mode = _MODE_RX if self.cadParams[3] and flags & SX126X_IRQ_CAD_DETECTED else _MODE_STDBY_RC
+            self._raise(flags)
+        if self.rxDeadline is not None and now >= self.rxDeadline and self.mode == _MODE_RX:
+            self.rxDeadline = None
+            self.mode = self.fallback
+            self._raise(SX126X_IRQ_TIMEOUT)
+
+    def _startRx(self, timeout, continuous):
+        self.mode = _MODE_RX
+        self.continuous = continuous
+        self.rxDeadline = None
+        if timeout:
+            self.rxDeadline = self.clock() + timeout * 15.625 / 1000000 * self.time_scale
+
+    # Commands: write commands take the bytes after the opcode, read commands the header
+    # bytes after the opcode and the number of bytes to return
+
+    def _setStandby(self, data):
+        self._stopTx()
+        self.mode = _MODE_STDBY_XOSC if data and data[0] == SX126X_STANDBY_XOSC else _MODE_STDBY_RC
+        self.rxDeadline = None
+        self.cadEnd = None
+
+    def _stopTx(self):
+        if self._tx is not None:
+            self._tx.end = self.clock()
+            self._tx.collided.update(self._tx.receivers)
+            self._tx = None
+
+    def _setSleep(self, data):
+        self._stopTx()
+        warm = data and data[0] & SX126X_SLEEP_START_WARM
+        self.mode = _MODE_SLEEP
+        if not warm:
+            self._reset()
+            self.mode = _MODE_SLEEP
+
+    def _setFs(self, data):
+        self.mode = _MODE_FS
+
+    def _setTx(self, data):
+        self._startTx()
+
+    def _setRx(self, data):
+        timeout = (data[0] << 16) | (data[1] << 8) | data[2]
+        self._startRx(0 if timeout == SX126X_RX_TIMEOUT_INF else timeout, timeout == SX126X_RX_TIMEOUT_INF)
+
+    def _setRxDutyCycle(self, data):
+        # Listening the whole time is what the duty cycle guarantees for a long enough preamble
+        self._startRx(0, False)
+
+    def _setCad(self, data):
+        sf = self.modulation[0]
+        bw = LORA_BANDWIDTH_KHZ.get(self.modulation[1], 125.0)
+        symbols = _CAD_SYMBOLS[min(self.cadParams[0], 4)]
+        self.mode = _MODE_RX
+        self.cadEnd = self.clock() + (symbols + 0.5) * (1 << sf) / (bw * 1000) * self.time_scale
+
+    def _ignore(self, data):
+        pass
+
+    def _setFallback(self, data):
+        self.fallback = data[0] if data[0] in (_MODE_FS, _MODE_STDBY_XOSC) else _MODE_STDBY_RC
+
+    def _writeRegister(self, data):
+        addr = (data[0] << 8) | data[1]
+        self.registers[addr:addr + len(data) - 2] = data[2:]
+
+    def _readRegister(self, header, count):
+        addr = (header[0] << 8) | header[1]
+        if addr == SX126X_REG_RANDOM_NUMBER_0:
+            return bytes(self.channel._rng.getrandbits(8) for _ in range(count))
+        return bytes(self.registers[addr:addr + count])
+
+    def _writeBuffer(self, data):
+        offset = data[0]
+        for i, value in enumerate(data[1:]):
+            self.buffer[(offset + i) & 0xFF] = value
+
+    def _readBuffer(self, header, count):
+        offset = header[0]
+        return bytes(self.buffer[(offset + i) & 0xFF] for i in range(count))
+
+    def _setDioIrqParams(self, data):
+        self.irqMask = (data[0] << 8) | data[1]
+        self.dio1Mask = (data[2] << 8) | data[3]
+
+    def _getIrqStatus(self, header, count):
+        return bytes(((self.irqStatus >> 8) & 0xFF, self.irqStatus & 0xFF))
+
+    def _clearIrqStatus(self, data):
+        self.irqStatus &= ~((data[0] << 8) | data[1])
+
+    def _setRfFrequency(self, data):
+        self.frf = (data[0] << 24) | (data[1] << 16) | (data[2] << 8) | data[3]
+
+    def _setPacketType(self, data):
+        self.packetType = data[0]
+
+    def _getPacketType(self, header, count):
+        return bytes((self.packetType,))
+
+    def _setTxParams(self, data):
+        self.power = data[0] - 256 if data[0] > 127 else data[0]
+
+    def _setModulationParams(self, data):
+        self.modulation = bytes(data) + bytes(8 - len(data))
+
+    def _setPacketParams(self, data):
+        self.packetParams = bytes(data) + bytes(9 - len(data))
+
+    def _setCadParams(self, data):
+        self.cadParams = bytes(data) + bytes(7 - len(data))
+
+    def _setBufferBaseAddress(self, data):
+        self.txBase = data[0]
+        self.rxBase = data[1]
+
+    def _getStatus(self, header, count):
+        return bytes((self._status(),))
+
+    def _getRxBufferStatus(self, header, count):
+        return bytes((self.rxLength, self.rxStart))
+
+    def _getPacketStatus(self, header, count):
+        rssi = min(255, max(0, int(-self.packetRssi * 2)))
+        snr = int(round(self.packetSnr * 4)) & 0xFF
+        return bytes((rssi, snr, rssi))
+
+    def _getRssiInst(self, header, count):
+        rssi = self.channel.strongest(self, self.key())
+        return bytes((min(255, max(0, int(-(rssi if rssi is not None else _NOISE_FLOOR) * 2))),))
+
+    def _getDeviceErrors(self, header, count):
+        return bytes(2)
+
+    def _getStats(self, header, count):
+        return bytes(6)
+
+_COMMANDS = {
+    SX126X_CMD_SET_SLEEP: SX126xEmulator._setSleep,
+    SX126X_CMD_SET_STANDBY: SX126xEmulator._setStandby,
+    SX126X_CMD_SET_FS: SX126xEmulator._setFs,
+    SX126X_CMD_SET_TX: SX126xEmulator._setTx,
+    SX126X_CMD_SET_RX: SX126xEmulator._setRx,
+    SX126X_CMD_STOP_TIMER_ON_PREAMBLE: SX126xEmulator._ignore,
+    SX126X_CMD_SET_RX_DUTY_CYCLE: SX126xEmulator._setRxDutyCycle,
+    SX126X_CMD_SET_CAD: SX126xEmulator._setCad,
+    SX126X_CMD_SET_REGULATOR_MODE: SX126xEmulator._ignore,
+    SX126X_CMD_CALIBRATE: SX126xEmulator._ignore,
+    SX126X_CMD_CALIBRATE_IMAGE: SX126xEmulator._ignore,
+    SX126X_CMD_SET_PA_CONFIG: SX126xEmulator._ignore,
+    SX126X_CMD_SET_RX_TX_FALLBACK_MODE: SX126xEmulator._setFallback,
+    SX126X_CMD_WRITE_REGISTER: SX126xEmulator._writeRegister,
+    SX126X_CMD_READ_REGISTER: SX126xEmulator._readRegister,
+    SX126X_CMD_WRITE_BUFFER: SX126xEmulator._writeBuffer,
+    SX126X_CMD_READ_BUFFER: SX126xEmulator._readBuffer,
+    SX126X_CMD_SET_DIO_IRQ_PARAMS: SX126xEmulator._setDioIrqParams,
+    SX126X_CMD_GET_IRQ_STATUS: SX126xEmulator._getIrqStatus,
+    SX126X_CMD_CLEAR_IRQ_STATUS: SX126xEmulator._clearIrqStatus,
+    SX126X_CMD_SET_DIO2_AS_RF_SWITCH_CTRL: SX126xEmulator._ignore,
+    SX126X_CMD_SET_DIO3_AS_TCXO_CTRL: SX126xEmulator._ignore,
+    SX126X_CMD_SET_RF_FREQUENCY: SX126xEmulator._setRfFrequency,
+    SX126X_CMD_SET_PACKET_TYPE: SX126xEmulator._setPacketType,
+    SX126X_CMD_GET_PACKET_TYPE: SX126xEmulator._getPacketType,
+    SX126X_CMD_SET_TX_PARAMS: SX126xEmulator._setTxParams,
+    SX126X_CMD_SET_MODULATION_PARAMS: SX126xEmulator._setModulationParams,
+    SX126X_CMD_SET_PACKET_PARAMS: SX126xEmulator._setPacketParams,
+    SX126X_CMD_SET_CAD_PARAMS: SX126xEmulator._setCadParams,
+    SX126X_CMD_SET_BUFFER_BASE_ADDRESS: SX126xEmulator._setBufferBaseAddress,
+    SX126X_CMD_SET_LORA_SYMB_NUM_TIMEOUT: SX126xEmulator._ignore,
+    SX126X_CMD_GET_STATUS: SX126xEmulator._getStatus,
+    SX126X_CMD_GET_RSSI_INST: SX126xEmulator._getRssiInst,
+    SX126X_CMD_GET_RX_BUFFER_STATUS: SX126xEmulator._getRxBufferStatus,
+    SX126X_CMD_GET_PACKET_STATUS: SX126xEmulator._getPacketStatus,
+    SX126X_CMD_GET_DEVICE_ERRORS: SX126xEmulator._getDeviceErrors,
+    SX126X_CMD_CLEAR_DEVICE_ERRORS: SX126xEmulator._ignore,
+    SX126X_CMD_GET_STATS: SX126xEmulator._getStats,
+}
+
+_EMULATORS = []
+
+def _find(pin):
+    # (emulator, role) wired to pin number pin, or (None, None).
+    for emulator in _EMULATORS:
+        role = emulator.pins.get(pin)
+        if role is not None:
+            return emulator, role
+    return None, None
+
+class Pin:
+    # machine.Pin stand-in: the pins of an emulated radio follow its lines, others just
+    # hold the last value written.
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id.id if isinstance(id, Pin) else id
+        self._value = value if value is not None else 0
+        self._emulator, self._role = _find(self.id)
+        if value is not None:
+            self.value(value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self.value(value)
+
+    def value(self, level=None):
+        emulator, role = self._emulator, self._role
+        if level is None:
+            if role == 'busy':
+                return 1 if emulator.busy() else 0
+            if role == 'dio1':
+                return 1 if emulator.dio1() else 0
+            return self._value
+        self._value = 1 if level else 0
+        if role == 'cs':
+            emulator.select(not self._value)
+        elif role == 'rst':
+            emulator.resetLine(self._value)
+
+    def __call__(self, level=None):
+        return self.value(level)
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def irq(self, handler=None, trigger=IRQ_RISING):
+        if self._role == 'dio1':
+            self._emulator.setHandler(handler, self)
+
+class SPI:
+    # machine.SPI stand-in routing transactions to the emulated radio on bus id.
+    MASTER = 0
+
+    def __init__(self, id, *args, **kwargs):
+        self.id = id
+        self._emulator = None
+        for emulator in _EMULATORS:
+            if emulator.spi_bus == id:
+                self._emulator = emulator
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def write_readinto(self, out, in_):
+        if self._emulator is None:
+            for i in range(len(in_)):
+                in_[i] = 0xFF
+            return
+        self._emulator.transfer(out, in_)
+
+    def write(self, out):
+        self.write_readinto(out, bytearray(len(out)))
+
+class RTC:
+    # machine.RTC stand-in for the modules that import it next to the radio (the Decision
+    # Engine): the host's local time, shifted by whatever datetime() sets, and a user
+    # memory area.
+    _offset = 0
+    _memory = b''
+
+    def datetime(self, value=None):
+        if value is None:
+            t = time.localtime(time.time() + RTC._offset)
+            return (t[0], t[1], t[2], t[6], t[3], t[4], t[5], 0)
+        year, month, day, weekday, hours, minutes, seconds, subseconds = value
+        RTC._offset = time.mktime((year, month, day, hours, minutes, seconds, 0, 0, -1)) - time.time()
+
+    def memory(self, data=None):
+        if data is None:
+            return RTC._memory
+        RTC._memory = bytes(data)
+
+def reset():
+    # Forget every emulated radio, so a new set can reuse the same bus and pin numbers.
+    del _EMULATORS[:]
+    RTC._offset = 0
+    RTC._memory = b''
+
+def install():
+    # Provide a machine module with this SPI, Pin and RTC for the driver to import.
+    module = type(sys)('machine')
+    module.SPI = SPI
+    module.Pin = Pin
+    module.RTC = RTC
+    sys.modules['machine'] = module
+    return module
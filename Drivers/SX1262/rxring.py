@@ -0,0 +1,53 @@
+from array import array
+from _sx126x import SX126X_MAX_PACKET_LENGTH
+
+class RxRing:
+    # Preallocated ring of receive slots, filled by the driver from the DIO1 interrupt
+    # and drained from a normal task. Each slot holds one frame with its state (ERR_NONE
+    # or ERR_CRC_MISMATCH), RSSI, SNR and the ticks_ms at which it was read.
+    # Only the interrupt side moves head and only the reader moves tail (both counting
+    # modulo twice the number of slots), so the two never update the same counter. A
+    # frame that arrives while every slot is full is dropped and counted in overflow.
+    def __init__(self, slots=8, size=SX126X_MAX_PACKET_LENGTH):
+        self.slots = slots
+        self.size = size
+        self._views = [memoryview(bytearray(size)) for _ in range(slots)]
+        self._lengths = array('H', [0] * slots)
+        self._states = array('h', [0] * slots)
+        self._rssi = array('f', [0] * slots)
+        self._snr = array('f', [0] * slots)
+        self._ticks = array('L', [0] * slots)
+        self._head = 0
+        self._tail = 0
+        self.received = 0
+        self.overflow = 0
+
+    def __len__(self):
+        return (self._head - self._tail) % (2 * self.slots)
+
+    def reserve(self):
+        # Interrupt side: buffer of the next free slot, or None (and an overflow) if full.
+        if len(self) >= self.slots:
+            self.overflow += 1
+            return None
+        return self._views[self._head % self.slots]
+
+    def commit(self, length, state, rssi, snr, ticks):
+        # Interrupt side: publish the slot returned by reserve().
+        i = self._head % self.slots
+        self._lengths[i] = length
+        self._states[i] = state
+        self._rssi[i] = rssi
+        self._snr[i] = snr
+        self._ticks[i] = ticks
+        self.received += 1
+        self._head = (self._head + 1) % (2 * self.slots)
+
+    def get(self):
+        # Reader side: (data, state, rssi, snr, ticks) of the oldest frame, or None if empty.
+        if not len(self):
+            return None
+        i = self._tail % self.slots
+        frame = (bytes(self._views[i][:self._lengths[i]]), self._states[i], self._rssi[i], self._snr[i], self._ticks[i])
+        self._tail = (self._tail + 1) % (2 * self.slots)
+        return frame
@@ -26,9 +26,12 @@ SOFTWARE.
 """
 
 from _sx126x import *
-from sx126x import SX126X
+from sx126x import SX126X, ticks_ms, ticks_diff
+from sx126x_profile import LoRaProfile, FSKProfile
 
 _SX126X_PA_CONFIG_SX1262 = const(0x00)
+# What setOutputPower() writes with SetPaConfig: [paDutyCycle, hpMax, deviceSel, paLut]
+_SX1262_PA_CONFIG = [0x04, SX126X_PA_CONFIG_HP_MAX, _SX126X_PA_CONFIG_SX1262, SX126X_PA_CONFIG_PA_LUT]
 
 class SX1262(SX126X):
     TX_DONE = SX126X_IRQ_TX_DONE
@@ -42,15 +45,32 @@ class SX1262(SX126X):
     PREAMBLE_DETECT_24 = SX126X_GFSK_PREAMBLE_DETECT_24
     PREAMBLE_DETECT_32 = SX126X_GFSK_PREAMBLE_DETECT_32
     STATUS = ERROR
+    RX_CONTINUOUS = 0
+    RX_DUTY_CYCLE = 1
+    # Typical supply currents (mA) from the SX1262 datasheet: LoRa RX with the DC-DC
+    # regulator, standby while the TCXO starts up, and sleep with the wake-up RTC running
+    RX_CURRENT = 4.6
+    STANDBY_CURRENT = 0.8
+    SLEEP_CURRENT = 0.0012
 
     def __init__(self, spi_bus, clk, mosi, miso, cs, irq, rst, gpio):
         super().__init__(spi_bus, clk, mosi, miso, cs, irq, rst, gpio)
         self._callbackFunction = self._dummyFunction
+        self._rxRing = None
+        self._profile = None
+        self._tcxoVoltage = 1.6
+        self._useRegulatorLDO = False
+        self.blocking = True
+        self._rxPolicy = SX1262.RX_CONTINUOUS
+        self._rxSenderPreamble = 0
+        self._rxMinSymbols = 8
+        self.resetRxCurrent()
 
     def begin(self, freq=434.0, bw=125.0, sf=9, cr=7, syncWord=SX126X_SYNC_WORD_PRIVATE,
               power=14, currentLimit=60.0, preambleLength=8, implicit=False, implicitLen=0xFF,
               crcOn=True, txIq=False, rxIq=False, tcxoVoltage=1.6, useRegulatorLDO=False,
               blocking=True):
+        self._profile = None
         state = super().begin(bw, sf, cr, syncWord, currentLimit, preambleLength, tcxoVoltage, useRegulatorLDO, txIq, rxIq)
         ASSERT(state)
 
@@ -72,6 +92,12 @@ class SX1262(SX126X):
         state = super().fixPaClamping()
         ASSERT(state)
 
+        self._profile = LoRaProfile(freq=freq, bw=bw, sf=sf, cr=cr, syncWord=syncWord, power=power,
+                                    currentLimit=currentLimit, preambleLength=preambleLength, implicit=implicit,
+                                    implicitLen=implicitLen, crcOn=crcOn, txIq=txIq, rxIq=rxIq)
+        self._tcxoVoltage = tcxoVoltage
+        self._useRegulatorLDO = useRegulatorLDO
+
         state = self.setBlockingCallback(blocking)
 
         return state
@@ -83,6 +109,7 @@ class SX1262(SX126X):
                  fixedPacketLength=False, packetLength=0xFF, preambleDetectorLength=SX126X_GFSK_PREAMBLE_DETECT_16,
                  tcxoVoltage=1.6, useRegulatorLDO=False,
                  blocking=True):
+        self._profile = None
         state = super().beginFSK(br, freqDev, rxBw, currentLimit, preambleLength, dataShaping, preambleDetectorLength, tcxoVoltage, useRegulatorLDO)
         ASSERT(state)
 
@@ -120,17 +147,128 @@ class SX1262(SX126X):
         state = super().fixPaClamping()
         ASSERT(state)
 
+        self._profile = FSKProfile(freq=freq, br=br, freqDev=freqDev, rxBw=rxBw, power=power, currentLimit=currentLimit,
+                                   preambleLength=preambleLength, dataShaping=dataShaping, syncWord=syncWord,
+                                   syncBitsLength=syncBitsLength, addrFilter=addrFilter, addr=addr, crcLength=crcLength,
+                                   crcInitial=crcInitial, crcPolynomial=crcPolynomial, crcInverted=crcInverted,
+                                   whiteningOn=whiteningOn, whiteningInitial=whiteningInitial,
+                                   fixedPacketLength=fixedPacketLength, packetLength=packetLength,
+                                   preambleDetectorLength=preambleDetectorLength)
+        self._tcxoVoltage = tcxoVoltage
+        self._useRegulatorLDO = useRegulatorLDO
+
         state = self.setBlockingCallback(blocking)
 
         return state
 
+    def getProfile(self):
+        # Profile the radio is currently configured with, or None before begin().
+        return self._profile
+
+    def apply(self, profile):
+        # Reconfigure the radio to profile, sending only the commands for settings that
+        # differ from the current profile. A change of modem (or no current profile) goes
+        # through begin()/beginFSK(), which resets the chip.
+        current = self._profile
+        if current is None or type(current) is not type(profile):
+            if isinstance(profile, LoRaProfile):
+                return self.begin(tcxoVoltage=self._tcxoVoltage, useRegulatorLDO=self._useRegulatorLDO,
+                                  blocking=self.blocking, **profile.settings())
+            return self.beginFSK(tcxoVoltage=self._tcxoVoltage, useRegulatorLDO=self._useRegulatorLDO,
+                                 blocking=self.blocking, **profile.settings())
+
+        changed = profile.diff(current)
+        if not changed:
+            return ERR_NONE
+
+        # The profile is only current once every command has gone through
+        self._profile = None
+        if isinstance(profile, LoRaProfile):
+            self._applyLoRa(profile, changed)
+        else:
+            self._applyFSK(profile, changed)
+        self._profile = profile
+
+        if not self.blocking:
+            ASSERT(self.startListening())
+        return ERR_NONE
+
+    def _applyLoRa(self, profile, changed):
+        if 'freq' in changed:
+            ASSERT(self.setFrequency(profile.freq))
+        if 'sf' in changed:
+            ASSERT(super().setSpreadingFactor(profile.sf))
+        if 'bw' in changed:
+            ASSERT(super().setBandwidth(profile.bw))
+        if 'cr' in changed:
+            ASSERT(super().setCodingRate(profile.cr))
+        if 'syncWord' in changed:
+            ASSERT(super().setSyncWord(profile.syncWord))
+        if 'currentLimit' in changed:
+            ASSERT(super().setCurrentLimit(profile.currentLimit))
+        if 'power' in changed:
+            ASSERT(self.setOutputPower(profile.power))
+        if 'implicit' in changed or 'implicitLen' in changed:
+            if profile.implicit:
+                ASSERT(super().implicitHeader(profile.implicitLen))
+            else:
+                ASSERT(super().explicitHeader())
+        if 'crcOn' in changed:
+            ASSERT(super().setCRC(profile.crcOn))
+        if 'preambleLength' in changed:
+            ASSERT(super().setPreambleLength(profile.preambleLength))
+        self._txIq = profile.txIq
+        self._rxIq = profile.rxIq
+
+    def _applyFSK(self, profile, changed):
+        if 'freq' in changed:
+            ASSERT(self.setFrequency(profile.freq))
+        if 'br' in changed:
+            ASSERT(super().setBitRate(profile.br))
+        if 'freqDev' in changed:
+            ASSERT(super().setFrequencyDeviation(profile.freqDev))
+        if 'rxBw' in changed:
+            ASSERT(super().setRxBandwidth(profile.rxBw))
+        if 'currentLimit' in changed:
+            ASSERT(super().setCurrentLimit(profile.currentLimit))
+        if 'power' in changed:
+            ASSERT(self.setOutputPower(profile.power))
+        if 'dataShaping' in changed:
+            ASSERT(super().setDataShaping(profile.dataShaping))
+        if 'preambleLength' in changed:
+            ASSERT(super().setPreambleLength(profile.preambleLength))
+        if 'syncWord' in changed or 'syncBitsLength' in changed:
+            ASSERT(super().setSyncBits(profile.syncWord, profile.syncBitsLength))
+        if 'addrFilter' in changed or 'addr' in changed:
+            if profile.addrFilter == SX126X_GFSK_ADDRESS_FILT_OFF:
+                state = super().disableAddressFiltering()
+            elif profile.addrFilter == SX126X_GFSK_ADDRESS_FILT_NODE:
+                state = super().setNodeAddress(profile.addr)
+            elif profile.addrFilter == SX126X_GFSK_ADDRESS_FILT_NODE_BROADCAST:
+                state = super().setBroadcastAddress(profile.addr)
+            else:
+                state = ERR_UNKNOWN
+            ASSERT(state)
+        if changed & {'crcLength', 'crcInitial', 'crcPolynomial', 'crcInverted'}:
+            ASSERT(super().setCRC(profile.crcLength, profile.crcInitial, profile.crcPolynomial, profile.crcInverted))
+        if 'whiteningOn' in changed or 'whiteningInitial' in changed:
+            ASSERT(super().setWhitening(profile.whiteningOn, profile.whiteningInitial))
+        if 'fixedPacketLength' in changed or 'packetLength' in changed:
+            if profile.fixedPacketLength:
+                ASSERT(super().fixedPacketLengthMode(profile.packetLength))
+            else:
+                ASSERT(super().variablePacketLengthMode(profile.packetLength))
+        if 'preambleDetectorLength' in changed:
+            self._preambleDetectorLength = profile.preambleDetectorLength
+
     def setFrequency(self, freq, calibrate=True):
         if freq < 150.0 or freq > 960.0:
             return ERR_INVALID_FREQUENCY
 
         state = ERR_NONE
 
-        if calibrate:
+        # Image calibration only depends on the band, so skip it while the band is unchanged
+        if calibrate and self._imageBand(freq) != self._calBand:
             data = bytearray(2)
             if freq > 900.0:
                 data[0] = SX126X_CAL_IMG_902_MHZ_1
@@ -149,25 +287,40 @@ class SX1262(SX126X):
                 data[1] = SX126X_CAL_IMG_430_MHZ_2
             state = super().calibrateImage(data)
             ASSERT(state)
+            self._calBand = self._imageBand(freq)
 
         return super().setFrequencyRaw(freq)
 
+    def _imageBand(self, freq):
+        if freq > 900.0:
+            return 902
+        elif freq > 850.0:
+            return 863
+        elif freq > 770.0:
+            return 779
+        elif freq > 460.0:
+            return 470
+        return 430
+
     def setOutputPower(self, power):
         if not ((power >= -9) and (power <= 22)):
             return ERR_INVALID_OUTPUT_POWER
 
-        ocp = bytearray(1)
-        ocp_mv = memoryview(ocp)
-        state = super().readRegister(SX126X_REG_OCP_CONFIGURATION, ocp_mv, 1)
-        ASSERT(state)
+        # With the PA already configured, a power change is a single SetTxParams
+        if power == super().getTxPower() and super().getPaConfig() == _SX1262_PA_CONFIG:
+            return ERR_NONE
 
-        state = super().setPaConfig(0x04, _SX126X_PA_CONFIG_SX1262)
-        ASSERT(state)
+        if super().getPaConfig() != _SX1262_PA_CONFIG:
+            # SetPaConfig resets the OCP limit, so restore the configured value from the shadow
+            ocp = super().getOcp()
 
-        state = super().setTxParams(power)
-        ASSERT(state)
+            state = super().setPaConfig(0x04, _SX126X_PA_CONFIG_SX1262)
+            ASSERT(state)
+
+            state = super().writeRegister(SX126X_REG_OCP_CONFIGURATION, [ocp], 1)
+            ASSERT(state)
 
-        return super().writeRegister(SX126X_REG_OCP_CONFIGURATION, ocp, 1)
+        return super().setTxParams(power)
 
     def setTxIq(self, txIq):
         self._txIq = txIq
@@ -175,20 +328,20 @@ class SX1262(SX126X):
     def setRxIq(self, rxIq):
         self._rxIq = rxIq
         if not self.blocking:
-            ASSERT(super().startReceive())
+            ASSERT(self.startListening())
 
     def setPreambleDetectorLength(self, preambleDetectorLength):
         self._preambleDetectorLength = preambleDetectorLength
         if not self.blocking:
-            ASSERT(super().startReceive())
+            ASSERT(self.startListening())
 
     def setBlockingCallback(self, blocking, callback=None):
         self.blocking = blocking
         if not self.blocking:
-            state = super().startReceive()
+            state = self.startListening()
             ASSERT(state)
-            if callback != None:
-                self._callbackFunction = callback
+            if callback != None or self._rxRing is not None:
+                self._callbackFunction = callback if callback != None else self._dummyFunction
                 super().setDio1Action(self._onIRQ)
             else:
                 self._callbackFunction = self._dummyFunction
@@ -197,10 +350,99 @@ class SX1262(SX126X):
         else:
             state = super().standby()
             ASSERT(state)
+            self._accountRx(0)
             self._callbackFunction = self._dummyFunction
             super().clearDio1Action()
             return state
 
+    def setReceivePolicy(self, policy, senderPreambleLength=0, minSymbols=8):
+        # RX_CONTINUOUS keeps the receiver on. RX_DUTY_CYCLE lets the chip alternate between
+        # listening and sleep, timed from the senders' preamble length (0 for our own) so
+        # that at least minSymbols of every preamble fall in a listen window. LoRa only;
+        # when the preamble is too short to sleep in between it stays continuous, which
+        # getReceivePeriods() reports. Senders need a preamble of at least
+        # getDutyCyclePreamble() symbols for duty cycling to take effect.
+        self._rxPolicy = policy
+        self._rxSenderPreamble = senderPreambleLength
+        self._rxMinSymbols = minSymbols
+        if not self.blocking:
+            return self.startListening()
+        return ERR_NONE
+
+    def getReceivePolicy(self):
+        return self._rxPolicy
+
+    def getReceivePeriods(self):
+        # (rx, sleep) periods in us the receiver duty cycles with under the current policy
+        # and settings, or None if it listens continuously.
+        if self._rxPolicy == SX1262.RX_DUTY_CYCLE and self.getPacketType() == SX126X_PACKET_TYPE_LORA:
+            return super().getDutyCyclePeriods(self._rxSenderPreamble, self._rxMinSymbols)
+        return None
+
+    def getDutyCyclePreamble(self, minSymbols=8):
+        # Shortest sender preamble (symbols) that lets the receiver sleep between listen
+        # windows with the current LoRa settings.
+        length = 2 * minSymbols
+        while length < 0xFFFF and super().getDutyCyclePeriods(length, minSymbols) is None:
+            length += 1
+        return length
+
+    def startListening(self):
+        # Start receiving according to the receive policy.
+        periods = self.getReceivePeriods()
+        if periods is None:
+            state = super().startReceive()
+            self._accountRx(SX1262.RX_CURRENT)
+            return state
+
+        rxPeriod, sleepPeriod = periods
+        state = super().startReceiveDutyCycle(rxPeriod, sleepPeriod)
+        # startReceiveDutyCycle() spends part of each sleep period waking up the TCXO
+        transition = min(sleepPeriod, self._tcxoDelay + 1000)
+        self._accountRx((rxPeriod * SX1262.RX_CURRENT + transition * SX1262.STANDBY_CURRENT +
+                         (sleepPeriod - transition) * SX1262.SLEEP_CURRENT) / (rxPeriod + sleepPeriod))
+        return state
+
+    def resetRxCurrent(self):
+        # Restart the average receive current measurement.
+        self._rxCharge = 0.0
+        self._rxTime = 0
+        self._rxCurrent = 0
+        self._rxSince = ticks_ms()
+
+    def getAverageCurrent(self):
+        # Average receiver current (mA) since resetRxCurrent(), from the time spent in each
+        # receive mode and the airtime of the frames received at full RX current. Time spent
+        # transmitting (or in standby) counts with the receiver off.
+        elapsed = ticks_diff(ticks_ms(), self._rxSince)
+        time_ = self._rxTime + elapsed
+        if time_ <= 0:
+            return self._rxCurrent
+        return (self._rxCharge + elapsed * self._rxCurrent) / time_
+
+    def _accountRx(self, current):
+        now = ticks_ms()
+        elapsed = ticks_diff(now, self._rxSince)
+        self._rxCharge += elapsed * self._rxCurrent
+        self._rxTime += elapsed
+        self._rxSince = now
+        self._rxCurrent = current
+
+    def _noteFrame(self, length):
+        # A received frame kept the receiver on for its whole airtime
+        if self._rxCurrent < SX1262.RX_CURRENT:
+            self._rxCharge += super().getTimeOnAir(length) / 1000 * (SX1262.RX_CURRENT - self._rxCurrent)
+
+    def startTransmit(self, data, len_, addr=0):
+        # The receiver is off while transmitting
+        self._accountRx(0)
+        return super().startTransmit(data, len_, addr)
+
+    def setRxRing(self, rxRing):
+        # In non-blocking mode, copy each received frame into rxRing from the DIO1 interrupt
+        # and restart reception straight away; the callback then only needs to wake a reader.
+        self._rxRing = rxRing
+
     def recv(self, len=0, timeout_en=False, timeout_ms=0):
         if not self.blocking:
             return self._readData(len)
@@ -230,7 +472,7 @@ class SX1262(SX126X):
         try:
             state = super().receive(data_mv, length, timeout_en, timeout_ms)
         except AssertionError as e:
-            state = list(ERROR.keys())[list(ERROR.values()).index(str(e))]
+            state = errorState(e)
 
         if state == ERR_NONE or state == ERR_CRC_MISMATCH:
             if len_ == 0:
@@ -265,16 +507,39 @@ class SX1262(SX126X):
         try:
             state = super().readData(data_mv, length)
         except AssertionError as e:
-            state = list(ERROR.keys())[list(ERROR.values()).index(str(e))]
+            state = errorState(e)
 
-        ASSERT(super().startReceive())
+        ASSERT(self.startListening())
 
         if state == ERR_NONE or state == ERR_CRC_MISMATCH:
+            self._noteFrame(length)
             return bytes(data), state
 
         else:
             return b'', state
 
+    def _readIntoRing(self):
+        slot = self._rxRing.reserve()
+        if slot is None:
+            super().clearIrqStatus()
+            ASSERT(self.startListening())
+            return
+
+        length = super().getPacketLength()
+        if length > self._rxRing.size:
+            length = self._rxRing.size
+
+        try:
+            state = super().readData(slot, length)
+        except AssertionError as e:
+            state = errorState(e)
+
+        if state == ERR_NONE or state == ERR_CRC_MISMATCH:
+            self._noteFrame(length)
+            self._rxRing.commit(length, state, super().getRSSI(), super().getSNR(), ticks_ms())
+
+        ASSERT(self.startListening())
+
     def _startTransmit(self, data):
         if isinstance(data, bytes) or isinstance(data, bytearray):
             pass
@@ -290,5 +555,7 @@ class SX1262(SX126X):
     def _onIRQ(self, callback):
         events = self._events()
         if events & SX126X_IRQ_TX_DONE:
-            super().startReceive()
+            self.startListening()
+        elif events & SX126X_IRQ_RX_DONE and self._rxRing is not None:
+            self._readIntoRing()
         self._callbackFunction(events)
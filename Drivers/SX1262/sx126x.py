@@ -28,14 +28,23 @@ SOFTWARE.
 from _sx126x import *
 
 from sys import implementation
+from array import array
 
 if implementation.name == 'micropython':
     from machine import SPI, Pin
-    from utime import sleep_ms, sleep_us, ticks_ms, ticks_us, ticks_diff
+    from utime import sleep_ms, sleep_us, ticks_ms, ticks_us, ticks_add, ticks_diff
 
 if implementation.name == 'circuitpython':
     import digitalio
     import busio
+
+# Host Python takes the MicroPython code paths, with SPI and Pin from a stand-in machine
+# module such as the one emulator.py installs
+_MACHINE = implementation.name != 'circuitpython'
+if implementation.name not in ('micropython', 'circuitpython'):
+    from machine import SPI, Pin
+
+if implementation.name != 'micropython':
     from time import sleep, monotonic_ns
 
     _MS_PER_NS = const(1000000)
@@ -57,6 +66,9 @@ if implementation.name == 'circuitpython':
     def ticks_us():
        return (monotonic_ns() // _US_PER_NS) & _TICKS_MAX
 
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & _TICKS_MAX
+
     def ticks_diff(end, start):
         diff = (end - start) & _TICKS_MAX
         diff = ((diff + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
@@ -66,7 +78,7 @@ class SX126X:
 
     def __init__(self, spi_bus, clk, mosi, miso, cs, irq, rst, gpio):
         self._irq = irq
-        if implementation.name == 'micropython':
+        if _MACHINE:
           try:
               self.spi = SPI(spi_bus, mode=SPI.MASTER, baudrate=2000000, pins=(clk, mosi, miso))        # Pycom variant uPy
           except:
@@ -91,6 +103,14 @@ class SX126X:
           self.gpio = digitalio.DigitalInOut(gpio)
           self.gpio.switch_to_input()
 
+        # Transfer buffers sized for a full packet plus the command and status bytes
+        self._spiOut = bytearray(SX126X_MAX_PACKET_LENGTH + 4)
+        self._spiIn = bytearray(SX126X_MAX_PACKET_LENGTH + 4)
+        self._spiOutMv = memoryview(self._spiOut)
+        self._spiInMv = memoryview(self._spiIn)
+        # NOP padding clocked out while reading, copied in with one slice assignment
+        self._spiNopMv = memoryview(bytes([SX126X_CMD_NOP]) * (SX126X_MAX_PACKET_LENGTH + 4))
+
         self._bwKhz = 0
         self._sf = 0
         self._bw = 0
@@ -121,6 +141,18 @@ class SX126X:
         self._packetLength = 0
         self._preambleDetectorLength = 0
 
+        # Time-on-air (us) for every payload length, rebuilt after a parameter change
+        self._toaTable = None
+
+        # Data buffer region (base, length) of the frame on air, and of the frame staged
+        # behind it for fireStaged(), or None
+        self._txRegion = (0, 0)
+        self._staged = None
+
+        # Shadow of configuration written to the chip, so getters and repeated writes need
+        # no SPI traffic; cleared by clearShadow() after a reset, sleep or device error
+        self.clearShadow()
+
     def begin(self, bw, sf, cr, syncWord, currentLimit, preambleLength, tcxoVoltage, useRegulatorLDO=False, txIq=False, rxIq=False):
         self._bwKhz = bw
         self._sf = sf
@@ -241,8 +273,21 @@ class SX126X:
 
         return state
 
+    def clearShadow(self):
+        # Forget the cached chip configuration; each value is read back or rewritten on next use.
+        self._modem = None
+        self._ocp = None
+        self._iqConfig = None
+        self._syncWordRaw = None
+        self._modulationParams = None
+        self._packetParams = None
+        self._calBand = None
+        self._paConfig = None
+        self._txPower = None
+
     def reset(self, verify=True):
-        if implementation.name == 'micropython':
+        self.clearShadow()
+        if _MACHINE:
           self.rst.value(1)
           sleep_us(150)
           self.rst.value(0)
@@ -405,6 +450,7 @@ class SX126X:
         if not retainConfig:
             sleepMode = [SX126X_SLEEP_START_COLD | SX126X_SLEEP_RTC_OFF]
         state = self.SPIwriteCommand([SX126X_CMD_SET_SLEEP], 1, sleepMode, 1, False)
+        self.clearShadow()
 
         sleep_us(500)
 
@@ -421,7 +467,7 @@ class SX126X:
             self.irq.irq(trigger=Pin.IRQ_RISING, handler=func)          # Generic variant uPy
 
     def clearDio1Action(self):
-        if implementation.name == 'micropython':
+        if _MACHINE:
           self.irq = Pin(self._irq, mode=Pin.IN)
 
         if implementation.name == 'circuitpython':
@@ -429,33 +475,11 @@ class SX126X:
           self.irq.switch_to_input()
 
     def startTransmit(self, data, len_, addr=0):
-        if len_ > SX126X_MAX_PACKET_LENGTH:
-            return ERR_PACKET_TOO_LONG
-                
-        if self._addrComp != SX126X_GFSK_ADDRESS_FILT_OFF and len_ > (SX126X_MAX_PACKET_LENGTH - 1):
-            return ERR_PACKET_TOO_LONG
-                
-        state = ERR_NONE
-        modem = self.getPacketType()
-        if modem == SX126X_PACKET_TYPE_LORA:
-            if self._txIq:
-                self._invertIQ = SX126X_LORA_IQ_INVERTED
-            else:
-                self._invertIQ = SX126X_LORA_IQ_STANDARD
-                
-            if self._headerType == SX126X_LORA_HEADER_IMPLICIT:
-                if len_ != self._implicitLen:
-                    return ERR_INVALID_PACKET_LENGTH
-                
-            state = self.setPacketParams(self._preambleLength, self._crcType, len_, self._headerType, self._invertIQ)
-        elif modem == SX126X_PACKET_TYPE_GFSK:
-            if self._packetType == SX126X_GFSK_PACKET_FIXED:
-                if len_ != self._packetLength:
-                    return ERR_INVALID_PACKET_LENGTH
-                
-            state = self.setPacketParamsFSK(self._preambleLengthFSK, self._crcTypeFSK, self._syncWordLength, self._addrComp, self._whitening, self._packetType, len_, self._preambleDetectorLength)
-        else:
-            return ERR_UNKNOWN
+        state = self.checkTxLength(len_)
+        if state != ERR_NONE:
+            return state
+
+        state = self.setTxPacketParams(len_)
         ASSERT(state)
         
         state = self.setDioIrqParams(SX126X_IRQ_TX_DONE | SX126X_IRQ_TIMEOUT, SX126X_IRQ_TX_DONE)
@@ -466,6 +490,8 @@ class SX126X:
         
         state = self.writeBuffer(data, len_)
         ASSERT(state)
+        self._txRegion = (0, len_)
+        self._staged = None
         
         state = self.clearIrqStatus()
         ASSERT(state)
@@ -476,7 +502,7 @@ class SX126X:
         state = self.setTx(SX126X_TX_TIMEOUT_NONE)
         ASSERT(state)
         
-        if implementation.name == 'micropython':
+        if _MACHINE:
           while self.gpio.value():
               yield_()
 
@@ -486,6 +512,75 @@ class SX126X:
 
         return state
 		
+    def checkTxLength(self, len_):
+        if len_ > SX126X_MAX_PACKET_LENGTH:
+            return ERR_PACKET_TOO_LONG
+        if self._addrComp != SX126X_GFSK_ADDRESS_FILT_OFF and len_ > (SX126X_MAX_PACKET_LENGTH - 1):
+            return ERR_PACKET_TOO_LONG
+        modem = self.getPacketType()
+        if modem == SX126X_PACKET_TYPE_LORA:
+            if self._headerType == SX126X_LORA_HEADER_IMPLICIT and len_ != self._implicitLen:
+                return ERR_INVALID_PACKET_LENGTH
+        elif modem == SX126X_PACKET_TYPE_GFSK:
+            if self._packetType == SX126X_GFSK_PACKET_FIXED and len_ != self._packetLength:
+                return ERR_INVALID_PACKET_LENGTH
+        else:
+            return ERR_UNKNOWN
+        return ERR_NONE
+
+    def setTxPacketParams(self, len_):
+        if self.getPacketType() == SX126X_PACKET_TYPE_LORA:
+            if self._txIq:
+                self._invertIQ = SX126X_LORA_IQ_INVERTED
+            else:
+                self._invertIQ = SX126X_LORA_IQ_STANDARD
+            return self.setPacketParams(self._preambleLength, self._crcType, len_, self._headerType, self._invertIQ)
+        return self.setPacketParamsFSK(self._preambleLengthFSK, self._crcTypeFSK, self._syncWordLength, self._addrComp, self._whitening, self._packetType, len_, self._preambleDetectorLength)
+
+    def stageTransmit(self, data, len_):
+        # Write the next frame into the data buffer right behind the frame on air (the
+        # buffer wraps at 256 bytes), so fireStaged() can start it without the payload
+        # transfer. The chip accepts buffer writes while transmitting. Returns ERR_NONE,
+        # or ERR_PACKET_TOO_LONG if both frames do not fit in the buffer together.
+        state = self.checkTxLength(len_)
+        if state != ERR_NONE:
+            return state
+        base, length = self._txRegion
+        if length + len_ > SX126X_MAX_PACKET_LENGTH + 1:
+            return ERR_PACKET_TOO_LONG
+        base = (base + length) & 0xFF
+        self._staged = None
+        state = self.writeBuffer(data, len_, base)
+        ASSERT(state)
+        self._staged = (base, len_)
+        return ERR_NONE
+
+    def hasStaged(self):
+        return self._staged is not None
+
+    def fireStaged(self):
+        # Start transmitting the frame written by stageTransmit(), normally straight from
+        # the TX_DONE of the previous one. Only short commands remain: the payload length,
+        # the buffer base address and SetTx.
+        if self._staged is None:
+            return ERR_UNKNOWN
+        base, len_ = self._staged
+        self._staged = None
+
+        state = self.setTxPacketParams(len_)
+        ASSERT(state)
+
+        state = self.setBufferBaseAddress(base, 0x00)
+        ASSERT(state)
+
+        state = self.clearIrqStatus()
+        ASSERT(state)
+
+        state = self.setTx(SX126X_TX_TIMEOUT_NONE)
+        ASSERT(state)
+        self._txRegion = (base, len_)
+        return ERR_NONE
+
     def startReceive(self, timeout=SX126X_RX_TIMEOUT_INF):
         state = ERR_NONE
         modem = self.getPacketType()
@@ -530,13 +625,22 @@ class SX126X:
         return self.SPIwriteCommand([SX126X_CMD_SET_RX_DUTY_CYCLE], 1, data, 6)
             
     def startReceiveDutyCycleAuto(self, senderPreambleLength=0, minSymbols=8):
+        periods = self.getDutyCyclePeriods(senderPreambleLength, minSymbols)
+        if periods is None:
+            return self.startReceive()
+                
+        return self.startReceiveDutyCycle(periods[0], periods[1])
+
+    def getDutyCyclePeriods(self, senderPreambleLength=0, minSymbols=8):
+        # (rx, sleep) periods in us that make sure a sender's preamble is caught in at least
+        # minSymbols of listening, or None if the preamble is too short to sleep in between.
         if senderPreambleLength == 0:
             senderPreambleLength = self._preambleLength
                 
         sleepSymbols = int(senderPreambleLength - 2 * minSymbols)
         
         if (2 * minSymbols) > senderPreambleLength:
-            return self.startReceive()
+            return None
                 
         symbolLength = int(((10*1000) << self._sf) / (10 * self._bwKhz))
         sleepPeriod = symbolLength * sleepSymbols
@@ -544,9 +648,9 @@ class SX126X:
         wakePeriod = int(max((symbolLength * (senderPreambleLength + 1) - (sleepPeriod - 1000)) / 2, symbolLength * (minSymbols + 1)))
         
         if sleepPeriod < (self._tcxoDelay + 1016):
-            return self.startReceive()
+            return None
                 
-        return self.startReceiveDutyCycle(wakePeriod, sleepPeriod)
+        return wakePeriod, sleepPeriod
             
     def startReceiveCommon(self):
         state = self.setDioIrqParams(SX126X_IRQ_RX_DONE | SX126X_IRQ_TIMEOUT | SX126X_IRQ_CRC_ERR | SX126X_IRQ_HEADER_ERR, SX126X_IRQ_RX_DONE)
@@ -584,10 +688,11 @@ class SX126X:
         ASSERT(state)
         
         state = self.clearIrqStatus()
+        ASSERT(state)
         
-        ASSERT(crcState)
-        
-        return state
+        # A CRC or header error is an ordinary outcome on a noisy channel, so it is
+        # returned as a state rather than raised; only SPI faults raise
+        return crcState
             
     def setBandwidth(self, bw):
         if self.getPacketType() != SX126X_PACKET_TYPE_LORA:
@@ -642,15 +747,22 @@ class SX126X:
             else:
                 controlBits = 0x44
             data = [int((syncWord & 0xF0) | ((controlBits & 0xF0) >> 4)), int(((syncWord & 0x0F) << 4) | (controlBits & 0x0F))]
-            return self.writeRegister(SX126X_REG_LORA_SYNC_WORD_MSB, data, 2)
+            if self._syncWordRaw == data:
+                return ERR_NONE
+            state = self.writeRegister(SX126X_REG_LORA_SYNC_WORD_MSB, data, 2)
+            self._syncWordRaw = data if state == ERR_NONE else None
+            return state
 
         elif self.getPacketType() == SX126X_PACKET_TYPE_GFSK:
             len_ = args[0]
             if len_ > 8:
                 return ERR_INVALID_SYNC_WORD
 
-            state = self.writeRegister(SX126X_REG_SYNC_WORD_0, syncWord, len_)
-            ASSERT(state)
+            data = list(syncWord[:len_])
+            if self._syncWordRaw != data:
+                state = self.writeRegister(SX126X_REG_SYNC_WORD_0, syncWord, len_)
+                ASSERT(state)
+                self._syncWordRaw = data
 
             self._syncWordLength = len_ * 8
             state = self.setPacketParamsFSK(self._preambleLengthFSK, self._crcTypeFSK, self._syncWordLength, self._addrComp, self._whitening, self._packetType, self._packetLength, self._preambleDetectorLength)
@@ -666,14 +778,22 @@ class SX126X:
 
         rawLimit = [int(currentLimit / 2.5)]
 
-        return self.writeRegister(SX126X_REG_OCP_CONFIGURATION, rawLimit, 1)
+        state = self.writeRegister(SX126X_REG_OCP_CONFIGURATION, rawLimit, 1)
+        self._ocp = rawLimit[0] if state == ERR_NONE else None
+        return state
 
     def getCurrentLimit(self):
-        ocp = bytearray(1)
-        ocp_mv = memoryview(ocp)
-        self.readRegister(SX126X_REG_OCP_CONFIGURATION, ocp_mv, 1)
-
-        return float(ocp[0]) * 2.5
+        return float(self.getOcp()) * 2.5
+
+    def getOcp(self):
+        if self._ocp is None:
+            ocp = bytearray(1)
+            ocp_mv = memoryview(ocp)
+            state = self.readRegister(SX126X_REG_OCP_CONFIGURATION, ocp_mv, 1)
+            if state != ERR_NONE:
+                return ocp[0]
+            self._ocp = ocp[0]
+        return self._ocp
 
     def setPreambleLength(self, preambleLength):
         modem = self.getPacketType()
@@ -935,6 +1055,17 @@ class SX126X:
         return self.setPacketMode(SX126X_GFSK_PACKET_VARIABLE, maxLen)
 
     def getTimeOnAir(self, len_):
+        if len_ > SX126X_MAX_PACKET_LENGTH:
+            return self._computeTimeOnAir(len_)
+        return self.getTimeOnAirTable()[len_]
+
+    def getTimeOnAirTable(self):
+        # Array of the time-on-air in us for payload lengths 0 to 255 with the current settings.
+        if self._toaTable is None:
+            self._toaTable = array('L', [self._computeTimeOnAir(len_) for len_ in range(SX126X_MAX_PACKET_LENGTH + 1)])
+        return self._toaTable
+
+    def _computeTimeOnAir(self, len_):
         if self.getPacketType() == SX126X_PACKET_TYPE_LORA:
             symbolLength_us = int(((1000 * 10) << self._sf) / (self._bwKhz * 10))
             sfCoeff1_x4 = 17
@@ -1049,7 +1180,13 @@ class SX126X:
 
     def setPaConfig(self, paDutyCycle, deviceSel, hpMax=SX126X_PA_CONFIG_HP_MAX, paLut=SX126X_PA_CONFIG_PA_LUT):
         data = [paDutyCycle, hpMax, deviceSel, paLut]
-        return self.SPIwriteCommand([SX126X_CMD_SET_PA_CONFIG], 1, data, 4)
+        state = self.SPIwriteCommand([SX126X_CMD_SET_PA_CONFIG], 1, data, 4)
+        self._paConfig = data if state == ERR_NONE else None
+        return state
+
+    def getPaConfig(self):
+        # [paDutyCycle, hpMax, deviceSel, paLut] last written, or None.
+        return self._paConfig
 
     def writeRegister(self, addr, data, numBytes):
         cmd = [SX126X_CMD_WRITE_REGISTER, int((addr >> 8) & 0xFF), int(addr & 0xFF)]
@@ -1100,16 +1237,24 @@ class SX126X:
         return self.SPIwriteCommand([SX126X_CMD_CALIBRATE_IMAGE], 1, data, 2)
 
     def getPacketType(self):
-        data = bytearray([0xFF])
-        data_mv = memoryview(data)
-        self.SPIreadCommand([SX126X_CMD_GET_PACKET_TYPE], 1, data_mv, 1)
-        return data[0]
+        if self._modem is None:
+            data = bytearray([0xFF])
+            data_mv = memoryview(data)
+            self.SPIreadCommand([SX126X_CMD_GET_PACKET_TYPE], 1, data_mv, 1)
+            if data[0] != SX126X_PACKET_TYPE_LORA and data[0] != SX126X_PACKET_TYPE_GFSK:
+                return data[0]
+            self._modem = data[0]
+        return self._modem
 
     def setTxParams(self, power, rampTime=SX126X_PA_RAMP_200U):
-        if power < 0:
-            power += 256
-        data = [power, rampTime]
-        return self.SPIwriteCommand([SX126X_CMD_SET_TX_PARAMS], 1, data, 2)
+        data = [power + 256 if power < 0 else power, rampTime]
+        state = self.SPIwriteCommand([SX126X_CMD_SET_TX_PARAMS], 1, data, 2)
+        self._txPower = power if state == ERR_NONE and rampTime == SX126X_PA_RAMP_200U else None
+        return state
+
+    def getTxPower(self):
+        # Output power (dBm) last set, or None.
+        return self._txPower
 
     def setPacketMode(self, mode, len_):
         if self.getPacketType() != SX126X_PACKET_TYPE_GFSK:
@@ -1145,26 +1290,49 @@ class SX126X:
             self._ldro = ldro
 
         data = [sf, bw, cr, self._ldro]
-        return self.SPIwriteCommand([SX126X_CMD_SET_MODULATION_PARAMS], 1, data, 4)
+        return self._setModulationParamsRaw(data)
 
     def setModulationParamsFSK(self, br, pulseShape, rxBw, freqDev):
         data = [int((br >> 16) & 0xFF), int((br >> 8) & 0xFF), int(br & 0xFF),
                 pulseShape, rxBw,
                 int((freqDev >> 16) & 0xFF), int((freqDev >> 8) & 0xFF), int(freqDev & 0xFF)]
-        return self.SPIwriteCommand([SX126X_CMD_SET_MODULATION_PARAMS], 1, data, 8)
+        return self._setModulationParamsRaw(data)
+
+    def _setModulationParamsRaw(self, data):
+        if data == self._modulationParams:
+            return ERR_NONE
+        state = self.SPIwriteCommand([SX126X_CMD_SET_MODULATION_PARAMS], 1, data, len(data))
+        self._modulationParams = data if state == ERR_NONE else None
+        self._toaTable = None
+        return state
 
     def setPacketParams(self, preambleLength, crcType, payloadLength, headerType, invertIQ=SX126X_LORA_IQ_STANDARD):
         state = self.fixInvertedIQ(invertIQ)
         ASSERT(state)
         data = [int((preambleLength >> 8) & 0xFF), int(preambleLength & 0xFF),
                 headerType, payloadLength, crcType, invertIQ]
-        return self.SPIwriteCommand([SX126X_CMD_SET_PACKET_PARAMS], 1, data, 6)
+        return self._setPacketParamsRaw(data)
 
     def setPacketParamsFSK(self, preambleLength, crcType, syncWordLength, addrComp, whitening, packetType=SX126X_GFSK_PACKET_VARIABLE, payloadLength=0xFF, preambleDetectorLength=SX126X_GFSK_PREAMBLE_DETECT_16):
         data = [int((preambleLength >> 8) & 0xFF), int(preambleLength & 0xFF),
                 preambleDetectorLength, syncWordLength, addrComp,
                 packetType, payloadLength, crcType, whitening]
-        return self.SPIwriteCommand([SX126X_CMD_SET_PACKET_PARAMS], 1, data, 9)
+        return self._setPacketParamsRaw(data)
+
+    def _setPacketParamsRaw(self, data):
+        if data == self._packetParams:
+            return ERR_NONE
+        # The payload length (and LoRa IQ inversion) change between packets but do not
+        # affect the time-on-air table
+        ignored = (3, 5) if len(data) == 6 else (6,)
+        previous = self._packetParams
+        if previous is None or len(previous) != len(data) or \
+           any(data[i] != previous[i] for i in range(len(data)) if i not in ignored):
+            self._toaTable = None
+
+        state = self.SPIwriteCommand([SX126X_CMD_SET_PACKET_PARAMS], 1, data, len(data))
+        self._packetParams = data if state == ERR_NONE else None
+        return state
 
     def setBufferBaseAddress(self, txBaseAddress=0x00, rxBaseAddress=0x00):
         data = [txBaseAddress, rxBaseAddress]
@@ -1190,7 +1358,9 @@ class SX126X:
         data = bytearray(2)
         data_mv = memoryview(data)
         self.SPIreadCommand([SX126X_CMD_GET_DEVICE_ERRORS], 1, data_mv, 2)
-        opError = ((data[0] & 0xFF) << 8) & data[1]
+        opError = ((data[0] & 0xFF) << 8) | data[1]
+        if opError:
+            self.clearShadow()
         return opError
 
     def clearDeviceErrors(self):
@@ -1239,17 +1409,23 @@ class SX126X:
         return self.writeRegister(SX126X_REG_RTC_EVENT, rtcEvent, 1)
 
     def fixInvertedIQ(self, iqConfig):
-        iqConfigCurrent = bytearray(1)
-        iqConfigCurrent_mv = memoryview(iqConfigCurrent)
-        state = self.readRegister(SX126X_REG_IQ_CONFIG, iqConfigCurrent_mv, 1)
-        ASSERT(state)
+        if self._iqConfig is None:
+            iqConfigCurrent = bytearray(1)
+            iqConfigCurrent_mv = memoryview(iqConfigCurrent)
+            state = self.readRegister(SX126X_REG_IQ_CONFIG, iqConfigCurrent_mv, 1)
+            ASSERT(state)
+            self._iqConfig = iqConfigCurrent[0]
 
         if iqConfig == SX126X_LORA_IQ_STANDARD:
-            iqConfigCurrent_mv[0] &= 0xFB
+            iqConfigNew = self._iqConfig & 0xFB
         else:
-            iqConfigCurrent_mv[0] |= 0x04
+            iqConfigNew = self._iqConfig | 0x04
+        if iqConfigNew == self._iqConfig:
+            return ERR_NONE
 
-        return self.writeRegister(SX126X_REG_IQ_CONFIG, iqConfigCurrent, 1)
+        state = self.writeRegister(SX126X_REG_IQ_CONFIG, [iqConfigNew], 1)
+        self._iqConfig = iqConfigNew if state == ERR_NONE else None
+        return state
 
     def config(self, modem):
         state = self.setBufferBaseAddress()
@@ -1259,6 +1435,8 @@ class SX126X:
         data[0] = modem
         state = self.SPIwriteCommand([SX126X_CMD_SET_PACKET_TYPE], 1, data, 1)
         ASSERT(state)
+        self.clearShadow()
+        self._modem = modem
 
         data[0] = SX126X_RX_TX_FALLBACK_MODE_STDBY_RC
         state = self.SPIwriteCommand([SX126X_CMD_SET_RX_TX_FALLBACK_MODE], 1, data, 1)
@@ -1284,7 +1462,7 @@ class SX126X:
 
         sleep_ms(5)
 
-        if implementation.name == 'micropython':
+        if _MACHINE:
           while self.gpio.value():
               yield_()
 
@@ -1301,7 +1479,31 @@ class SX126X:
         return self.SPItransfer(cmd, cmdLen, False, [], data, numBytes, waitForBusy)
 
     def SPItransfer(self, cmd, cmdLen, write, dataOut, dataIn, numBytes, waitForBusy, timeout=5000):
-        if implementation.name == 'micropython':
+        # The whole transaction (command, then data out or status byte and data in) is
+        # clocked with one write_readinto on preallocated buffers; the status bytes the
+        # chip returns are checked in the input buffer afterwards.
+        length = cmdLen + numBytes + (0 if write else 1)
+        if length <= len(self._spiOut):
+            out = self._spiOutMv[:length]
+            in_ = self._spiInMv[:length]
+        else:
+            out = bytearray(length)
+            in_ = bytearray(length)
+
+        for i in range(cmdLen):
+            out[i] = cmd[i]
+        if write:
+            if isinstance(dataOut, (bytes, bytearray, memoryview)):
+                out[cmdLen:length] = dataOut[:numBytes]
+            else:
+                for i in range(numBytes):
+                    out[cmdLen + i] = dataOut[i]
+        elif length <= len(self._spiNopMv):
+            out[cmdLen:length] = self._spiNopMv[:length - cmdLen]
+        else:
+            out[cmdLen:length] = bytes([SX126X_CMD_NOP]) * (length - cmdLen)
+
+        if _MACHINE:
           self.cs.value(0)
 
           start = ticks_ms()
@@ -1311,8 +1513,7 @@ class SX126X:
                   self.cs.value(1)
                   return ERR_SPI_CMD_TIMEOUT
 
-          for i in range(cmdLen):
-              self.spi.write(bytes([cmd[i]]))
+          self.spi.write_readinto(out, in_)
 
         if implementation.name == 'circuitpython':
           while not self.spi.try_lock():
@@ -1327,62 +1528,30 @@ class SX126X:
                   self.spi.unlock()
                   return ERR_SPI_CMD_TIMEOUT
 
-          for i in range(cmdLen):
-              self.spi.write(bytes([cmd[i]]))
-
-          in_ = bytearray(1)
+          self.spi.write_readinto(out, in_)
 
         status = 0
 
-        if write:
-            for i in range(numBytes):
-                if implementation.name == 'micropython':
-                    try:
-                        in_ = self.spi.read(1, dataOut[i])
-                    except:
-                        in_ = self.spi.read(1, write=dataOut[i])
-
-                if implementation.name == 'circuitpython':
-                  self.spi.write_readinto(bytes([dataOut[i]]), in_)
-
-                if (in_[0] & 0b00001110) == SX126X_STATUS_CMD_TIMEOUT or\
-                   (in_[0] & 0b00001110) == SX126X_STATUS_CMD_INVALID or\
-                   (in_[0] & 0b00001110) == SX126X_STATUS_CMD_FAILED:
-                    status = in_[0] & 0b00001110
-                    break
-                elif (in_[0] == 0x00) or (in_[0] == 0xFF):
-                    status = SX126X_STATUS_SPI_FAILED
-                    break
-        else:
-            if implementation.name == 'micropython':
-                try:
-                    in_ = self.spi.read(1, SX126X_CMD_NOP)
-                except:
-                    in_ = self.spi.read(1, write=SX126X_CMD_NOP)
-
-            if implementation.name == 'circuitpython':
-              self.spi.readinto(in_)
-
-            if (in_[0] & 0b00001110) == SX126X_STATUS_CMD_TIMEOUT or\
-               (in_[0] & 0b00001110) == SX126X_STATUS_CMD_INVALID or\
-               (in_[0] & 0b00001110) == SX126X_STATUS_CMD_FAILED:
-                status = in_[0] & 0b00001110
-            elif (in_[0] == 0x00) or (in_[0] == 0xFF):
+        # A write returns a status byte for every data byte; a read returns one status
+        # byte before the data
+        for i in range(cmdLen, cmdLen + numBytes if write else cmdLen + 1):
+            if (in_[i] & 0b00001110) == SX126X_STATUS_CMD_TIMEOUT or\
+               (in_[i] & 0b00001110) == SX126X_STATUS_CMD_INVALID or\
+               (in_[i] & 0b00001110) == SX126X_STATUS_CMD_FAILED:
+                status = in_[i] & 0b00001110
+                break
+            elif (in_[i] == 0x00) or (in_[i] == 0xFF):
                 status = SX126X_STATUS_SPI_FAILED
+                break
+
+        if not write and status == 0:
+            if isinstance(dataIn, (bytearray, memoryview)):
+                dataIn[:numBytes] = in_[cmdLen + 1:length]
             else:
-                if implementation.name == 'micropython':
-                    for i in range(numBytes):
-                        try:
-                            dataIn[i] = self.spi.read(1, SX126X_CMD_NOP)[0]
-                        except:
-                            dataIn[i] = self.spi.read(1, write=SX126X_CMD_NOP)[0]
-
-                if implementation.name == 'circuitpython':
-                  for i in range(numBytes):
-                      self.spi.readinto(in_)
-                      dataIn[i] = in_[0]
-
-        if implementation.name == 'micropython':
+                for i in range(numBytes):
+                    dataIn[i] = in_[cmdLen + 1 + i]
+
+        if _MACHINE:
           self.cs.value(1)
 
         if implementation.name == 'circuitpython':
@@ -1392,7 +1561,7 @@ class SX126X:
         if waitForBusy:
             sleep_us(1)
             start = ticks_ms()
-            if implementation.name == 'micropython':
+            if _MACHINE:
               while self.gpio.value():
                   yield_()
                   if abs(ticks_diff(start, ticks_ms())) >= timeout:
@@ -1406,6 +1575,9 @@ class SX126X:
                       status =  SX126X_STATUS_CMD_TIMEOUT
                       break
 
+        if status != 0:
+            self.clearShadow()
+
         switch = {SX126X_STATUS_CMD_TIMEOUT: ERR_SPI_CMD_TIMEOUT,
                   SX126X_STATUS_CMD_INVALID: ERR_SPI_CMD_INVALID,
                   SX126X_STATUS_CMD_FAILED: ERR_SPI_CMD_FAILED,
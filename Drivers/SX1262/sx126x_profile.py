@@ -0,0 +1,52 @@
+from _sx126x import *
+
+class _Profile:
+    FIELDS = ()
+
+    def __init__(self, **kwargs):
+        for name in self.FIELDS:
+            setattr(self, name, kwargs.pop(name, self.DEFAULTS[name]))
+        if kwargs:
+            raise TypeError('unknown profile setting: ' + ', '.join(kwargs))
+
+    def copy(self, **changes):
+        # New profile with the given settings replaced.
+        kwargs = self.settings()
+        kwargs.update(changes)
+        return type(self)(**kwargs)
+
+    def settings(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def diff(self, other):
+        # Names of the settings that differ from other (all of them if other is None or another modem).
+        if other is None or type(other) is not type(self):
+            return set(self.FIELDS)
+        return {name for name in self.FIELDS if getattr(self, name) != getattr(other, name)}
+
+    def __eq__(self, other):
+        return not self.diff(other)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self.FIELDS))
+
+class LoRaProfile(_Profile):
+    # LoRa settings for SX1262.apply(); the fields and defaults match SX1262.begin().
+    FIELDS = ('freq', 'bw', 'sf', 'cr', 'syncWord', 'power', 'currentLimit', 'preambleLength',
+              'implicit', 'implicitLen', 'crcOn', 'txIq', 'rxIq')
+    DEFAULTS = {'freq': 434.0, 'bw': 125.0, 'sf': 9, 'cr': 7, 'syncWord': SX126X_SYNC_WORD_PRIVATE,
+                'power': 14, 'currentLimit': 60.0, 'preambleLength': 8, 'implicit': False,
+                'implicitLen': 0xFF, 'crcOn': True, 'txIq': False, 'rxIq': False}
+
+class FSKProfile(_Profile):
+    # FSK settings for SX1262.apply(); the fields and defaults match SX1262.beginFSK().
+    FIELDS = ('freq', 'br', 'freqDev', 'rxBw', 'power', 'currentLimit', 'preambleLength', 'dataShaping',
+              'syncWord', 'syncBitsLength', 'addrFilter', 'addr', 'crcLength', 'crcInitial', 'crcPolynomial',
+              'crcInverted', 'whiteningOn', 'whiteningInitial', 'fixedPacketLength', 'packetLength',
+              'preambleDetectorLength')
+    DEFAULTS = {'freq': 434.0, 'br': 48.0, 'freqDev': 50.0, 'rxBw': 156.2, 'power': 14, 'currentLimit': 60.0,
+                'preambleLength': 16, 'dataShaping': 0.5, 'syncWord': [0x2D, 0x01], 'syncBitsLength': 16,
+                'addrFilter': SX126X_GFSK_ADDRESS_FILT_OFF, 'addr': 0x00, 'crcLength': 2, 'crcInitial': 0x1D0F,
+                'crcPolynomial': 0x1021, 'crcInverted': True, 'whiteningOn': True, 'whiteningInitial': 0x0100,
+                'fixedPacketLength': False, 'packetLength': 0xFF,
+                'preambleDetectorLength': SX126X_GFSK_PREAMBLE_DETECT_16}
@@ -1,18 +1,27 @@
 import time
-from machine import I2C, Pin, UART
-from decision_engine import Packetisation, DecisionEngine
+from machine import I2C, Pin, UART, RTC
+from decision_engine import Packetisation, DecisionEngine, RADIO_WIFI_LORA, RADIO_WIFI, RADIO_BLE, RADIO_LORA
+from packet_codec import PacketEncoder, PacketDecoder, FrameAggregator, DeltaEncoder, encode_ack, decode_ack, frame_seq, frame_options
+from link_manager import LinkManager, AckSender, AdrController, ListenBeforeTalk, TxPowerControl, link_margin
+from channel_plan import ChannelPlan, FrequencyHopper
+from scheduler import SensorScheduler
+from power import PowerScheduler
+from display import StatusDisplay
 from bme280 import BME280
 from sh1106 import SH1106_I2C
 from AXP2101 import *
 from micropyGPS import MicropyGPS
 import json
 from sx1262 import SX1262
+from aiosx1262 import AsyncSX1262
+from rxring import RxRing
 import asyncio
 import aioble
 import bluetooth
 import network
 import socket
 
+# Sampling periods in seconds
 # GPS packet every 2 minutes
 GPS_INTERVAL = 30  
 # BME280 packet every minute
@@ -22,6 +31,44 @@ PMU_INTERVAL = 10
 
 # Example sensor ID
 SENSOR_ID = 1  
+# Print every packet in full (builds its readable dict) instead of a one-line summary
+DEBUG_PACKETS = False
+
+# Sleep between sampling events when idle for at least this long (ms). ESP32 light sleep
+# powers the WiFi and BLE radios down too, so their connections can drop while asleep;
+# None never sleeps, keeping them up
+LIGHT_SLEEP_MIN = 100
+# Deep sleep for idle gaps at least this long (ms), which restarts the node on waking (WiFi
+# and BLE reconnect from boot); None uses light sleep only
+DEEP_SLEEP_MIN = None
+# AXP2101 interrupt line, used to wake from light sleep (GPIO40 is not an RTC pin, so it
+# cannot wake the ESP32-S3 from deep sleep)
+PMU_IRQ_PIN = 40
+# Stay awake this long (ms) before a GPS reading, as light sleep stops UART reception and
+# the GPS needs a couple of 1 s NMEA cycles to refill the buffer
+GPS_AWAKE_MS = 2500
+# Check the channel with CAD before each LoRa transmission and back off while it is busy
+LISTEN_BEFORE_TALK = True
+# LoRa receive policy: SX1262.RX_DUTY_CYCLE sleeps the receiver between listen windows
+# timed from the senders' preamble; SX1262.RX_CONTINUOUS keeps it on
+LORA_RX_POLICY = SX1262.RX_CONTINUOUS
+# Preamble (symbols) every node transmits with. Duty-cycled receivers need it long enough
+# to sleep between listen windows, so all nodes must use the same policy
+LORA_PREAMBLE = 64 if LORA_RX_POLICY == SX1262.RX_DUTY_CYCLE else 8
+# Hop LoRa transmissions over the EU868 channel plan every HOP_SLOT seconds; the radio
+# listens on the channel sequence of PEER_ID, the node it talks to. Slots come from the
+# clock, which is set from the GPS fix, and a node stays on its starting channel until it
+# has one, so only enable hopping where every node gets a GPS fix
+FREQUENCY_HOPPING = False
+HOP_SLOT = 30
+PEER_ID = 2
+# Reset the clock from GPS when it is off by more than this many seconds
+CLOCK_TOLERANCE = 2
+
+# Encodes packets into the binary wire format, numbering frames for this node and
+# sending slowly changing sensor streams as deltas against values the peer acknowledged
+packet_encoder = PacketEncoder(SENSOR_ID, DeltaEncoder(auto_ack=False))
+packet_decoder = PacketDecoder()
 
 # Constants
 # SDA pin for I2C1 (OLED)
@@ -71,6 +118,15 @@ oled = SH1106_I2C(128, 64, i2c)
 oled.fill(0)  # Clear the display at startup
 oled.show()
 
+# Display rows (8 px each); producers update these and a render task redraws what changed
+ROW_FIX = 0
+ROW_LAT = 1
+ROW_LON = 2
+ROW_PACKETS = 4
+ROW_MESSAGE_TITLE = 6
+ROW_MESSAGE = 7
+display = StatusDisplay(oled)
+
 # Pin assignments for SX1262
 cs_pin = Pin(10, Pin.OUT)  # Chip Select
 rst_pin = Pin(5, Pin.OUT)  # Reset
@@ -78,7 +134,12 @@ gpio_pin = Pin(4, Pin.IN)  # DIO1
 irq_pin = Pin(1, Pin.IN)   # IRQ pin
 
 # Create SX1262 object
-sx = SX1262(spi_bus=2, clk=12, mosi=11, miso=13, cs=cs_pin, irq=irq_pin, rst=rst_pin, gpio=gpio_pin)
+sx = AsyncSX1262(spi_bus=2, clk=12, mosi=11, miso=13, cs=cs_pin, irq=irq_pin, rst=rst_pin, gpio=gpio_pin)
+
+# Frames are copied into this ring as they arrive, so back-to-back frames are kept while
+# the receive task is still handling an earlier one
+lora_rx_ring = RxRing(slots=8)
+sx.setRxRing(lora_rx_ring)
 
 # Reset the module
 def reset_sx1262():
@@ -94,12 +155,37 @@ reset_sx1262()
 def initialise_lora():
     """Initialise LoRa communication parameters."""
     sx.begin(freq=868, bw=500.0, sf=12, cr=8, syncWord=0x12,
-             power=-5, currentLimit=60.0, preambleLength=8,
+             power=-5, currentLimit=60.0, preambleLength=LORA_PREAMBLE,
              implicit=False, implicitLen=0xFF,
              crcOn=True, txIq=False, rxIq=False,
              tcxoVoltage=1.7, useRegulatorLDO=False, blocking=True)
 
 initialise_lora()
+sx.setReceivePolicy(LORA_RX_POLICY, senderPreambleLength=LORA_PREAMBLE)
+if LORA_RX_POLICY == SX1262.RX_DUTY_CYCLE and sx.getReceivePeriods() is None:
+    print(f"LoRa duty-cycled receive inactive: senders need a preamble of {sx.getDutyCyclePreamble()} symbols")
+
+# Keeps LoRa transmissions within the EU868 sub-band duty-cycle limits, optionally
+# listening before talking
+lbt = ListenBeforeTalk(sx) if LISTEN_BEFORE_TALK else None
+hopper = FrequencyHopper(sx, ChannelPlan(slot=HOP_SLOT, bw=sx.getProfile().bw), SENSOR_ID, follow=PEER_ID, synced=False) if FREQUENCY_HOPPING else None
+# Keeps a TX power per destination, lowered while its acknowledgements report margin to
+# spare and raised again when they fall short or frames go unacknowledged
+power_control = TxPowerControl(sx)
+link_manager = LinkManager(sx, lbt=lbt, hopper=hopper, power_control=power_control)
+# Acknowledges received frames from its own task, so receiving never waits for the budget
+ack_sender = AckSender(link_manager)
+# Frames report the power they go out with, so the peer's link estimate does not depend on it
+packet_encoder.tx_power = lambda: power_control.power(PEER_ID)
+
+# Lowers the spreading factor while received and acknowledged frames show margin to spare,
+# agreeing each change with the peer through the SF carried in data frames
+adr = AdrController(sx, adjust_power=False)
+packet_encoder.link_sf = adr.proposal
+
+# Packs readings into shared LoRa frames, using the radio's time-on-air to size them and
+# holding Best Effort frames back while the duty-cycle budget is short
+frame_aggregator = FrameAggregator(packet_encoder, time_on_air=sx.getTimeOnAir, defer=link_manager.defer)
 
 class MessageClient:
     def __init__(self, device):
@@ -193,19 +279,55 @@ def shutdown_wifi(wlan):
 
 def display_received_message(msg):
     """Display the received message on the OLED."""
-    oled.fill(0)
-    oled.text("Message received:", 0, 0)
-    oled.text(f"{msg.decode()}", 0, 20)
-    oled.show()  # Ensure the display is updated
-
-def cb(events):
-    if events & SX1262.RX_DONE:
-        msg, err = sx.recv()
+    display.set(ROW_MESSAGE_TITLE, "Message received:")
+    display.set(ROW_MESSAGE, msg)
+
+async def lora_receive_task():
+    """Listen for LoRa frames whenever the radio is not transmitting, queue their acknowledgements and adapt the data rate and TX power to the peer."""
+    while True:
+        msg, err, rssi, snr = await sx.recv()
         if err:
             print(f"Error receiving message: {SX1262.STATUS[err]}")
-            return
-        print('Received message:', msg)
-        display_received_message(msg)
+            continue
+        print('Received message:', msg, 'RSSI:', rssi, 'SNR:', snr, 'Dropped:', lora_rx_ring.overflow,
+              'RX current: {:.2f} mA'.format(sx.getAverageCurrent()))
+
+        ack = decode_ack(msg)
+        if ack is not None:
+            node_id, dest_node, seq, peer_rssi, peer_snr, margin = ack
+            if dest_node == SENSOR_ID:
+                # The peer's view of our frame is the link we are transmitting over
+                tx_power = power_control.on_ack(node_id, seq, margin)
+                if node_id == PEER_ID:
+                    packet_encoder.ack(seq)
+                    await adr.confirmed(seq)
+                    if tx_power is not None:
+                        adr.observe_ack(peer_rssi, peer_snr, tx_power)
+                        await adr.update()
+            continue
+
+        try:
+            node_id, seq, packets = packet_decoder.decode(msg)
+        except (ValueError, KeyError, IndexError) as e:
+            print(f"Error decoding frame: {e}")
+            continue
+        display_received_message(f"Node {node_id}: {len(packets)} rec")
+        options, offset = frame_options(msg)
+        profile = sx.getProfile()
+        margin = link_margin(rssi, snr, profile.sf, profile.bw)
+        ack = encode_ack(SENSOR_ID, node_id, seq, rssi, snr, margin)
+        if node_id != PEER_ID:
+            ack_sender.ack(ack, node_id)
+            continue
+        # Move to the peer's proposed SF only once the frame has been acknowledged
+        follow = None
+        if 'sf' in options:
+            follow = lambda sf=options['sf']: adr.follow(sf)
+        ack_sender.ack(ack, node_id, follow)
+        adr.heard()
+        if 'tx_power' in options:
+            adr.observe(rssi, snr, options['tx_power'])
+        await adr.update()
 
 def mV_to_V(mv):
     return mv / 1000
@@ -330,6 +452,13 @@ def UPDATE_GPS(GPS_UART, GPS):
         return True
     return False
 
+# Function to convert a micropyGPS [degrees, minutes, hemisphere] coordinate to decimal degrees
+def coord_to_decimal(coord):
+    decimal = coord[0] + coord[1] / 60
+    if coord[2] in ('S', 'W'):
+        decimal = -decimal
+    return decimal
+
 # Function to get GPS data with non-sero check and display on OLED
 def GET_GPS_DATA(GPS):
     if GPS.latitude[0] != 0 and GPS.longitude[0] != 0:
@@ -342,140 +471,188 @@ def GET_GPS_DATA(GPS):
         fix_status = "Fix: None"
 
     # Display on OLED
-    oled.fill(0)
-    oled.text(fix_status, 0, 0)
-    oled.text(f"Lat: {latitude}", 0, 10)
-    oled.text(f"Lon: {longitude}", 0, 20)
-    oled.show()
+    display.set(ROW_FIX, fix_status)
+    display.set(ROW_LAT, f"Lat: {latitude}")
+    display.set(ROW_LON, f"Lon: {longitude}")
 
     return fix_status, latitude, longitude
 
-def create_and_print_bme_packets(bme280_data, engine):
-    temperature_payload = json.dumps(bme280_data['temperature']).encode()
-    pressure_payload = json.dumps(bme280_data['pressure']).encode()
-    humidity_payload = json.dumps(bme280_data['humidity']).encode()
-    temperature_packet = Packetisation(sensor_id='BME', sensor_data={'temperature': bme280_data['temperature']}, data_type='temperature', decision_engine=engine, payload=temperature_payload, qos=1)
-    pressure_packet = Packetisation(sensor_id='BME', sensor_data={'pressure': bme280_data['pressure']}, data_type='pressure', decision_engine=engine, payload=pressure_payload, qos=1)
-    humidity_packet = Packetisation(sensor_id='BME', sensor_data={'humidity': bme280_data['humidity']}, data_type='humidity', decision_engine=engine, payload=humidity_payload, qos=1)
-    print(temperature_packet.get_packet())
-    print(f"QoS: {temperature_packet.packet['header']['qos']}, Radio: {temperature_packet.packet['header']['radio']}")
-    print(pressure_packet.get_packet())
-    print(f"QoS: {pressure_packet.packet['header']['qos']}, Radio: {pressure_packet.packet['header']['radio']}")
-    print(humidity_packet.get_packet())
-    print(f"QoS: {humidity_packet.packet['header']['qos']}, Radio: {humidity_packet.packet['header']['radio']}")
+def print_packet(packet):
+    """Print a one-line summary of a packet, or the whole packet dict with DEBUG_PACKETS."""
+    if DEBUG_PACKETS:
+        print(packet.get_packet())
+        return
+    classification = packet.classification
+    print(f"{packet.sensor_id} {packet.data_type}: {packet.data_size} B, QoS: {classification.qos_name}, Radio: {classification.radio_name}")
+
+def create_and_print_gps_packet(gps_data, engine, classifications):
+    gps_packet = Packetisation(sensor_id='GPS', sensor_data=gps_data, data_type='gps', decision_engine=engine, payload=None, qos=3, classification=classifications['gps'])
+    print_packet(gps_packet)
+
+    return gps_packet
+
+def create_and_print_bme_packets(bme280_data, engine, classifications):
+    temperature_packet = Packetisation(sensor_id='BME', sensor_data={'temperature': bme280_data['temperature']}, data_type='temperature', decision_engine=engine, payload=None, qos=1, classification=classifications['temperature'])
+    pressure_packet = Packetisation(sensor_id='BME', sensor_data={'pressure': bme280_data['pressure']}, data_type='pressure', decision_engine=engine, payload=None, qos=1, classification=classifications['pressure'])
+    humidity_packet = Packetisation(sensor_id='BME', sensor_data={'humidity': bme280_data['humidity']}, data_type='humidity', decision_engine=engine, payload=None, qos=1, classification=classifications['humidity'])
+    print_packet(temperature_packet)
+    print_packet(pressure_packet)
+    print_packet(humidity_packet)
 
     return temperature_packet, pressure_packet, humidity_packet
 
-def create_and_print_pmu_packets(pmu_data, engine):
-    batt_level_payload = json.dumps(pmu_data['battery_level']).encode()
-    sys_voltage_payload = json.dumps(pmu_data['system_voltage']).encode()
-    batt_level_packet = Packetisation(sensor_id='PMU', sensor_data={'battery_level': pmu_data['battery_level']}, data_type='battery_level', decision_engine=engine, payload=batt_level_payload, qos=2)
-    sys_voltage_packet = Packetisation(sensor_id='PMU', sensor_data={'system_voltage': pmu_data['system_voltage']}, data_type='system_voltage', decision_engine=engine, payload=sys_voltage_payload, qos=2)
-    print(batt_level_packet.get_packet())
-    print(f"QoS: {batt_level_packet.packet['header']['qos']}, Radio: {batt_level_packet.packet['header']['radio']}")
-    print(sys_voltage_packet.get_packet())
-    print(f"QoS: {sys_voltage_packet.packet['header']['qos']}, Radio: {sys_voltage_packet.packet['header']['radio']}")
+def create_and_print_pmu_packets(pmu_data, engine, classifications):
+    batt_level_packet = Packetisation(sensor_id='PMU', sensor_data={'battery_level': pmu_data['battery_level']}, data_type='battery_level', decision_engine=engine, payload=None, qos=2, classification=classifications['battery_level'])
+    sys_voltage_packet = Packetisation(sensor_id='PMU', sensor_data={'system_voltage': pmu_data['system_voltage']}, data_type='system_voltage', decision_engine=engine, payload=None, qos=2, classification=classifications['system_voltage'])
+    print_packet(batt_level_packet)
+    print_packet(sys_voltage_packet)
     
     return batt_level_packet, sys_voltage_packet
 
 def send_wifi_data(packet):
     """Send data packet over Wi-Fi (HTTP request)."""
-    # Use the data in the packet (e.g., payload or message) for the request
-    message = packet['payload']  # Assuming the packet contains a 'payload' field
+    # Use the sensor readings in the packet for the request
+    message = json.dumps(packet.sensor_data).encode()
     send_http_request(SERVER_IP, PORT, message)
 
 def send_ble_data(packet):
     """Send data packet over Bluetooth Low Energy (BLE)."""
-    message = packet['payload']
+    message = packet_encoder.encode([packet])
     # Example of BLE device setup, assuming `message_client` is instantiated
     message_client = MessageClient(device=device)  # Replace with actual device
     asyncio.run(message_client.connect())
     asyncio.run(message_client.send_message(message))
     asyncio.run(message_client.disconnect())
 
-def send_lora_data(packet):
-    """Send data packet over LoRa."""
-    message = packet['payload']
-    sx.setBlockingCallback(False, cb)
-    sx.send(message)
-    print(f"Sent message over LoRa: {message}")
+async def send_lora_data(packet):
+    """Send data packet over LoRa, aggregated with other readings into binary frames."""
+    frames = frame_aggregator.add(packet)
+    if len(frames) > 1:
+        await transmit_lora_frames(frames)
+    else:
+        for frame in frames:
+            await transmit_lora_frame(frame)
+
+def record_lora_frame(frame):
+    """Note a sent frame as awaiting the peer's acknowledgement."""
+    seq = frame_seq(frame)
+    power_control.sent(PEER_ID, seq)
+    adr.sent(seq, frame_options(frame)[0].get('sf'))
+
+async def transmit_lora_frames(frames):
+    """Transmit several frames back to back, each staged in the radio while the previous one is on air."""
+    sent, err = await link_manager.send_all(frames, dest=PEER_ID)
+    for frame in frames[:sent]:
+        record_lora_frame(frame)
+    if err:
+        print(f"Error sending frames ({sent}/{len(frames)} sent): {SX1262.STATUS[err]}")
+        return
+    print(f"Sent {sent} frames over LoRa")
+
+async def transmit_lora_frame(frame):
+    """Transmit an encoded frame over LoRa once the duty-cycle budget allows it."""
+    length, err = await link_manager.send(frame, dest=PEER_ID)
+    if length:
+        record_lora_frame(frame)
+    if err:
+        print(f"Error sending frame: {SX1262.STATUS[err]}")
+        if lbt is not None:
+            print(f"Channel busy: {lbt.busy}, backoffs: {lbt.backoffs}, dropped: {lbt.dropped}")
+        return
+    print(f"Sent frame over LoRa: {frame}, TX power: {power_control.power(PEER_ID)} dBm")
 
-def send_data(packet):
+async def send_data(packet):
     """Function to send data based on the packet's radio type."""
-    packet = packet.get_packet()
-    radio_type = packet['header']['radio']
+    radio_type = packet.radio
     
-    if radio_type == "WiFi/LoRa - range dependent":
+    if radio_type == RADIO_WIFI_LORA:
         # if packet['header']['distance/rssi'] >= distance_threshold:
             # send_lora_data(packet)
         # else:
         #send_wifi_data(packet)
-        send_lora_data(packet)
-    elif radio_type == "WiFi":
+        await send_lora_data(packet)
+    elif radio_type == RADIO_WIFI:
         #send_wifi_data(packet)
-        send_lora_data(packet)
-    elif radio_type == "LoRa":
-        send_lora_data(packet)
-    elif radio_type == "BLE":
+        await send_lora_data(packet)
+    elif radio_type == RADIO_LORA:
+        await send_lora_data(packet)
+    elif radio_type == RADIO_BLE:
         #send_ble_data(packet)
-        send_lora_data(packet)
+        await send_lora_data(packet)
     else:
         print(f"Unknown radio type: {radio_type}. Data not sent.")
 
-def handle_gps_data(last_gps_time, GPS_UART, GPS, engine, oled):
-    current_time = time.time()
-    if current_time - last_gps_time >= GPS_INTERVAL:
-        gps_available = UPDATE_GPS(GPS_UART, GPS)
-        if gps_available:
-            FIX_STATUS, LATITUDE, LONGITUDE = GET_GPS_DATA(GPS)
-            if FIX_STATUS == "Fix: Valid":
-                gps_data = {
-                    'latitude': LATITUDE,
-                    'longitude': LONGITUDE
-                }
-                gps_payload = json.dumps(gps_data).encode()
-                gps_packet = Packetisation(sensor_id='GPS', sensor_data=gps_data, data_type='gps', decision_engine=engine, payload=gps_payload, qos=3)
-                # urgency, priority, traffic_type, qos, radio = engine.classify_data(gps_data, 'gps')
-                print(gps_packet.get_packet())
-                print(f"QoS: {gps_packet.packet['header']['qos']}, Radio: {gps_packet.packet['header']['radio']}")
-                oled.fill(0)
-                oled.text("GPS packet created", 0, 0)
-                oled.show()
-                return current_time, gps_packet
-        return current_time, None  # No GPS data available, return None
-    return last_gps_time, None  # No new GPS data, return last time and None
-
-def handle_bme_data(last_bme_time, bme280, engine, oled):
-    current_time = time.time()
-    if current_time - last_bme_time >= BME_INTERVAL:
-        sensor_data = bme280.read_all()
-        bme280_data = {
-            'temperature': float(f"{sensor_data['temperature']:.1f}"),
-            'pressure': float(f"{sensor_data['pressure'] * 100:.2f}"),
-            'humidity': float(f"{sensor_data['humidity']:.1f}")
-        }
-        temperature_packet, pressure_packet, humidity_packet = create_and_print_bme_packets(bme280_data, engine)
-        oled.fill(0)
-        oled.text("BME packet created", 0, 10)
-        oled.show()
-        return current_time, temperature_packet, pressure_packet, humidity_packet
-    return last_bme_time, None, None, None  # No new BME data
-
-def handle_pmu_data(last_pmu_time, PMU, engine, oled):
-    current_time = time.time()
-    if current_time - last_pmu_time >= PMU_INTERVAL:
-        batt_voltage = PMU.getBattVoltage()
-        sys_voltage = PMU.getSystemVoltage()
-        pmu_data = {
-            'battery_level': float(voltage_to_percentage(mV_to_V(batt_voltage))),
-            'system_voltage': mV_to_V(sys_voltage)
-        }
-        batt_level_packet, sys_voltage_packet = create_and_print_pmu_packets(pmu_data, engine)
-        oled.fill(0)
-        oled.text("PMU packet created", 0, 20)
-        oled.show()
-        return current_time, batt_level_packet, sys_voltage_packet
-    return last_pmu_time, None, None  # No new PMU data
+def sync_clock_from_gps(GPS):
+    """Set the RTC to the GPS fix's UTC time, so nodes agree on channel hopping slots."""
+    day, month, year = GPS.date
+    if not year:
+        return
+    hours, minutes, seconds = GPS.timestamp
+    now = (2000 + year, month, day, hours, minutes, int(seconds), 0, 0)
+    if abs(time.time() - time.mktime(now)) > CLOCK_TOLERANCE:
+        RTC().datetime((2000 + year, month, day, 0, hours, minutes, int(seconds), 0))
+    if hopper is not None and not hopper.synced:
+        hopper.synced = True
+        print("Clock set from GPS, frequency hopping started")
+
+def read_gps_data(GPS_UART, GPS):
+    gps_available = UPDATE_GPS(GPS_UART, GPS)
+    if gps_available:
+        FIX_STATUS, LATITUDE, LONGITUDE = GET_GPS_DATA(GPS)
+        if FIX_STATUS == "Fix: Valid":
+            sync_clock_from_gps(GPS)
+            # Decimal degrees, so the readings can be classified against the numeric rules
+            gps_data = {
+                'latitude': coord_to_decimal(GPS.latitude),
+                'longitude': coord_to_decimal(GPS.longitude)
+            }
+            return gps_data
+    return None  # No GPS data available
+
+def read_bme_data(bme280):
+    sensor_data = bme280.read_all()
+    bme280_data = {
+        'temperature': float(f"{sensor_data['temperature']:.1f}"),
+        'pressure': float(f"{sensor_data['pressure'] * 100:.2f}"),
+        'humidity': float(f"{sensor_data['humidity']:.1f}")
+    }
+    return bme280_data
+
+def read_pmu_data(PMU):
+    batt_voltage = PMU.getBattVoltage()
+    sys_voltage = PMU.getSystemVoltage()
+    pmu_data = {
+        'battery_level': float(voltage_to_percentage(mV_to_V(batt_voltage))),
+        'system_voltage': mV_to_V(sys_voltage)
+    }
+    return pmu_data
+
+def create_snapshot_packets(gps_data, bme280_data, pmu_data, engine):
+    """Classify every reading due this tick in one pass and packetise the results."""
+    snapshot = {}
+    if gps_data:
+        snapshot['gps'] = gps_data
+    if bme280_data:
+        snapshot.update(bme280_data)
+    if pmu_data:
+        snapshot.update(pmu_data)
+    if not snapshot:
+        return []
+
+    classifications = engine.classify_batch(snapshot)
+    packets = []
+    created = []
+    if gps_data:
+        packets.append(create_and_print_gps_packet(gps_data, engine, classifications))
+        created.append("GPS")
+    if bme280_data:
+        packets.extend(create_and_print_bme_packets(bme280_data, engine, classifications))
+        created.append("BME")
+    if pmu_data:
+        packets.extend(create_and_print_pmu_packets(pmu_data, engine, classifications))
+        created.append("PMU")
+    display.set(ROW_PACKETS, "Pkt: " + " ".join(created))
+    return packets
 
 async def main():
     # Initialise GPS
@@ -508,32 +685,57 @@ async def main():
     # Initialise decision engine
     engine = DecisionEngine()
 
-    # Variables to track the last time each packet was created
-    last_gps_time = time.time()
-    last_bme_time = time.time()
-    last_pmu_time = time.time()
-
+    # Run each sensor as its own task, handing packets to the engine's transmit queue
+    scheduler = SensorScheduler(engine.transmit_queue)
+    scheduler.add('gps', GPS_INTERVAL * 1000, lambda: create_snapshot_packets(read_gps_data(GPS_UART, GPS), None, None, engine))
+    scheduler.add('bme', BME_INTERVAL * 1000, lambda: create_snapshot_packets(None, read_bme_data(bme280), None, engine))
+    scheduler.add('pmu', PMU_INTERVAL * 1000, lambda: create_snapshot_packets(None, None, read_pmu_data(PMU), engine))
+
+    # Sleep until the next sensor or transmission is due, waking early on LoRa DIO1 or the PMU IRQ
+    # Also wakes for LoRa sends waiting on the duty-cycle budget and for channel hops
+    wake_sources = [link_manager.until_wake]
+    if hopper is not None:
+        wake_sources.append(hopper.until_next_slot)
+    power = PowerScheduler(scheduler, engine.transmit_queue, frame_aggregator,
+                           min_sleep_ms=LIGHT_SLEEP_MIN, deep_sleep_ms=DEEP_SLEEP_MIN,
+                           persist=lambda: {'seq': packet_encoder.seq},
+                           wake_sources=wake_sources, awake_before={'gps': GPS_AWAKE_MS})
+    power.configure_wake(dio1_pin=irq_pin, pmu_irq_pin=Pin(PMU_IRQ_PIN, Pin.IN, Pin.PULL_UP))
+    delays, state = power.restore_state()
+    if state:
+        packet_encoder.seq = state['seq']
+
+    scheduler.start(delays)
+    asyncio.create_task(display.run())
+    asyncio.create_task(power.run())
+    asyncio.create_task(lora_receive_task())
+    asyncio.create_task(ack_sender.run())
+    asyncio.create_task(adr.run())
+    if hopper is not None:
+        asyncio.create_task(hopper.run())
+
+    await transmit_task(engine.transmit_queue, scheduler.transmit_event)
+
+async def transmit_task(transmit_queue, transmit_event):
+    """Send queued packets as they arrive, highest priority first."""
     while True:
-        # Call sensor handlers and update last_*_time variables
-        last_gps_time, gps_packet = handle_gps_data(last_gps_time, GPS_UART, GPS, engine, oled)
-        last_bme_time, temperature_packet, pressure_packet, humidity_packet = handle_bme_data(last_bme_time, bme280, engine, oled)
-        last_pmu_time, batt_level_packet, sys_voltage_packet = handle_pmu_data(last_pmu_time, PMU, engine, oled)
-
-        # Example of sending data from the created packets if they exist
-        if gps_packet:
-            send_data(gps_packet)
-        if temperature_packet:
-            send_data(temperature_packet)
-        if pressure_packet:
-            send_data(pressure_packet)
-        if humidity_packet:
-            send_data(humidity_packet)
-        if batt_level_packet:
-            send_data(batt_level_packet)
-        if sys_voltage_packet:
-            send_data(sys_voltage_packet)
-
-        # Sleep to avoid busy-waiting
-        time.sleep(1)
+        transmit_event.clear()
+
+        while transmit_queue:
+            await send_data(transmit_queue.pop())
+
+        # Send any aggregated LoRa frame whose hold time has expired
+        for frame in frame_aggregator.poll():
+            await transmit_lora_frame(frame)
+
+        # Wait for new packets, or until the aggregator's pending frame is due
+        deadline = frame_aggregator.next_deadline()
+        if deadline is None:
+            await transmit_event.wait()
+        else:
+            try:
+                await asyncio.wait_for(transmit_event.wait(), max(0, deadline - time.time()))
+            except asyncio.TimeoutError:
+                pass
 
 asyncio.run(main())
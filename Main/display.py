@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+class StatusDisplay:
+    # Display model for the SH1106 OLED. Producers only update text rows, one per 8 px
+    # page, which is cheap and safe to call from the LoRa callback. A single render task
+    # redraws the rows that changed at no more than max_fps, so several updates between
+    # frames cost one push, and only the changed pages go over the I2C bus shared with the
+    # BME280 (the driver tracks dirty pages and show() writes just those).
+    def __init__(self, oled, max_fps=4):
+        self.oled = oled
+        self.rows = oled.height // 8
+        self.columns = oled.width // 8
+        self.frame_ms = 1000 // max_fps
+        self.lines = [''] * self.rows
+        self.dirty = 0
+        self.frames = 0
+        self._flag = asyncio.ThreadSafeFlag()
+
+    def set(self, row, text=''):
+        # Set the text of one row; the row is only redrawn if the text changed.
+        text = text[:self.columns]
+        if self.lines[row] != text:
+            self.lines[row] = text
+            self.dirty |= 1 << row
+            self._flag.set()
+
+    def clear(self, first=0, last=None):
+        # Blank rows first..last (inclusive), by default the whole screen.
+        if last is None:
+            last = self.rows - 1
+        for row in range(first, last + 1):
+            self.set(row)
+
+    def render(self):
+        # Redraw the changed rows and push only their pages to the display.
+        dirty, self.dirty = self.dirty, 0
+        if not dirty:
+            return
+        oled = self.oled
+        for row in range(self.rows):
+            if dirty & (1 << row):
+                y = row * 8
+                oled.fill_rect(0, y, oled.width, 8, 0)
+                oled.text(self.lines[row], 0, y)
+        oled.show()
+        self.frames += 1
+
+    async def run(self):
+        # Render task: wait for a change, draw it, then hold off until the next frame slot.
+        while True:
+            await self._flag.wait()
+            started = time.ticks_ms()
+            self.render()
+            elapsed = time.ticks_diff(time.ticks_ms(), started)
+            if elapsed < self.frame_ms:
+                await asyncio.sleep_ms(self.frame_ms - elapsed)
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import time
+
+try:
+    from time import ticks_ms, ticks_diff
+except ImportError:
+    # CPython has no ticks functions; lets the policy run on a host with a fake machine module
+    def ticks_ms():
+        return int(time.monotonic() * 1000) & 0x3FFFFFFF
+
+    def ticks_diff(end, start):
+        return ((end - start + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+class PowerScheduler:
+    # Puts the node to sleep until the next due event instead of idling with the CPU and
+    # radios powered. The next event is the earliest of the sensor deadlines in the
+    # SensorScheduler and the hold deadline of the frame aggregator; nothing sleeps while
+    # packets are waiting in the transmit queue.
+    # Idle gaps of at least min_sleep_ms use machine.lightsleep, which keeps RAM and the
+    # asyncio tasks intact but powers WiFi and BLE down; min_sleep_ms None never sleeps.
+    # If deep_sleep_ms is set and nothing is pending, gaps of at least that long use
+    # machine.deepsleep instead, after saving the sensor deadlines to RTC
+    # memory so the next boot can resume the schedule with restore_state(); persist() may
+    # return a small dict of extra state (e.g. frame sequence numbers) to save with them.
+    # wake_sources are callables returning the seconds until another task needs the CPU
+    # (e.g. LinkManager.until_wake, FrequencyHopper.until_next_slot), or None.
+    # awake_before maps sensor names to ms to stay awake ahead of their deadline: light
+    # sleep stops UART reception, so a GPS needs a couple of NMEA cycles of wake time
+    # before its reading is parsed.
+    # The machine and esp32 modules and the ms clock can be replaced, so the policy can be
+    # exercised on Linux with a fake clock.
+    def __init__(self, scheduler, transmit_queue=None, aggregator=None, min_sleep_ms=100,
+                 deep_sleep_ms=None, wake_margin_ms=5, persist=None, machine_module=None,
+                 esp32_module=None, clock=ticks_ms, wall_clock=time.time, wake_sources=(),
+                 awake_before=None):
+        if machine_module is None:
+            import machine as machine_module
+        self.machine = machine_module
+        self.esp32 = esp32_module
+        self.scheduler = scheduler
+        self.transmit_queue = transmit_queue
+        self.aggregator = aggregator
+        self.min_sleep_ms = min_sleep_ms
+        self.deep_sleep_ms = deep_sleep_ms
+        self.wake_margin_ms = wake_margin_ms
+        self.persist = persist
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self.wake_sources = wake_sources
+        self.awake_before = awake_before or {}
+        self.light_sleeps = 0
+        self.slept_ms = 0
+
+    def configure_wake(self, dio1_pin=None, pmu_irq_pin=None):
+        # Wake from sleep on SX1262 DIO1 (active high) and on the PMU IRQ line (active low).
+        # Only RTC GPIOs (0-21 on the ESP32-S3) can wake from deep sleep; a PMU line on any
+        # other pin only wakes from light sleep, through the GPIO wakeup.
+        esp32 = self.esp32
+        if esp32 is None:
+            import esp32
+            self.esp32 = esp32
+        if pmu_irq_pin is not None:
+            try:
+                esp32.wake_on_ext0(pin=pmu_irq_pin, level=esp32.WAKEUP_ALL_LOW)
+            except ValueError:
+                pmu_irq_pin.irq(handler=None, trigger=pmu_irq_pin.WAKE_LOW, wake=self.machine.SLEEP)
+        if dio1_pin is not None:
+            esp32.wake_on_ext1(pins=(dio1_pin,), level=esp32.WAKEUP_ANY_HIGH)
+
+    def idle_ms(self):
+        # Milliseconds until the next due event, 0 if work is pending, None if nothing is scheduled.
+        if self.transmit_queue:
+            return 0
+        idle = None
+        now = self._clock()
+        for task in self.scheduler.tasks:
+            if task.next_due is not None:
+                due_ms = max(0, ticks_diff(task.next_due, now) - self.awake_before.get(task.name, 0))
+                if idle is None or due_ms < idle:
+                    idle = due_ms
+        if self.aggregator is not None:
+            hold_deadline = self.aggregator.next_deadline()
+            if hold_deadline is not None:
+                hold_ms = max(0, int((hold_deadline - self._wall_clock()) * 1000))
+                if idle is None or hold_ms < idle:
+                    idle = hold_ms
+        for source in self.wake_sources:
+            wait = source()
+            if wait is not None:
+                wait_ms = max(0, int(wait * 1000))
+                if idle is None or wait_ms < idle:
+                    idle = wait_ms
+        return idle
+
+    def step(self):
+        # Sleep through the current idle gap if it is long enough. Returns the ms slept.
+        idle = self.idle_ms()
+        if idle is None or self.min_sleep_ms is None:
+            return 0
+        sleep_ms = idle - self.wake_margin_ms
+        if sleep_ms < self.min_sleep_ms:
+            return 0
+
+        if self.deep_sleep_ms is not None and sleep_ms >= self.deep_sleep_ms and not (self.aggregator and len(self.aggregator)):
+            self.save_state(sleep_ms, self.persist() if self.persist else None)
+            self.machine.deepsleep(sleep_ms)
+            return sleep_ms
+
+        self.machine.lightsleep(sleep_ms)
+        self.light_sleeps += 1
+        self.slept_ms += sleep_ms
+        return sleep_ms
+
+    async def run(self, poll_ms=1000):
+        # Idle task: sleep whenever the node is idle, otherwise let the other tasks run.
+        while True:
+            if self.step():
+                # Let the tasks that are now due run before deciding again
+                await asyncio.sleep(0)
+                continue
+            idle = self.idle_ms()
+            if idle is None or idle > poll_ms:
+                idle = poll_ms
+            await asyncio.sleep(max(idle, 1) / 1000)
+
+    def save_state(self, sleep_ms, extra=None):
+        # Store the time left to each sensor deadline after sleep_ms in RTC memory.
+        now = self._clock()
+        due = {}
+        for task in self.scheduler.tasks:
+            if task.next_due is not None:
+                due[task.name] = max(0, ticks_diff(task.next_due, now) - sleep_ms)
+        state = {'due': due}
+        if extra:
+            state['extra'] = extra
+        self.machine.RTC().memory(json.dumps(state).encode())
+
+    def restore_state(self):
+        # Returns (sensor delays, extra state) saved before deep sleep, or (None, None) after
+        # any other kind of reset.
+        if self.machine.reset_cause() != self.machine.DEEPSLEEP_RESET:
+            return None, None
+        data = self.machine.RTC().memory()
+        if not data:
+            return None, None
+        state = json.loads(data)
+        return state.get('due'), state.get('extra')
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+try:
+    from time import ticks_ms, ticks_add, ticks_diff
+except ImportError:
+    # CPython has no ticks functions; lets the scheduler run on a host
+    def ticks_ms():
+        return int(time.monotonic() * 1000) & 0x3FFFFFFF
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) & 0x3FFFFFFF
+
+    def ticks_diff(end, start):
+        return ((end - start + 0x20000000) & 0x3FFFFFFF) - 0x20000000
+
+class SensorTask:
+    # Timing state of one sensor run by SensorScheduler.
+    def __init__(self, name, period_ms, handler, deadline_ms):
+        self.name = name
+        self.period_ms = period_ms
+        self.handler = handler
+        self.deadline_ms = deadline_ms
+        self.next_due = None
+        self.runs = 0
+        self.late = 0
+        self.skipped = 0
+
+class SensorScheduler:
+    # Runs every sensor as its own coroutine with its own period, instead of polling all
+    # of them from one loop. Each coroutine sleeps until its next due time (so the event
+    # loop, including aioble, keeps running in between), calls its handler and hands the
+    # returned packets to the shared transmit queue, waking the transmit task.
+    # A run that starts more than deadline_ms after its due time is counted as late; if a
+    # sensor falls a whole period behind, the missed runs are skipped rather than bunched.
+    def __init__(self, transmit_queue):
+        self.transmit_queue = transmit_queue
+        self.transmit_event = asyncio.Event()
+        self.tasks = []
+        self.dropped = 0
+
+    def add(self, name, period_ms, handler, deadline_ms=None):
+        # Register a sensor. handler() returns a list of packets (possibly empty) or None.
+        task = SensorTask(name, period_ms, handler, deadline_ms if deadline_ms is not None else period_ms // 10)
+        self.tasks.append(task)
+        return task
+
+    def start(self, delays=None):
+        # Create one coroutine per registered sensor on the running event loop. delays maps
+        # sensor names to the ms until their first run (e.g. restored after deep sleep),
+        # otherwise each sensor first runs one period from now.
+        now = ticks_ms()
+        for task in self.tasks:
+            delay = task.period_ms
+            if delays and task.name in delays:
+                delay = delays[task.name]
+            task.next_due = ticks_add(now, delay)
+            asyncio.create_task(self._run(task))
+
+    def submit(self, packets):
+        # Queue packets for transmission and wake the transmit task.
+        for packet in packets:
+            if self.transmit_queue.push(packet) is not None:
+                self.dropped += 1
+        if packets:
+            self.transmit_event.set()
+
+    def next_deadline(self):
+        # Tick (ms) at which the next sensor is due, or None if nothing is scheduled.
+        deadline = None
+        for task in self.tasks:
+            if task.next_due is not None and (deadline is None or ticks_diff(task.next_due, deadline) < 0):
+                deadline = task.next_due
+        return deadline
+
+    async def _run(self, task):
+        while True:
+            delay = ticks_diff(task.next_due, ticks_ms())
+            if delay > 0:
+                await asyncio.sleep(delay / 1000)
+
+            now = ticks_ms()
+            if ticks_diff(now, task.next_due) > task.deadline_ms:
+                task.late += 1
+
+            packets = task.handler()
+            task.runs += 1
+            if packets:
+                self.submit(packets)
+
+            task.next_due = ticks_add(task.next_due, task.period_ms)
+            now = ticks_ms()
+            if ticks_diff(task.next_due, now) < 0:
+                task.skipped += 1
+                task.next_due = ticks_add(now, task.period_ms)
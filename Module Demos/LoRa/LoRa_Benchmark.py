@@ -0,0 +1,74 @@
+# Host-side benchmark of reading a corrupted LoRa frame with the SX1262 driver, over two
+# emulated radios on a virtual channel that corrupts every frame (crc_error=1.0, see
+# Drivers/SX1262/emulator.py). Times readData() returning ERR_CRC_MISMATCH as a state
+# against the old path, where the CRC error was raised with ASSERT() and the caller
+# looked its state back up by searching the ERROR table, on the same frames.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Drivers', 'SX1262'))
+
+import emulator
+
+# Frames read per measurement, and their payload size
+RUNS = 1000
+PAYLOAD = 32
+
+channel = emulator.VirtualChannel(crc_error=1.0, rssi=-92.0, snr=6.5, seed=1)
+emulator.SX126xEmulator(channel, spi_bus=1, cs=10, irq=1, rst=5, gpio=4, time_scale=0)
+emulator.SX126xEmulator(channel, spi_bus=2, cs=20, irq=21, rst=22, gpio=23, time_scale=0)
+emulator.install()
+
+from _sx126x import ERROR, ERR_CRC_MISMATCH, ASSERT, errorState
+from sx126x import SX126X
+from sx1262 import SX1262
+
+def create(spi_bus, cs, irq, rst, gpio):
+    radio = SX1262(spi_bus=spi_bus, clk=12, mosi=11, miso=13, cs=cs, irq=irq, rst=rst, gpio=gpio)
+    radio.begin(freq=868, bw=500.0, sf=7, cr=5, syncWord=0x12,
+                power=-5, currentLimit=60.0, preambleLength=8,
+                implicit=False, implicitLen=0xFF,
+                crcOn=True, txIq=False, rxIq=False,
+                tcxoVoltage=1.7, useRegulatorLDO=False, blocking=True)
+    return radio
+
+TX = create(1, 10, 1, 5, 4)
+RX = create(2, 20, 21, 22, 23)
+FRAME = bytes(range(PAYLOAD))
+BUFFER = memoryview(bytearray(PAYLOAD))
+
+def old_read():
+    # The read before CRC errors became states: readData() raised them through ASSERT()
+    # and the wrapper recovered the state with a list search over ERROR
+    try:
+        ASSERT(SX126X.readData(RX, BUFFER, PAYLOAD))
+        return 0
+    except AssertionError as e:
+        return list(ERROR.keys())[list(ERROR.values()).index(str(e))]
+
+def new_read():
+    try:
+        return SX126X.readData(RX, BUFFER, PAYLOAD)
+    except AssertionError as e:
+        return errorState(e)
+
+def bench(name, read):
+    # Deliver a corrupted frame to RX, then time only the read of it
+    elapsed = 0
+    for _ in range(RUNS):
+        RX.startListening()
+        TX.send(FRAME)
+        channel.update()
+        start = time.perf_counter()
+        state = read()
+        elapsed += time.perf_counter() - start
+        assert state == ERR_CRC_MISMATCH, state
+    print("{:<44} {:>8.1f} us".format(name, 1000000 * elapsed / RUNS))
+    return elapsed
+
+print("Reading", RUNS, "corrupted frames of", PAYLOAD, "bytes each.")
+old = bench("readData(): ASSERT, then ERROR list search", old_read)
+new = bench("readData(): ERR_CRC_MISMATCH returned", new_read)
+bench("SX1262.readData(): returned, RX restarted", lambda: RX.readData(BUFFER, PAYLOAD))
+print("Saved per corrupted frame: {:.1f} us ({:.1f}%)".format(1000000 * (old - new) / RUNS, 100 * (old - new) / old))
@@ -0,0 +1,64 @@
+# Host-side run of the SX1262 driver against two emulated radios on a shared virtual
+# channel (Drivers/SX1262/emulator.py): one transmits frames, the other receives them
+# through the non-blocking callback path. Prints delivery, send latency and throughput,
+# so driver changes can be compared on a PC without the board.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Drivers', 'SX1262'))
+
+import emulator
+
+# Number of frames, their payload size, and the channel's packet loss probability
+FRAMES = 50
+PAYLOAD = 32
+LOSS = 0.1
+# Scale on the time on air (0 delivers every frame instantly, to time the driver alone)
+TIME_SCALE = 1.0
+
+channel = emulator.VirtualChannel(loss=LOSS, rssi=-92.0, snr=6.5, seed=1)
+emulator.SX126xEmulator(channel, spi_bus=1, cs=10, irq=1, rst=5, gpio=4, time_scale=TIME_SCALE)
+emulator.SX126xEmulator(channel, spi_bus=2, cs=20, irq=21, rst=22, gpio=23, time_scale=TIME_SCALE)
+emulator.install()
+
+from sx1262 import SX1262
+
+def create(spi_bus, cs, irq, rst, gpio):
+    radio = SX1262(spi_bus=spi_bus, clk=12, mosi=11, miso=13, cs=cs, irq=irq, rst=rst, gpio=gpio)
+    radio.begin(freq=868, bw=500.0, sf=7, cr=5, syncWord=0x12,
+                power=-5, currentLimit=60.0, preambleLength=8,
+                implicit=False, implicitLen=0xFF,
+                crcOn=True, txIq=False, rxIq=False,
+                tcxoVoltage=1.7, useRegulatorLDO=False, blocking=True)
+    return radio
+
+TX = create(1, 10, 1, 5, 4)
+RX = create(2, 20, 21, 22, 23)
+
+received = []
+
+def cb(events):
+    if events & SX1262.RX_DONE:
+        msg, err = RX.recv()
+        received.append((msg, err))
+
+RX.setBlockingCallback(False, cb)
+
+print("Sending", FRAMES, "frames of", PAYLOAD, "bytes, loss", LOSS)
+latencies = []
+start = time.perf_counter()
+for n in range(FRAMES):
+    message = bytes([n]) * PAYLOAD
+    sent = time.perf_counter()
+    TX.send(message)
+    latencies.append(time.perf_counter() - sent)
+elapsed = time.perf_counter() - start
+
+good = sum(1 for msg, err in received if err == 0)
+print("Received: {}/{} ({} with CRC errors)".format(good, FRAMES, len(received) - good))
+print("Channel: sent {}, delivered {}, lost {}, collisions {}".format(channel.sent, channel.delivered, channel.lost, channel.collisions))
+print("Time on air per frame: {:.2f} ms".format(TX.getTimeOnAir(PAYLOAD) / 1000))
+print("Send latency: avg {:.2f} ms, max {:.2f} ms".format(1000 * sum(latencies) / FRAMES, 1000 * max(latencies)))
+print("Throughput: {:.0f} bytes/s".format(FRAMES * PAYLOAD / elapsed))
+print("SPI transactions per frame: TX {:.1f}, RX {:.1f}".format(channel.radios[0].commands / FRAMES, channel.radios[1].commands / FRAMES))
@@ -1,6 +1,7 @@
 from machine import Pin
 import time
 from sx1262 import SX1262
+from rxring import RxRing
 
 # Pin assignments for SX1262
 SPI_BUS = 2                # SPI bus
@@ -34,29 +35,41 @@ print("Receiver initialized successfully.")
 TARGET_ADDR = b'\x01'
 SOURCE_ADDR = b'\x02'  
 
+# Received frames are copied into this ring from the DIO1 interrupt and handled below
+RX_RING = RxRing(slots=8)
+LORA.setRxRing(RX_RING)
+
 # Function to handle received messages
-def cb(EVENTS):
-    if EVENTS & SX1262.RX_DONE:
-        MESSAGE, ERR = LORA.recv()
-        ERROR = SX1262.STATUS[ERR]
-        if ERROR == 'ERR_NONE':
-            # Extract the destination and source addresses
-            TARGET = MESSAGE[0:1]  # First byte is the destination address
-            SOURCE = MESSAGE[1:2]  # Second byte is the source address
-            PAYLOAD = MESSAGE[2:]  # The rest of the message is the actual payload
-
-            # Check if the message is for this node and from the expected source
-            if TARGET == TARGET_ADDR and SOURCE == SOURCE_ADDR:
-                print('Received message from source', SOURCE, ':', PAYLOAD)
-            else:
-                print('Message not for this node or from unexpected source. Ignored.')
+def handle_message(MESSAGE, ERR, RSSI, SNR):
+    ERROR = SX1262.STATUS[ERR]
+    if ERROR == 'ERR_NONE':
+        # Extract the destination and source addresses
+        TARGET = MESSAGE[0:1]  # First byte is the destination address
+        SOURCE = MESSAGE[1:2]  # Second byte is the source address
+        PAYLOAD = MESSAGE[2:]  # The rest of the message is the actual payload
 
+        # Check if the message is for this node and from the expected source
+        if TARGET == TARGET_ADDR and SOURCE == SOURCE_ADDR:
+            print('Received message from source', SOURCE, ':', PAYLOAD)
         else:
-            print('Received message with error:', ERROR)
-        print('Received message:', MESSAGE, 'with status:', ERROR)
+            print('Message not for this node or from unexpected source. Ignored.')
+
+    else:
+        print('Received message with error:', ERROR)
+    print('Received message:', MESSAGE, 'with status:', ERROR, 'RSSI:', RSSI, 'SNR:', SNR)
 
-# Set callback for receiving messages
-LORA.setBlockingCallback(False, cb)  # Use non-blocking callback
+# Receive in non-blocking mode; the driver fills RX_RING without a callback
+LORA.setBlockingCallback(False)
 
+DROPPED = 0
 while True:
-    time.sleep(1)  # Keep the loop running
+    # Drain the ring outside interrupt context
+    FRAME = RX_RING.get()
+    while FRAME:
+        MESSAGE, ERR, RSSI, SNR, TICKS = FRAME
+        handle_message(MESSAGE, ERR, RSSI, SNR)
+        FRAME = RX_RING.get()
+    if RX_RING.overflow != DROPPED:
+        DROPPED = RX_RING.overflow
+        print('Frames dropped (ring full):', DROPPED)
+    time.sleep(0.1)  # Keep the loop running
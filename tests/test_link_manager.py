@@ -0,0 +1,85 @@
+# Tests for the LoRa link manager (Decision Engine/link_manager.py) on the host, over
+# emulated radios (Drivers/SX1262/emulator.py). Run with: python -m pytest tests
+import asyncio
+import os
+import sys
+import unittest
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(root, 'Drivers', 'SX1262'))
+sys.path.insert(0, os.path.join(root, 'Decision Engine'))
+
+import emulator
+emulator.install()
+
+from _sx126x import ERR_NONE, CHANNEL_FREE, LORA_DETECTED
+from aiosx1262 import AsyncSX1262
+from link_manager import ListenBeforeTalk
+
+def create(spi_bus, cs, irq, rst, gpio, sf):
+    radio = AsyncSX1262(spi_bus=spi_bus, clk=12, mosi=11, miso=13, cs=cs, irq=irq, rst=rst, gpio=gpio)
+    radio.begin(freq=868, bw=125.0, sf=sf, cr=5, syncWord=0x12,
+                power=-5, currentLimit=60.0, preambleLength=8,
+                implicit=False, implicitLen=0xFF,
+                crcOn=True, txIq=False, rxIq=False,
+                tcxoVoltage=1.7, useRegulatorLDO=False, blocking=True)
+    return radio
+
+def pair(sf):
+    # (channel, transmitter, scanner) at sf: the transmitter's frames take their real time
+    # on air, while the scanner's CAD completes instantly.
+    emulator.reset()
+    air = emulator.VirtualChannel()
+    emulator.SX126xEmulator(air, spi_bus=1, cs=10, irq=1, rst=5, gpio=4)
+    emulator.SX126xEmulator(air, spi_bus=2, cs=20, irq=21, rst=22, gpio=23, time_scale=0)
+    return air, create(1, 10, 1, 5, 4, sf), create(2, 20, 21, 22, 23, sf)
+
+class ListenBeforeTalkTest(unittest.TestCase):
+    def run_async(self, coroutine, air):
+        async def main():
+            pump = asyncio.create_task(air.run())
+            try:
+                return await asyncio.wait_for(coroutine, 5)
+            finally:
+                pump.cancel()
+        return asyncio.run(main())
+
+    def acquire_during(self, lbt, tx, frame):
+        # lbt.acquire() while tx has frame on air, then the result of tx's send.
+        async def scan():
+            task = asyncio.create_task(tx.send(frame))
+            await asyncio.sleep(0.01)
+            state = await lbt.acquire(1000)
+            return state, await task
+        return scan()
+
+    def test_free_channel_is_acquired_at_once(self):
+        air, tx, rx = pair(7)
+        lbt = ListenBeforeTalk(rx, slot_ms=1)
+        self.assertEqual(self.run_async(lbt.acquire(1000), air), CHANNEL_FREE)
+        self.assertEqual((lbt.busy, lbt.backoffs, lbt.dropped), (0, 0, 0))
+
+    def test_busy_channel_backs_off_then_drops(self):
+        # At SF12 the frame is on air for most of a second, longer than every backoff
+        air, tx, rx = pair(12)
+        lbt = ListenBeforeTalk(rx, max_attempts=3, slot_ms=1, rand=lambda bits: (1 << bits) - 1)
+        state, sent = self.run_async(self.acquire_during(lbt, tx, b'busy'), air)
+        self.assertEqual(state, LORA_DETECTED)
+        self.assertEqual((lbt.busy, lbt.backoffs, lbt.dropped), (3, 2, 1))
+        # Windows of 2 and 4 slots after the first and second busy scan
+        self.assertEqual(lbt.backoff_ms, 2 + 4)
+        self.assertEqual(sent, (4, ERR_NONE))
+
+    def test_backoff_outlasts_a_short_frame(self):
+        # At SF9 the frame is on air for about 100 ms, and the backoff grows past it
+        air, tx, rx = pair(9)
+        lbt = ListenBeforeTalk(rx, max_attempts=8, slot_ms=20, rand=lambda bits: (1 << bits) - 1)
+        state, sent = self.run_async(self.acquire_during(lbt, tx, b'short'), air)
+        self.assertEqual(state, CHANNEL_FREE)
+        self.assertTrue(lbt.busy >= 1)
+        self.assertEqual(lbt.backoffs, lbt.busy)
+        self.assertEqual(lbt.dropped, 0)
+        self.assertEqual(lbt.backoff_ms, sum(20 << min(n, 5) for n in range(1, lbt.busy + 1)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,157 @@
+# Tests for the sleep policy (Main/power.py) on the host, with a fake machine module and
+# ms clock. Run with: python -m pytest tests
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Main'))
+
+from power import PowerScheduler
+
+class FakeRTC:
+    def __init__(self, machine):
+        self._machine = machine
+
+    def memory(self, data=None):
+        if data is None:
+            return self._machine.rtc_memory
+        self._machine.rtc_memory = bytes(data)
+
+class FakeMachine:
+    # Records the sleeps instead of sleeping; RTC memory survives like it does on the chip.
+    DEEPSLEEP_RESET = 4
+    PWRON_RESET = 1
+    SLEEP = 2
+
+    def __init__(self, cause=PWRON_RESET):
+        self.cause = cause
+        self.rtc_memory = b''
+        self.sleeps = []
+
+    def lightsleep(self, ms):
+        self.sleeps.append(('light', ms))
+
+    def deepsleep(self, ms):
+        self.sleeps.append(('deep', ms))
+
+    def RTC(self):
+        return FakeRTC(self)
+
+    def reset_cause(self):
+        return self.cause
+
+class Task:
+    def __init__(self, name, next_due):
+        self.name = name
+        self.next_due = next_due
+
+class Scheduler:
+    def __init__(self, *tasks):
+        self.tasks = list(tasks)
+
+class Aggregator:
+    # A frame held until deadline (wall clock seconds), or an empty aggregator.
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+
+    def next_deadline(self):
+        return self.deadline
+
+    def __len__(self):
+        return 0 if self.deadline is None else 1
+
+def create(*tasks, **kwargs):
+    # PowerScheduler at ms clock 1000 and wall clock 100 s over tasks, and its machine.
+    machine = kwargs.pop('machine', None) or FakeMachine()
+    power = PowerScheduler(Scheduler(*tasks), machine_module=machine, clock=lambda: 1000,
+                           wall_clock=lambda: 100.0, **kwargs)
+    return power, machine
+
+class IdleTest(unittest.TestCase):
+    def test_nothing_scheduled(self):
+        power, machine = create(Task('bme', None))
+        self.assertIsNone(power.idle_ms())
+        self.assertEqual(power.step(), 0)
+        self.assertEqual(machine.sleeps, [])
+
+    def test_earliest_deadline(self):
+        power, machine = create(Task('bme', 6000), Task('pmu', 4000))
+        self.assertEqual(power.idle_ms(), 3000)
+
+    def test_pending_transmissions_keep_it_awake(self):
+        power, machine = create(Task('bme', 6000), transmit_queue=[object()])
+        self.assertEqual(power.idle_ms(), 0)
+        self.assertEqual(power.step(), 0)
+
+    def test_awake_before_aggregator_and_wake_sources(self):
+        power, machine = create(Task('gps', 11000), awake_before={'gps': 2000})
+        self.assertEqual(power.idle_ms(), 8000)
+        power.aggregator = Aggregator(105.5)
+        self.assertEqual(power.idle_ms(), 5500)
+        power.wake_sources = (lambda: None, lambda: 1.25)
+        self.assertEqual(power.idle_ms(), 1250)
+
+    def test_overdue_task_is_due_now(self):
+        power, machine = create(Task('bme', 500))
+        self.assertEqual(power.idle_ms(), 0)
+
+class StepTest(unittest.TestCase):
+    def test_light_sleep_until_the_next_deadline(self):
+        power, machine = create(Task('bme', 3000), wake_margin_ms=5)
+        self.assertEqual(power.step(), 1995)
+        self.assertEqual(machine.sleeps, [('light', 1995)])
+        self.assertEqual((power.light_sleeps, power.slept_ms), (1, 1995))
+
+    def test_short_gaps_stay_awake(self):
+        power, machine = create(Task('bme', 1050), min_sleep_ms=100)
+        self.assertEqual(power.step(), 0)
+        self.assertEqual(machine.sleeps, [])
+
+    def test_light_sleep_disabled(self):
+        power, machine = create(Task('bme', 60000), min_sleep_ms=None)
+        self.assertEqual(power.step(), 0)
+        self.assertEqual(machine.sleeps, [])
+
+    def test_long_gaps_deep_sleep(self):
+        power, machine = create(Task('bme', 61000), wake_margin_ms=0, deep_sleep_ms=30000)
+        self.assertEqual(power.step(), 60000)
+        self.assertEqual(machine.sleeps, [('deep', 60000)])
+        self.assertEqual(power.light_sleeps, 0)
+
+    def test_gaps_below_deep_sleep_use_light_sleep(self):
+        power, machine = create(Task('bme', 21000), wake_margin_ms=0, deep_sleep_ms=30000)
+        self.assertEqual(power.step(), 20000)
+        self.assertEqual(machine.sleeps, [('light', 20000)])
+
+    def test_held_frames_prevent_deep_sleep(self):
+        # A frame held in RAM would be lost by deep sleep
+        power, machine = create(Task('bme', 61000), aggregator=Aggregator(200.0), wake_margin_ms=0,
+                                deep_sleep_ms=30000)
+        self.assertEqual(power.step(), 60000)
+        self.assertEqual(machine.sleeps, [('light', 60000)])
+
+class StateTest(unittest.TestCase):
+    def test_round_trip_through_rtc_memory(self):
+        power, machine = create(Task('gps', 61000), Task('bme', 41000), Task('pmu', None),
+                                wake_margin_ms=0, deep_sleep_ms=30000, persist=lambda: {'seq': 17})
+        self.assertEqual(power.step(), 40000)
+        self.assertEqual(machine.sleeps, [('deep', 40000)])
+
+        # The next boot, woken from deep sleep, sees the deadlines left after the sleep
+        machine.cause = FakeMachine.DEEPSLEEP_RESET
+        booted, machine = create(machine=machine)
+        delays, extra = booted.restore_state()
+        self.assertEqual(delays, {'gps': 20000, 'bme': 0})
+        self.assertEqual(extra, {'seq': 17})
+
+    def test_other_resets_start_fresh(self):
+        power, machine = create(Task('bme', 61000))
+        power.save_state(1000, {'seq': 3})
+        self.assertEqual(power.restore_state(), (None, None))
+
+    def test_empty_rtc_memory(self):
+        power, machine = create(machine=FakeMachine(FakeMachine.DEEPSLEEP_RESET))
+        self.assertEqual(power.restore_state(), (None, None))
+
+if __name__ == '__main__':
+    unittest.main()
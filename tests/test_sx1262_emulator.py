@@ -0,0 +1,123 @@
+# Regression tests for the SX1262 drivers on the host, over emulated radios sharing a
+# VirtualChannel (Drivers/SX1262/emulator.py). Run with: python -m pytest tests
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Drivers', 'SX1262'))
+
+import emulator
+emulator.install()
+
+from _sx126x import ERR_NONE, ERR_CRC_MISMATCH
+from sx1262 import SX1262
+from aiosx1262 import AsyncSX1262
+from rxring import RxRing
+
+def create(cls, spi_bus, cs, irq, rst, gpio):
+    radio = cls(spi_bus=spi_bus, clk=12, mosi=11, miso=13, cs=cs, irq=irq, rst=rst, gpio=gpio)
+    radio.begin(freq=868, bw=500.0, sf=7, cr=5, syncWord=0x12,
+                power=-5, currentLimit=60.0, preambleLength=8,
+                implicit=False, implicitLen=0xFF,
+                crcOn=True, txIq=False, rxIq=False,
+                tcxoVoltage=1.7, useRegulatorLDO=False, blocking=True)
+    return radio
+
+def pair(cls, **channel):
+    # (channel, transmitter, receiver) on a fresh channel, delivering frames instantly.
+    emulator.reset()
+    air = emulator.VirtualChannel(**channel)
+    emulator.SX126xEmulator(air, spi_bus=1, cs=10, irq=1, rst=5, gpio=4, time_scale=0)
+    emulator.SX126xEmulator(air, spi_bus=2, cs=20, irq=21, rst=22, gpio=23, time_scale=0)
+    return air, create(cls, 1, 10, 1, 5, 4), create(cls, 2, 20, 21, 22, 23)
+
+def frames(count):
+    return [bytes([n]) * (n % 20 + 1) for n in range(count)]
+
+def callback_run(count, **channel):
+    # Send count frames to a non-blocking receiver. Returns (channel, [(data, state), ...]).
+    air, tx, rx = pair(SX1262, **channel)
+    received = []
+
+    def cb(events):
+        if events & SX1262.RX_DONE:
+            received.append(rx.recv())
+
+    rx.setBlockingCallback(False, cb)
+    for frame in frames(count):
+        tx.send(frame)
+        air.update()
+    return air, received
+
+class BlockingTest(unittest.TestCase):
+    def test_delivers_every_frame_on_a_clean_channel(self):
+        air, received = callback_run(20, rssi=-92.0, snr=6.5)
+        self.assertEqual(received, [(frame, ERR_NONE) for frame in frames(20)])
+        self.assertEqual(air.delivered, 20)
+
+    def test_loss_drops_frames_and_is_reproducible(self):
+        air, received = callback_run(50, loss=0.3, seed=7)
+        self.assertEqual(len(received), air.delivered)
+        self.assertEqual(air.delivered + air.lost, 50)
+        self.assertTrue(0 < air.lost < 50)
+        self.assertEqual(callback_run(50, loss=0.3, seed=7)[1], received)
+
+    def test_crc_errors_are_returned_as_states(self):
+        air, received = callback_run(5, crc_error=1.0)
+        self.assertEqual([state for data, state in received], [ERR_CRC_MISMATCH] * 5)
+
+class AsyncTest(unittest.TestCase):
+    def run_async(self, coroutine, air):
+        async def main():
+            pump = asyncio.create_task(air.run())
+            try:
+                return await asyncio.wait_for(coroutine, 5)
+            finally:
+                pump.cancel()
+        return asyncio.run(main())
+
+    def test_send_all_streams_frames_in_order(self):
+        # Back-to-back frames need the ring: the receiver copies each one out from DIO1
+        air, tx, rx = pair(AsyncSX1262, rssi=-80.0, snr=8.0)
+        rx.setRxRing(RxRing(slots=8))
+        batch = frames(6)
+
+        async def exchange():
+            received = []
+
+            async def receive():
+                while len(received) < len(batch):
+                    received.append(await rx.recv())
+
+            task = asyncio.create_task(receive())
+            await asyncio.sleep(0.01)
+            sent = await tx.sendAll(batch)
+            await task
+            return sent, received
+
+        sent, received = self.run_async(exchange(), air)
+        self.assertEqual(sent, (len(batch), ERR_NONE))
+        self.assertEqual([data for data, state, rssi, snr in received], batch)
+        self.assertEqual(received[0][1:], (ERR_NONE, -80.0, 8.0))
+
+    def test_recv_reports_crc_errors(self):
+        air, tx, rx = pair(AsyncSX1262, crc_error=1.0)
+
+        async def exchange():
+            task = asyncio.create_task(rx.recv())
+            await asyncio.sleep(0.01)
+            await tx.send(b'corrupted')
+            return await task
+
+        data, state, rssi, snr = self.run_async(exchange(), air)
+        self.assertEqual(state, ERR_CRC_MISMATCH)
+
+    def test_recv_times_out(self):
+        air, tx, rx = pair(AsyncSX1262)
+        data, state, rssi, snr = self.run_async(rx.recv(timeout_ms=20), air)
+        self.assertEqual(data, b'')
+        self.assertNotEqual(state, ERR_NONE)
+
+if __name__ == '__main__':
+    unittest.main()